@@ -1,3 +1,20 @@
 from django.contrib import admin
+from .models import Brand, Product, KeyIngredient
 
-# Register your models here.
+class KeyIngredientInline(admin.TabularInline):
+    model = KeyIngredient
+    fields = ['name']
+    extra = 1
+
+@admin.register(Brand)
+class BrandAdmin(admin.ModelAdmin):
+    list_display = ['id', 'name']
+    search_fields = ['name']
+
+@admin.register(Product)
+class ProductAdmin(admin.ModelAdmin):
+    list_display = ['id', 'name', 'brand', 'category', 'is_active', 'updated_at']
+    list_filter = ['category', 'is_active']
+    search_fields = ['name', 'brand__name']
+    list_select_related = ['brand']
+    inlines = [KeyIngredientInline]
@@ -0,0 +1,127 @@
+"""In-memory snapshot of the brand catalog for BrandMatcher.
+
+Each worker keeps one ``BrandIndex`` built from the database and polls
+``CatalogVersion`` at most every ``CATALOG_REFRESH_INTERVAL`` seconds.
+When the version moved, only products updated since the last sync are
+re-read from the database; hard deletes bump the generation instead,
+which triggers a full reload. Either way a new snapshot with a new index
+is built and swapped in, so searches in flight keep a consistent one.
+"""
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, Optional
+
+from django.conf import settings
+from django.db import DatabaseError
+from django.utils import timezone
+
+from ingredient_analysis.brand_matcher import BrandIndex
+from .models import CatalogVersion, Product
+
+DEFAULT_REFRESH_INTERVAL = 30.0
+
+# Rows committed just before a sync can carry an updated_at slightly older
+# than the sync timestamp; re-reading a small window catches them.
+SYNC_OVERLAP = timedelta(seconds=5)
+
+
+class CatalogSnapshot:
+    """A BrandIndex plus the catalog version it reflects"""
+
+    def __init__(self, version: int, generation: int, entries: Dict[int, Dict] = None):
+        self.version = version
+        self.generation = generation
+        self.synced_at: Optional[datetime] = None
+        self.checked_at = 0.0
+        # Product dicts of the active catalog, by Product pk
+        self.entries: Dict[int, Dict] = entries or {}
+        self.index = BrandIndex.from_products(self.entries.values())
+
+    def updated(self, products: Iterable[Product], version: int) -> 'CatalogSnapshot':
+        """A new snapshot with the given products replaced and inactive ones dropped"""
+        entries = dict(self.entries)
+        for product in products:
+            if product.is_active:
+                entries[product.pk] = _as_entry(product)
+            else:
+                entries.pop(product.pk, None)
+        return CatalogSnapshot(version, self.generation, entries)
+
+
+def _as_entry(product: Product) -> Dict:
+    return {
+        'name': product.name,
+        'brand': product.brand.name,
+        'category': product.category,
+        'confidence_weight': product.confidence_weight,
+        'key_ingredients': [k.name for k in product.key_ingredients.all()],
+    }
+
+
+def _products(since: Optional[datetime] = None):
+    queryset = Product.objects.select_related('brand').prefetch_related('key_ingredients')
+    if since is None:
+        return queryset.filter(is_active=True).iterator(chunk_size=2000)
+    return queryset.filter(updated_at__gte=since - SYNC_OVERLAP)
+
+
+def refresh_interval() -> float:
+    return getattr(settings, 'CATALOG_REFRESH_INTERVAL', DEFAULT_REFRESH_INTERVAL)
+
+
+def build_snapshot() -> CatalogSnapshot:
+    """Load the whole active catalog into a fresh snapshot"""
+    version, generation = CatalogVersion.current()
+    synced_at = timezone.now()
+    snapshot = CatalogSnapshot(version, generation, {product.pk: _as_entry(product) for product in _products()})
+    snapshot.synced_at = synced_at
+    return snapshot
+
+
+def refresh_snapshot(snapshot: CatalogSnapshot) -> CatalogSnapshot:
+    """Bring a snapshot up to date; returns it unchanged or an updated replacement"""
+    version, generation = CatalogVersion.current()
+    if generation != snapshot.generation:
+        return build_snapshot()
+    if version != snapshot.version:
+        synced_at = timezone.now()
+        fresh = snapshot.updated(_products(since=snapshot.synced_at), version)
+        fresh.synced_at = synced_at
+        return fresh
+    return snapshot
+
+
+_lock = threading.Lock()
+_snapshot: Optional[CatalogSnapshot] = None
+
+
+def get_catalog_snapshot() -> Optional[CatalogSnapshot]:
+    """Return this process's catalog snapshot, refreshing it when due.
+
+    Returns None when the catalog tables can't be read (e.g. before
+    migrations have run).
+    """
+    global _snapshot
+    snapshot = _snapshot
+    if snapshot is not None and time.monotonic() - snapshot.checked_at < refresh_interval():
+        return snapshot
+
+    with _lock:
+        snapshot = _snapshot
+        if snapshot is not None and time.monotonic() - snapshot.checked_at < refresh_interval():
+            return snapshot
+        try:
+            snapshot = build_snapshot() if snapshot is None else refresh_snapshot(snapshot)
+        except DatabaseError:
+            return _snapshot
+        snapshot.checked_at = time.monotonic()
+        _snapshot = snapshot
+        return snapshot
+
+
+def reset_catalog_snapshot() -> None:
+    """Drop the cached snapshot so the next lookup reloads from the database"""
+    global _snapshot
+    with _lock:
+        _snapshot = None
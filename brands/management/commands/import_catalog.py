@@ -0,0 +1,149 @@
+import csv
+import json
+import re
+from itertools import islice
+from typing import Dict, Iterable, Iterator, List
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+
+from brands.models import Brand, CatalogVersion, KeyIngredient, Product
+from brands.signals import catalog_signals_muted
+from ingredient_analysis.category_detector import CategoryDetector
+from ingredient_analysis.normalization import normalize
+
+KEY_INGREDIENT_SEPARATOR = re.compile(r'[;|]')
+
+
+def read_csv(path: str) -> Iterator[Dict]:
+    """Rows of brand, product, category, key_ingredients (; or | separated), confidence_weight.
+
+    An empty category is filled in by the category classifier.
+    """
+    with open(path, newline='', encoding='utf-8') as f:
+        for row in csv.DictReader(f):
+            yield {
+                'brand': row['brand'],
+                'name': row.get('product') or row['name'],
+                'category': row.get('category') or '',
+                'key_ingredients': KEY_INGREDIENT_SEPARATOR.split(row.get('key_ingredients') or ''),
+                'confidence_weight': row.get('confidence_weight') or 1.0,
+            }
+
+
+def read_json(path: str) -> Iterator[Dict]:
+    """A list of products, or a {category: [products]} mapping like DEFAULT_CATALOG"""
+    with open(path, encoding='utf-8') as f:
+        data = json.load(f)
+    if isinstance(data, dict):
+        for category, products in data.items():
+            for product in products:
+                yield {'category': category, **product}
+    else:
+        yield from data
+
+
+def _chunks(rows: Iterable[Dict], size: int) -> Iterator[List[Dict]]:
+    rows = iter(rows)
+    while chunk := list(islice(rows, size)):
+        yield chunk
+
+
+class Command(BaseCommand):
+    help = "Bulk import brands, products and key ingredients from a CSV or JSON file"
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="CSV or JSON catalog file")
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument(
+            '--replace', action='store_true',
+            help="Deactivate products that are not in the file",
+        )
+
+    def handle(self, *args, **options):
+        path = options['path']
+        if path.lower().endswith('.json'):
+            rows = read_json(path)
+        elif path.lower().endswith('.csv'):
+            rows = read_csv(path)
+        else:
+            raise CommandError("Catalog file must be .csv or .json")
+
+        started = timezone.now()
+        imported = 0
+        try:
+            for chunk in _chunks(rows, options['batch_size']):
+                with transaction.atomic():
+                    self._import_chunk(chunk)
+                imported += len(chunk)
+                self.stdout.write(f"Imported {imported} products")
+        except (KeyError, ValueError) as e:
+            raise CommandError(f"Invalid catalog row after {imported} products: {e}")
+
+        deactivated = 0
+        if options['replace']:
+            deactivated = Product.objects.filter(is_active=True, updated_at__lt=started).update(
+                is_active=False, updated_at=timezone.now(),
+            )
+
+        # Bulk writes don't send signals, so announce the change once here
+        CatalogVersion.bump()
+        self.stdout.write(self.style.SUCCESS(
+            f"Imported {imported} products, deactivated {deactivated}"
+        ))
+
+    def _import_chunk(self, chunk: List[Dict]) -> None:
+        # Rows without a category are classified from their key ingredients in one batch
+        unlabeled = [row for row in chunk if not (row.get('category') or '').strip()]
+        if unlabeled:
+            results = CategoryDetector().detect_categories(
+                [row['key_ingredients'] for row in unlabeled], top_k=1,
+            )
+            for row, result in zip(unlabeled, results):
+                row['category'] = result['category']
+
+        brand_names = {row['brand'].strip() for row in chunk}
+        Brand.objects.bulk_create(
+            [Brand(name=name) for name in brand_names], ignore_conflicts=True,
+        )
+        brand_ids = dict(Brand.objects.filter(name__in=brand_names).values_list('name', 'id'))
+
+        products = {}
+        for row in chunk:
+            brand_id = brand_ids[row['brand'].strip()]
+            products[brand_id, row['name'].strip()] = Product(
+                brand_id=brand_id,
+                name=row['name'].strip(),
+                category=row['category'].strip().upper(),
+                confidence_weight=float(row.get('confidence_weight', 1.0)),
+                is_active=True,
+            )
+        Product.objects.bulk_create(
+            products.values(),
+            update_conflicts=True,
+            unique_fields=['brand', 'name'],
+            update_fields=['category', 'confidence_weight', 'is_active', 'updated_at'],
+        )
+
+        product_ids = {
+            (brand_id, name): pk
+            for pk, brand_id, name in Product.objects.filter(
+                brand_id__in=brand_ids.values(), name__in={name for _, name in products},
+            ).values_list('id', 'brand_id', 'name')
+            if (brand_id, name) in products
+        }
+        # The products were just touched and handle() bumps the version once
+        with catalog_signals_muted():
+            KeyIngredient.objects.filter(product_id__in=product_ids.values()).delete()
+
+        key_ingredients = {}
+        for row in chunk:
+            product_id = product_ids[brand_ids[row['brand'].strip()], row['name'].strip()]
+            for name in row['key_ingredients']:
+                if name and name.strip():
+                    normalized = normalize(name)
+                    key_ingredients[product_id, normalized] = KeyIngredient(
+                        product_id=product_id, name=name.strip(), normalized_name=normalized,
+                    )
+        KeyIngredient.objects.bulk_create(key_ingredients.values())
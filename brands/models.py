@@ -1,3 +1,69 @@
 from django.db import models
+from django.db.models import F
 
-# Create your models here.
+from ingredient_analysis.normalization import normalize
+
+
+class Brand(models.Model):
+    name = models.CharField(max_length=255, unique=True)
+    
+    def __str__(self):
+        return self.name
+
+class Product(models.Model):
+    brand = models.ForeignKey(Brand, on_delete=models.CASCADE, related_name='products')
+    name = models.CharField(max_length=255)
+    category = models.CharField(max_length=100, db_index=True)
+    confidence_weight = models.FloatField(default=1.0)
+    is_active = models.BooleanField(default=True)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+    
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['brand', 'name'], name='unique_brand_product'),
+        ]
+    
+    def __str__(self):
+        return f"{self.brand} {self.name}"
+
+class KeyIngredient(models.Model):
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='key_ingredients')
+    name = models.CharField(max_length=255)
+    normalized_name = models.CharField(max_length=255, db_index=True)
+    
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['product', 'normalized_name'], name='unique_product_key_ingredient'),
+        ]
+    
+    def save(self, *args, **kwargs):
+        self.normalized_name = normalize(self.name)
+        super().save(*args, **kwargs)
+    
+    def __str__(self):
+        return self.name
+
+class CatalogVersion(models.Model):
+    """Single-row change counter that catalog snapshots poll.
+
+    ``version`` is bumped on every change; ``generation`` only when rows
+    are hard-deleted, which incremental refreshes can't see.
+    """
+    version = models.PositiveBigIntegerField(default=0)
+    generation = models.PositiveBigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    @classmethod
+    def current(cls):
+        return cls.objects.values_list('version', 'generation').filter(pk=1).first() or (0, 0)
+    
+    @classmethod
+    def bump(cls, deleted: bool = False):
+        cls.objects.get_or_create(pk=1)
+        updates = {'version': F('version') + 1}
+        if deleted:
+            updates['generation'] = F('generation') + 1
+        cls.objects.filter(pk=1).update(**updates)
+    
+    def __str__(self):
+        return f"Catalog v{self.version}"
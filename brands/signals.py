@@ -0,0 +1,56 @@
+import threading
+from contextlib import contextmanager
+
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .models import Brand, CatalogVersion, KeyIngredient, Product
+
+_state = threading.local()
+
+
+@contextmanager
+def catalog_signals_muted():
+    """Skip the per-row catalog bumps in this thread; the caller bumps once afterwards"""
+    previous = getattr(_state, 'muted', False)
+    _state.muted = True
+    try:
+        yield
+    finally:
+        _state.muted = previous
+
+
+def _muted() -> bool:
+    return getattr(_state, 'muted', False)
+
+
+@receiver(post_save, sender=Product)
+def product_saved(sender, **kwargs):
+    if not _muted():
+        CatalogVersion.bump()
+
+
+@receiver(post_save, sender=Brand)
+def brand_saved(sender, instance, **kwargs):
+    if _muted():
+        return
+    # Touch the products so incremental snapshot refreshes pick them up
+    Product.objects.filter(brand=instance).update(updated_at=timezone.now())
+    CatalogVersion.bump()
+
+
+@receiver(post_save, sender=KeyIngredient)
+@receiver(post_delete, sender=KeyIngredient)
+def key_ingredient_changed(sender, instance, **kwargs):
+    if _muted():
+        return
+    Product.objects.filter(pk=instance.product_id).update(updated_at=timezone.now())
+    CatalogVersion.bump()
+
+
+@receiver(post_delete, sender=Brand)
+@receiver(post_delete, sender=Product)
+def catalog_deleted(sender, **kwargs):
+    if not _muted():
+        CatalogVersion.bump(deleted=True)
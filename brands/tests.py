@@ -1,3 +1,102 @@
+import json
+import os
+import tempfile
+from io import StringIO
+
+from django.core.management import call_command
 from django.test import TestCase
 
-# Create your tests here.
+from .catalog import build_snapshot, refresh_snapshot
+from .models import Brand, CatalogVersion, KeyIngredient, Product
+
+
+def names(snapshot, detected):
+    return [product['name'] for _, product in snapshot.index.search(detected)]
+
+
+class CatalogSnapshotTests(TestCase):
+    def setUp(self):
+        self.colgate = Brand.objects.create(name='Colgate')
+        self.total = self.add_product('Total 12', ['Sodium Fluoride', 'Hydrated Silica'])
+
+    def add_product(self, name, key_ingredients, brand=None):
+        product = Product.objects.create(brand=brand or self.colgate, name=name, category='TOOTHPASTE')
+        for key_ingredient in key_ingredients:
+            KeyIngredient.objects.create(product=product, name=key_ingredient)
+        return product
+
+    def test_unchanged_catalog_keeps_the_snapshot(self):
+        snapshot = build_snapshot()
+        self.assertIs(refresh_snapshot(snapshot), snapshot)
+
+    def test_changes_swap_in_a_new_index(self):
+        snapshot = build_snapshot()
+        self.add_product('Optic White', ['Hydrogen Peroxide'])
+
+        fresh = refresh_snapshot(snapshot)
+        self.assertIsNot(fresh, snapshot)
+        self.assertGreater(fresh.version, snapshot.version)
+        self.assertEqual(names(fresh, ['hydrogen peroxide']), ['Optic White'])
+        # Searches holding the old snapshot still see the catalog it was built from
+        self.assertEqual(names(snapshot, ['hydrogen peroxide']), [])
+
+    def test_deactivated_products_are_dropped(self):
+        snapshot = build_snapshot()
+        self.total.is_active = False
+        self.total.save()
+        self.assertEqual(names(refresh_snapshot(snapshot), ['sodium fluoride']), [])
+
+    def test_brand_renames_reach_their_products(self):
+        snapshot = build_snapshot()
+        self.colgate.name = 'Colgate-Palmolive'
+        self.colgate.save()
+        [(_, product)] = refresh_snapshot(snapshot).index.search(['sodium fluoride'])
+        self.assertEqual(product['brand'], 'Colgate-Palmolive')
+
+    def test_hard_deletes_trigger_a_full_reload(self):
+        self.add_product('Optic White', ['Hydrogen Peroxide'])
+        snapshot = build_snapshot()
+        self.total.delete()
+
+        fresh = refresh_snapshot(snapshot)
+        self.assertGreater(fresh.generation, snapshot.generation)
+        self.assertEqual(names(fresh, ['sodium fluoride']), [])
+        self.assertEqual(names(fresh, ['hydrogen peroxide']), ['Optic White'])
+
+
+class ImportCatalogTests(TestCase):
+    def import_catalog(self, products, *args):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'catalog.json')
+            with open(path, 'w', encoding='utf-8') as fh:
+                json.dump(products, fh)
+            call_command('import_catalog', path, *args, stdout=StringIO())
+
+    def test_import_upserts_products_and_bumps_the_version_once(self):
+        self.import_catalog({'TOOTHPASTE': [
+            {'brand': 'Crest', 'name': 'Pro-Health', 'key_ingredients': ['Stannous Fluoride']},
+        ]})
+        version, _ = CatalogVersion.current()
+        self.import_catalog({'TOOTHPASTE': [
+            {'brand': 'Crest', 'name': 'Pro-Health', 'key_ingredients': ['Stannous Fluoride', 'Zinc']},
+            {'brand': 'Sensodyne', 'name': 'Repair', 'key_ingredients': ['Potassium Nitrate']},
+        ]})
+
+        self.assertEqual(CatalogVersion.current()[0], version + 1)
+        self.assertEqual(Product.objects.count(), 2)
+        self.assertEqual(
+            sorted(KeyIngredient.objects.filter(product__name='Pro-Health').values_list('name', flat=True)),
+            ['Stannous Fluoride', 'Zinc'],
+        )
+
+    def test_replace_deactivates_products_missing_from_the_file(self):
+        self.import_catalog([{'brand': 'Crest', 'name': 'Pro-Health', 'category': 'toothpaste',
+                              'key_ingredients': ['Stannous Fluoride']}])
+        snapshot = build_snapshot()
+        self.import_catalog([{'brand': 'Sensodyne', 'name': 'Repair', 'category': 'toothpaste',
+                              'key_ingredients': ['Potassium Nitrate']}], '--replace')
+
+        self.assertFalse(Product.objects.get(name='Pro-Health').is_active)
+        fresh = refresh_snapshot(snapshot)
+        self.assertEqual(names(fresh, ['stannous fluoride']), [])
+        self.assertEqual(names(fresh, ['potassium nitrate']), ['Repair'])
@@ -3,5 +3,4 @@ from . import views
 
 urlpatterns = [
     path('', views.home, name='home'),
-    path('api/analyze/', views.analyze, name='analyze'),
 ]
@@ -1,3 +1,133 @@
-from django.test import TestCase
+import hashlib
+import io
+import json
+import os
+import tempfile
+from unittest import mock
 
-# Create your tests here.
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import TestCase, override_settings
+from PIL import Image
+
+from ingredient_analysis.models import AnalysisResult
+from ocr.models import OCRResult, UploadedImage
+
+
+class AnalysisHistoryViewTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        for brand in ('Colgate', 'Crest', 'Sensodyne'):
+            image = UploadedImage.objects.create(status=UploadedImage.Status.DONE)
+            ocr_result = OCRResult.objects.create(image=image, raw_text=brand, processing_time=0.1)
+            AnalysisResult.objects.create(ocr_result=ocr_result, identified_brand=brand)
+
+    def test_pages_link_to_the_next_one(self):
+        response = self.client.get('/api/analyses/', {'limit': 2, 'brand': 'crest'})
+        self.assertEqual(response.json()['next'], None)
+
+        response = self.client.get('/api/analyses/', {'limit': 2})
+        payload = response.json()
+        self.assertEqual(len(payload['results']), 2)
+        self.assertIn(f"cursor={payload['next_cursor']}", payload['next'])
+        self.assertEqual(len(self.client.get(payload['next']).json()['results']), 1)
+
+    def test_unchanged_page_is_not_modified(self):
+        response = self.client.get('/api/analyses/')
+        etag = response['ETag']
+        self.assertEqual(response['Cache-Control'], 'private, no-cache')
+
+        response = self.client.get('/api/analyses/', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+
+        AnalysisResult.objects.filter(identified_brand='Crest').delete()
+        response = self.client.get('/api/analyses/', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()['results']), 2)
+
+    def test_invalid_parameters_are_rejected(self):
+        response = self.client.get('/api/analyses/', {'cursor': 'not-a-cursor'})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('error', response.json())
+
+
+class AnalyzeDedupTests(TestCase):
+    url = '/api/analyze/'
+
+    def setUp(self):
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        self.enterContext(override_settings(MEDIA_ROOT=media_root.name))
+        self.media_root = media_root.name
+
+        buffer = io.BytesIO()
+        Image.new('RGB', (32, 32), 'white').save(buffer, 'PNG')
+        self.png = buffer.getvalue()
+        self.original = UploadedImage.objects.create(
+            image='uploads/label.png', content_hash=hashlib.sha256(self.png).hexdigest(),
+            status=UploadedImage.Status.DONE,
+        )
+        ocr_result = OCRResult.objects.create(
+            image=self.original, raw_text='Ingredients: Water, Glycerin',
+            extracted_ingredients=['Water', 'Glycerin'], confidence=0.9, processing_time=0.1,
+        )
+        self.analysis = AnalysisResult.objects.create(
+            ocr_result=ocr_result, health_conditions=['Diabetes', 'Heart Disease'],
+        )
+
+    def analyze(self, conditions):
+        upload = SimpleUploadedFile('label.png', self.png, content_type='image/png')
+        return self.client.post(self.url, {'image': upload, 'conditions[]': conditions}).json()
+
+    def test_same_image_and_conditions_reuse_the_stored_analysis(self):
+        response = self.analyze(['Heart Disease', 'Diabetes'])
+        self.assertEqual(response['analysis_id'], str(self.analysis.pk))
+        self.assertEqual(response['cache'], {'ocr': 'hit', 'analysis': 'hit'})
+        self.assertEqual(UploadedImage.objects.count(), 1)
+
+    def test_same_image_with_other_conditions_reuses_the_ocr_result(self):
+        response = self.analyze(['Kidney Disease'])
+        self.assertEqual(response['cache'], {'ocr': 'hit', 'analysis': 'miss'})
+        self.assertEqual(response['ingredients'], ['Water', 'Glycerin'])
+        repeat = UploadedImage.objects.exclude(pk=self.original.pk).get()
+        self.assertEqual(repeat.status, UploadedImage.Status.DONE)
+        self.assertEqual(repeat.image.name, 'uploads/label.png')
+        self.assertFalse(os.path.exists(os.path.join(self.media_root, 'uploads')))
+
+
+class AsyncAnalyzeTests(AnalyzeDedupTests):
+    """The dedup cases again, through the async view and the async ORM"""
+    url = '/api/async/analyze/'
+
+    def post(self, data):
+        upload = SimpleUploadedFile('other.png', data, content_type='image/png')
+        return self.client.post(self.url, {'image': upload})
+
+    @override_settings(ANALYSIS_ASYNC_MAX_IN_FLIGHT=0)
+    def test_requests_over_the_in_flight_limit_are_refused(self):
+        response = self.post(self.png)
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response['Retry-After'], '1')
+        self.assertEqual(UploadedImage.objects.count(), 1)
+
+    def test_failed_analysis_marks_the_upload(self):
+        buffer = io.BytesIO()
+        Image.new('RGB', (32, 32), 'black').save(buffer, 'PNG')
+        with mock.patch('home.views.arun_analysis', side_effect=RuntimeError('OCR Error: unreadable')):
+            response = self.post(buffer.getvalue())
+        self.assertEqual(response.status_code, 500)
+        failed = UploadedImage.objects.exclude(pk=self.original.pk).get()
+        self.assertEqual((failed.status, failed.error), (UploadedImage.Status.FAILED, 'OCR Error: unreadable'))
+
+
+class AnalyzeStreamTests(AnalyzeDedupTests):
+    """The dedup cases again, reading the final event of the stream"""
+    url = '/api/analyze/stream/'
+
+    def analyze(self, conditions):
+        upload = SimpleUploadedFile('label.png', self.png, content_type='image/png')
+        response = self.client.post(self.url, {'image': upload, 'conditions[]': conditions})
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        self.assertEqual(response['X-Accel-Buffering'], 'no')
+        *_, complete = (json.loads(line) for line in b''.join(response.streaming_content).splitlines())
+        self.assertEqual(complete.pop('stage'), 'complete')
+        return complete
@@ -4,4 +4,9 @@ from . import views
 urlpatterns = [
     path('', views.home, name='home'),
     path('api/analyze/', views.analyze, name='analyze'),
+    path('api/analyze/batch/', views.analyze_batch, name='analyze_batch'),
+    path('api/analyze/stream/', views.analyze_stream, name='analyze_stream'),
+    path('api/async/analyze/', views.analyze_async, name='analyze_async'),
+    path('api/analyze/<uuid:job_id>/', views.analysis_status, name='analysis_status'),
+    path('api/analyses/', views.analysis_history, name='analysis_history'),
 ]
@@ -1,92 +1,118 @@
+import asyncio
+
+from asgiref.sync import sync_to_async
 from django.shortcuts import render
-from django.http import JsonResponse
+from django.http import JsonResponse, StreamingHttpResponse
+from django.urls import reverse
+from django.utils.cache import get_conditional_response
 from django.views.decorators.http import require_http_methods
 from django.views.decorators.csrf import csrf_exempt
 
-from ocr.models import UploadedImage, OCRResult
-from ocr.services import OCRService
+from ocr.dedup import afind_duplicate, content_digest, find_duplicate, record_cache_lookup, store_upload
+from ocr.engine import OCRQueueFull, OCRTimeout
+from ocr.models import UploadedImage
+from ocr.preprocessing import UnknownProfile, profile_name
+from ocr.uploads import UploadRejected, open_encoded, rejected_uploads
 from ingredient_analysis.models import AnalysisResult
-from ingredient_analysis.classifier import SafetyChecker
-from ingredient_analysis.brand_matcher import BrandMatcher
-from ingredient_analysis.category_detector import CategoryDetector
+from ingredient_analysis.history import HistoryError, history_page, load_page
+from ingredient_analysis.batch import BatchError, files_from_archive, max_images, run_batch
+from ingredient_analysis.jobs import QueueFull, enqueue
+from ingredient_analysis.streaming import stream_analysis, stream_cached, stream_format
+from ingredient_analysis.async_pipeline import AnalysisBusy, analysis_slot, arun_analysis
+from ingredient_analysis.pipeline import (
+    afind_cached_analysis, build_response, find_cached_analysis, run_analysis,
+)
 
 def home(request):
     """Render home page"""
     return render(request, 'index.html')
 
+def _preprocess_option(request):
+    """The request's preprocessing profile; raises UnknownProfile for a bad name"""
+    preprocess = request.POST.get('preprocess', True)
+    profile_name(preprocess)
+    return preprocess
+
+def _failure_response(error):
+    """Status-coded response for errors that are the client's or a capacity limit, else None"""
+    if isinstance(error, (UploadRejected, UnknownProfile)):
+        return JsonResponse({'error': str(error)}, status=400)
+    if isinstance(error, (OCRQueueFull, OCRTimeout)):
+        response = JsonResponse({'error': str(error)}, status=429 if isinstance(error, OCRQueueFull) else 503)
+        response['Retry-After'] = '5'
+        return response
+    return None
+
 @csrf_exempt
 @require_http_methods(["POST"])
 def analyze(request):
     """Main analysis endpoint"""
     try:
         if 'image' not in request.FILES:
+            # Uploads that failed validation while streaming never reach FILES
+            rejected = rejected_uploads(request).get('image')
+            if rejected:
+                return JsonResponse({'error': rejected[0][1]}, status=400)
             return JsonResponse({'error': 'No image provided'}, status=400)
         
         image_file = request.FILES['image']
-        if image_file.size > 10 * 1024 * 1024:
-            return JsonResponse({'error': 'File too large. Maximum 10MB.'}, status=400)
-        
-        uploaded_image = UploadedImage.objects.create(image=image_file)
+        try:
+            encoded = open_encoded(image_file)
+        except UploadRejected as e:
+            return JsonResponse({'error': str(e)}, status=400)
         
+        user_conditions = request.POST.getlist('conditions[]', [])
         try:
-            ocr_service = OCRService()
-            raw_text = ocr_service.extract_text(uploaded_image.image.path)
-            extracted_ingredients = ocr_service.extract_ingredients(raw_text)
-            
-            ocr_result = OCRResult.objects.create(
-                image=uploaded_image,
-                raw_text=raw_text if raw_text else "No text detected",
-                extracted_ingredients=extracted_ingredients if extracted_ingredients else [],
-                confidence=0.85,
-                processing_time=1.0
-            )
-            
-            safety_checker = SafetyChecker()
-            user_conditions = request.POST.getlist('conditions[]', [])
-            unsafe_raw = safety_checker.check_safety(raw_text, user_conditions)
-            
-            unsafe_ingredients = []
-            for ingredient, effect in unsafe_raw:
-                unsafe_ingredients.append({
-                    'ingredient': ingredient,
-                    'effect': effect,
-                    'definition': safety_checker.fetch_wikipedia_definition(ingredient),
-                    'safety': safety_checker._get_safety_rating(ingredient),
-                })
-            
-            brand_matcher = BrandMatcher()
-            brand_result = brand_matcher.identify_brand(extracted_ingredients)
-            
-            category_detector = CategoryDetector()
-            category_result = category_detector.detect_category(extracted_ingredients)
-            
-            analysis = AnalysisResult.objects.create(
-                ocr_result=ocr_result,
-                unsafe_ingredients=unsafe_ingredients,
-                health_conditions=user_conditions,
-                identified_brand=brand_result['brand'],
-                product_category=category_result['category'],
-                confidence_score=brand_result['confidence'],
-                recommendations="Analysis complete. Check ingredients."
-            )
+            preprocess = _preprocess_option(request)
+        except UnknownProfile as e:
+            return JsonResponse({'error': str(e)}, status=400)
+        
+        content_hash = content_digest(image_file)
+        duplicate = find_duplicate(content_hash)
+        if duplicate is not None:
+            cached = find_cached_analysis(duplicate, user_conditions)
+            if cached is not None:
+                record_cache_lookup(hit=True)
+                response = build_response(cached)
+                response['cache'] = {'ocr': 'hit', 'analysis': 'hit'}
+                return JsonResponse(response)
+        record_cache_lookup(hit=duplicate is not None)
+        
+        if request.POST.get('mode') == 'async':
+            try:
+                job = enqueue(image_file, user_conditions, duplicate, preprocess, content_hash=content_hash)
+            except QueueFull as e:
+                response = JsonResponse({'error': str(e)}, status=429)
+                response['Retry-After'] = '5'
+                return response
             
             return JsonResponse({
-                'status': 'success',
-                'analysis_id': str(analysis.id),
-                'extracted_text': raw_text,
-                'ingredients': extracted_ingredients,
-                'unsafe_ingredients': unsafe_ingredients,
-                'identified_brand': {
-                    'name': brand_result['brand'],
-                    'product_name': brand_result['product_name'],
-                    'confidence': brand_result['confidence']
-                },
-                'product_category': category_result['category'],
-                'overall_confidence': (brand_result['confidence'] + (category_result['confidence'] * 100)) / 2,
-                'recommendations': analysis.recommendations
-            })
+                'status': job.status,
+                'job_id': str(job.id),
+                'status_url': reverse('analysis_status', args=[job.id]),
+            }, status=202)
+        
+        uploaded_image = store_upload(
+            image_file,
+            duplicate,
+            health_conditions=user_conditions,
+            status=UploadedImage.Status.RUNNING,
+            content_hash=content_hash,
+        )
+        
+        try:
+            return JsonResponse(
+                run_analysis(uploaded_image, user_conditions, preprocess=preprocess, image=encoded)
+            )
         
         except Exception as inner_error:
+            UploadedImage.objects.filter(pk=uploaded_image.pk).update(
+                status=UploadedImage.Status.FAILED,
+                error=str(inner_error),
+            )
+            failure = _failure_response(inner_error)
+            if failure is not None:
+                return failure
             # Return COMPLETE sample data with all 3 categories
             return JsonResponse({
                 'status': 'success',
@@ -145,3 +171,205 @@ def analyze(request):
     
     except Exception as e:
         return JsonResponse({'error': f'Error: {str(e)}'}, status=500)
+
+@csrf_exempt
+@require_http_methods(["POST"])
+def analyze_stream(request):
+    """Analyze one image, streaming each stage's result as soon as it's ready"""
+    if 'image' not in request.FILES:
+        rejected = rejected_uploads(request).get('image')
+        if rejected:
+            return JsonResponse({'error': rejected[0][1]}, status=400)
+        return JsonResponse({'error': 'No image provided'}, status=400)
+    
+    image_file = request.FILES['image']
+    try:
+        encoded = open_encoded(image_file)
+    except UploadRejected as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    
+    user_conditions = request.POST.getlist('conditions[]', [])
+    try:
+        preprocess = _preprocess_option(request)
+    except UnknownProfile as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    content_type = stream_format(request)
+    
+    content_hash = content_digest(image_file)
+    duplicate = find_duplicate(content_hash)
+    events = None
+    if duplicate is not None:
+        cached = find_cached_analysis(duplicate, user_conditions)
+        if cached is not None:
+            response = build_response(cached)
+            response['cache'] = {'ocr': 'hit', 'analysis': 'hit'}
+            events = stream_cached(response, content_type)
+    record_cache_lookup(hit=duplicate is not None)
+    
+    if events is None:
+        uploaded_image = store_upload(
+            image_file,
+            duplicate,
+            health_conditions=user_conditions,
+            status=UploadedImage.Status.RUNNING,
+            content_hash=content_hash,
+        )
+        events = stream_analysis(
+            uploaded_image, user_conditions, preprocess, duplicate, encoded, content_type,
+        )
+    
+    response = StreamingHttpResponse(events, content_type=content_type)
+    # Keep proxies from buffering the stream until it ends
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+@csrf_exempt
+@require_http_methods(["POST"])
+async def analyze_async(request):
+    """Native async twin of ``analyze`` for ASGI servers.
+
+    OCR is awaited on a thread pool, definitions are fetched with an async
+    HTTP client and lookups use the async ORM (see
+    ingredient_analysis.async_pipeline), so one worker keeps many uploads
+    in flight. Answers 429 when the worker's in-flight limit is reached.
+    """
+    if 'image' not in request.FILES:
+        rejected = rejected_uploads(request).get('image')
+        if rejected:
+            return JsonResponse({'error': rejected[0][1]}, status=400)
+        return JsonResponse({'error': 'No image provided'}, status=400)
+    
+    image_file = request.FILES['image']
+    try:
+        encoded = open_encoded(image_file)
+    except UploadRejected as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    
+    user_conditions = request.POST.getlist('conditions[]', [])
+    try:
+        preprocess = _preprocess_option(request)
+    except UnknownProfile as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    
+    try:
+        async with analysis_slot():
+            content_hash = await asyncio.to_thread(content_digest, image_file)
+            duplicate = await afind_duplicate(content_hash)
+            if duplicate is not None:
+                cached = await afind_cached_analysis(duplicate, user_conditions)
+                if cached is not None:
+                    record_cache_lookup(hit=True)
+                    response = build_response(cached)
+                    response['cache'] = {'ocr': 'hit', 'analysis': 'hit'}
+                    return JsonResponse(response)
+            record_cache_lookup(hit=duplicate is not None)
+            
+            # Storage writes the file, so this goes through a thread too
+            uploaded_image = await sync_to_async(store_upload)(
+                image_file,
+                duplicate,
+                health_conditions=user_conditions,
+                status=UploadedImage.Status.RUNNING,
+                content_hash=content_hash,
+            )
+            try:
+                return JsonResponse(await arun_analysis(
+                    uploaded_image, user_conditions, preprocess, duplicate, encoded,
+                ))
+            except Exception as e:
+                await UploadedImage.objects.filter(pk=uploaded_image.pk).aupdate(
+                    status=UploadedImage.Status.FAILED,
+                    error=str(e),
+                )
+                failure = _failure_response(e)
+                if failure is not None:
+                    return failure
+                return JsonResponse({'error': f'Error: {str(e)}'}, status=500)
+    except AnalysisBusy as e:
+        response = JsonResponse({'error': str(e)}, status=429)
+        response['Retry-After'] = '1'
+        return response
+
+@csrf_exempt
+@require_http_methods(["POST"])
+def analyze_batch(request):
+    """Analyze many images (or a zip of images), streaming NDJSON results"""
+    limit = max_images()
+    files = request.FILES.getlist('images')
+    rejected = rejected_uploads(request).get('images', [])
+    
+    try:
+        if 'archive' in request.FILES:
+            files += files_from_archive(request.FILES['archive'], limit - len(files))
+    except BatchError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    
+    if not files:
+        if rejected:
+            return JsonResponse({'error': 'No valid images provided', 'rejected': [
+                {'filename': name, 'error': reason} for name, reason in rejected
+            ]}, status=400)
+        return JsonResponse({'error': 'No images provided'}, status=400)
+    if len(files) > limit:
+        return JsonResponse({'error': f'Too many images. Maximum {limit}.'}, status=400)
+    
+    user_conditions = request.POST.getlist('conditions[]', [])
+    try:
+        preprocess = _preprocess_option(request)
+    except UnknownProfile as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    return StreamingHttpResponse(
+        run_batch(files, user_conditions, preprocess, rejected),
+        content_type='application/x-ndjson',
+    )
+
+@require_http_methods(["GET", "HEAD"])
+def analysis_history(request):
+    """List past analyses, newest first, one keyset-paginated page at a time"""
+    try:
+        page = history_page(request.GET)
+    except HistoryError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    
+    # Answer polling clients from the page's keys alone when nothing changed
+    not_modified = get_conditional_response(request, etag=page.etag)
+    if not_modified is not None:
+        return not_modified
+    
+    next_url = None
+    if page.next_cursor:
+        params = request.GET.copy()
+        params['cursor'] = page.next_cursor
+        next_url = f"{request.path}?{params.urlencode()}"
+    
+    response = JsonResponse({
+        'results': load_page(page),
+        'next_cursor': page.next_cursor,
+        'next': next_url,
+    })
+    response['ETag'] = page.etag
+    response['Cache-Control'] = 'private, no-cache'
+    return response
+
+@require_http_methods(["GET"])
+def analysis_status(request, job_id):
+    """Report the state of an analysis job, with results once it's done"""
+    job = UploadedImage.objects.filter(pk=job_id).first()
+    if job is None:
+        return JsonResponse({'error': 'Job not found'}, status=404)
+    
+    payload = {'status': job.status, 'job_id': str(job.id)}
+    if job.status == UploadedImage.Status.DONE:
+        analysis = (
+            AnalysisResult.objects
+            .select_related('ocr_result')
+            .filter(ocr_result__image=job)
+            .first()
+        )
+        if analysis is not None:
+            payload['result'] = build_response(analysis)
+    elif job.status == UploadedImage.Status.FAILED:
+        payload['error'] = job.error
+    
+    return JsonResponse(payload)
@@ -1,8 +1,14 @@
 from django.contrib import admin
-from .models import AnalysisResult
+from .models import AnalysisResult, IngredientDefinition
 
 @admin.register(AnalysisResult)
 class AnalysisResultAdmin(admin.ModelAdmin):
     list_display = ['id', 'identified_brand', 'product_category', 'confidence_score', 'created_at']
     list_filter = ['product_category', 'created_at']
     search_fields = ['identified_brand']
+
+@admin.register(IngredientDefinition)
+class IngredientDefinitionAdmin(admin.ModelAdmin):
+    list_display = ['name', 'found', 'fetched_at']
+    list_filter = ['found']
+    search_fields = ['name']
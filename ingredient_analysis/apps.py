@@ -4,3 +4,9 @@ from django.apps import AppConfig
 class IngredientAnalysisConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'ingredient_analysis'
+
+    def ready(self):
+        # Load the harmful-ingredient knowledge base once per worker so the
+        # first request doesn't pay for parsing it.
+        from .knowledge_base import get_knowledge_base
+        get_knowledge_base()
@@ -0,0 +1,60 @@
+"""The analysis pipeline for async (ASGI) views.
+
+Nothing here blocks the event loop. ``AnalysisPipeline.arun`` awaits OCR
+on a bounded thread pool (ANALYSIS_ASYNC_OCR_THREADS) and fetches
+definitions with the fetchers' async clients. Duplicate and cache checks
+use the async ORM, and so does the definition cache. The result rows are
+written by ``save_outcome`` in a worker thread, because Django's
+``transaction.atomic`` has no async form and those rows must commit
+together.
+
+Each event loop admits at most ANALYSIS_ASYNC_MAX_IN_FLIGHT analyses;
+further requests are refused with ``AnalysisBusy`` rather than queued
+behind OCR.
+"""
+import asyncio
+import weakref
+from contextlib import asynccontextmanager
+from typing import Dict, List, Optional
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+
+from ocr.models import UploadedImage
+from ocr.uploads import EncodedImage
+from .pipeline import AnalysisPipeline, get_pipeline, save_outcome
+
+DEFAULT_MAX_IN_FLIGHT = 32
+
+_slots: 'weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, asyncio.Semaphore]' = (
+    weakref.WeakKeyDictionary()
+)
+
+
+class AnalysisBusy(Exception):
+    """Raised when ANALYSIS_ASYNC_MAX_IN_FLIGHT analyses are already running"""
+
+
+@asynccontextmanager
+async def analysis_slot():
+    """Hold one of the event loop's in-flight analysis slots, or raise AnalysisBusy"""
+    loop = asyncio.get_running_loop()
+    slots = _slots.get(loop)
+    if slots is None:
+        limit = getattr(settings, 'ANALYSIS_ASYNC_MAX_IN_FLIGHT', DEFAULT_MAX_IN_FLIGHT)
+        slots = _slots[loop] = asyncio.Semaphore(limit)
+    if slots.locked():
+        raise AnalysisBusy("Too many analyses in progress")
+    async with slots:
+        yield
+
+
+async def arun_analysis(uploaded_image: UploadedImage, user_conditions: List[str], preprocess=True,
+                        duplicate: Optional[UploadedImage] = None,
+                        image: Optional[EncodedImage] = None,
+                        pipeline: Optional[AnalysisPipeline] = None) -> Dict:
+    """``run_analysis`` for async callers; the caller passes the duplicate it already looked up"""
+    pipeline = pipeline or get_pipeline()
+    outcome = await pipeline.arun(uploaded_image, user_conditions, preprocess, duplicate, image)
+    await sync_to_async(save_outcome)(uploaded_image, outcome)
+    return outcome.response
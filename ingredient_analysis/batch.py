@@ -0,0 +1,239 @@
+"""Analyze many label images in one request.
+
+Images are hashed and stored on the request thread, analysed in
+parallel on a shared thread pool (OCR itself runs on the OCR engine's
+process pool), and each result is yielded as an NDJSON line as soon as it
+finishes. Images that finish together are written as a group, with one
+``bulk_create`` per table in a single transaction, before their lines are
+sent, so every ``analysis_id`` a client receives exists. Repeats of an image within the
+batch are analysed once and share its result. If the client goes away,
+images still in flight are abandoned and their files deleted.
+"""
+import json
+import os
+import threading
+import time
+import zipfile
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from functools import partial
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import DatabaseError, connections, transaction
+
+from ocr.dedup import content_digest, find_duplicate, record_cache_lookup
+from ocr.models import OCRResult, UploadedImage
+from ocr.storage import discard_upload_files, share_derivatives
+from ocr.uploads import UploadRejected, open_encoded
+from .models import AnalysisResult
+from .pipeline import (
+    DB_WRITE_SECONDS, AnalysisPipeline, analyze_image, build_response, find_cached_analysis, get_pipeline,
+)
+
+DEFAULT_WORKERS = 4
+DEFAULT_MAX_IMAGES = 100
+MAX_IMAGE_SIZE = 10 * 1024 * 1024
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.webp', '.bmp', '.tif', '.tiff')
+
+_executor_lock = threading.Lock()
+_executor: Optional[ThreadPoolExecutor] = None
+
+
+class BatchError(Exception):
+    """Raised for batch requests that can't be processed at all"""
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=getattr(settings, 'ANALYSIS_BATCH_WORKERS', DEFAULT_WORKERS),
+                    thread_name_prefix='batch',
+                )
+    return _executor
+
+
+def max_images() -> int:
+    return getattr(settings, 'ANALYSIS_BATCH_MAX_IMAGES', DEFAULT_MAX_IMAGES)
+
+
+def files_from_archive(archive, limit: int) -> List[ContentFile]:
+    """Extract image entries from an uploaded zip archive"""
+    try:
+        zf = zipfile.ZipFile(archive)
+    except zipfile.BadZipFile:
+        raise BatchError("Archive is not a valid zip file")
+
+    files = []
+    with zf:
+        for info in zf.infolist():
+            name = os.path.basename(info.filename)
+            if info.is_dir() or not name.lower().endswith(IMAGE_EXTENSIONS):
+                continue
+            if len(files) >= limit:
+                raise BatchError(f"Too many images. Maximum {limit}.")
+            if info.file_size > MAX_IMAGE_SIZE:
+                raise BatchError(f"{name} is too large. Maximum 10MB.")
+            files.append(ContentFile(zf.read(info), name=name))
+    return files
+
+
+def _analyze_in_thread(pipeline, uploaded_image, user_conditions, preprocess, duplicate, image):
+    try:
+        return analyze_image(uploaded_image, user_conditions, preprocess, duplicate, image, pipeline)
+    finally:
+        # Worker threads open their own connections (definition cache lookups)
+        connections.close_all()
+
+
+def _save(finished: Sequence[Tuple[UploadedImage, Optional[object]]]) -> None:
+    """Insert the upload rows of finished images and the result rows of the analysed ones"""
+    start = time.perf_counter()
+    outcomes = [outcome for _, outcome in finished if outcome is not None]
+    with transaction.atomic():
+        UploadedImage.objects.bulk_create([uploaded_image for uploaded_image, _ in finished])
+        OCRResult.objects.bulk_create([outcome.ocr_result for outcome in outcomes])
+        AnalysisResult.objects.bulk_create([outcome.analysis for outcome in outcomes])
+    DB_WRITE_SECONDS.observe(time.perf_counter() - start, path='batch')
+
+
+def _abandon(uploaded_image: UploadedImage, owns_files: bool, future) -> None:
+    if owns_files:
+        discard_upload_files(uploaded_image)
+
+
+def _line(payload) -> str:
+    return json.dumps(payload) + '\n'
+
+
+def run_batch(files, user_conditions: List[str], preprocess=True,
+              rejected: Sequence[Tuple[str, str]] = ()) -> Iterator[str]:
+    """Analyze files in parallel, yielding one NDJSON line per image and a summary line.
+
+    ``rejected`` holds ``(filename, reason)`` for uploads the upload
+    handlers refused; each gets an error line.
+    """
+    futures = {}
+    # Later copies of an image in this batch, by content hash: (index, filename)
+    repeats: Dict[str, List[Tuple[int, str]]] = {}
+    analyzed = failed = cached = 0
+    # Images already run side by side, so each one's stages run in sequence
+    pipeline = AnalysisPipeline(skip=get_pipeline().skip, concurrent=False)
+
+    for name, reason in rejected:
+        failed += 1
+        yield _line({'filename': name, 'status': 'error', 'error': reason})
+
+    for index, image_file in enumerate(files):
+        name = getattr(image_file, 'name', f'image-{index}')
+        if image_file.size > MAX_IMAGE_SIZE:
+            failed += 1
+            yield _line({'index': index, 'filename': name, 'status': 'error',
+                         'error': 'File too large. Maximum 10MB.'})
+            continue
+
+        content_hash = content_digest(image_file)
+        if content_hash in repeats:
+            repeats[content_hash].append((index, name))
+            continue
+        duplicate = find_duplicate(content_hash)
+        if duplicate is not None:
+            analysis = find_cached_analysis(duplicate, user_conditions)
+            if analysis is not None:
+                record_cache_lookup(hit=True)
+                cached += 1
+                result = build_response(analysis)
+                result['cache'] = {'ocr': 'hit', 'analysis': 'hit'}
+                yield _line({'index': index, 'filename': name, **result})
+                continue
+        record_cache_lookup(hit=duplicate is not None)
+
+        image = None
+        if duplicate is None:
+            try:
+                # Borrowed before saving: storage may move a temporary upload
+                image = open_encoded(image_file)
+            except UploadRejected as e:
+                failed += 1
+                yield _line({'index': index, 'filename': name, 'status': 'error', 'error': str(e)})
+                continue
+
+        uploaded_image = UploadedImage(
+            content_hash=content_hash,
+            health_conditions=user_conditions,
+            status=UploadedImage.Status.DONE,
+            processed=True,
+        )
+        if duplicate is not None:
+            share_derivatives(uploaded_image, duplicate)
+        else:
+            uploaded_image.image.save(name, image_file, save=False)
+
+        future = _get_executor().submit(
+            _analyze_in_thread, pipeline, uploaded_image, user_conditions, preprocess, duplicate, image,
+        )
+        futures[future] = (index, name, uploaded_image, duplicate is None)
+        repeats[content_hash] = []
+
+    unsaved = set(futures)
+    running = set(futures)
+    try:
+        while running:
+            done, running = wait(running, return_when=FIRST_COMPLETED)
+            finished = []
+            for future in sorted(done, key=lambda future: futures[future][0]):
+                uploaded_image = futures[future][2]
+                try:
+                    outcome = future.result()
+                except Exception as e:
+                    outcome = None
+                    uploaded_image.status = UploadedImage.Status.FAILED
+                    uploaded_image.processed = False
+                    uploaded_image.error = str(e)
+                finished.append((future, uploaded_image, outcome))
+
+            save_error = None
+            try:
+                _save([(uploaded_image, outcome) for _, uploaded_image, outcome in finished])
+            except DatabaseError as e:
+                save_error = {'status': 'error', 'error': f'Could not save the result: {e}'}
+            else:
+                unsaved.difference_update(future for future, _, _ in finished)
+
+            for future, uploaded_image, outcome in finished:
+                index, name = futures[future][:2]
+                if save_error is not None:
+                    outcome, result = None, save_error
+                elif outcome is not None:
+                    result = outcome.response
+                else:
+                    result = {'status': 'error', 'error': uploaded_image.error}
+
+                if outcome is not None:
+                    analyzed += 1
+                else:
+                    failed += 1
+                yield _line({'index': index, 'filename': name, **result})
+
+                for repeat_index, repeat_name in repeats[uploaded_image.content_hash]:
+                    if outcome is not None:
+                        cached += 1
+                    else:
+                        failed += 1
+                    yield _line({'index': repeat_index, 'filename': repeat_name, **result, 'duplicate_of': index})
+    finally:
+        # Client disconnected or a save failed: nothing will store these rows
+        for future in unsaved:
+            future.cancel()
+            _, _, uploaded_image, owns_files = futures[future]
+            future.add_done_callback(partial(_abandon, uploaded_image, owns_files))
+
+    yield _line({
+        'status': 'complete',
+        'analyzed': analyzed,
+        'cached': cached,
+        'failed': failed,
+    })
@@ -0,0 +1,403 @@
+"""End-to-end benchmarks on a synthetic label corpus.
+
+The corpus is generated, not collected. Ingredient lists draw on the
+names the matchers know (synonym canon, default brand catalog, category
+indicators, health-risk terms) mixed with common filler ingredients, so
+safety, brand and category matching all find hits. Label images are
+rendered from the same texts with PIL at several widths, fonts and
+noise levels. Everything is seeded, so two runs on different commits
+measure the same inputs.
+
+Each benchmark times one call per iteration after a warm-up call and
+reports latency percentiles and throughput. ``run_suite`` collects them
+into a JSON-serializable document; ``compare`` lines a run up against a
+stored baseline. See ``manage.py benchmark_analysis``.
+"""
+import io
+import os
+import platform
+import random
+import statistics
+import subprocess
+import tempfile
+import time
+from typing import Callable, Dict, Iterable, List, NamedTuple, Optional, Sequence, Tuple
+
+import django
+import numpy as np
+from django.conf import settings
+from django.utils import timezone
+from PIL import Image, ImageDraw, ImageFont
+
+from ocr.models import UploadedImage
+from ocr.services import OCRService
+from ocr.uploads import open_encoded
+from .brand_matcher import DEFAULT_CATALOG, BrandMatcher
+from .category_detector import DEFAULT_SIGNATURES, CategoryDetector
+from .classifier import SafetyChecker
+from .knowledge_base import HEALTH_RISKS
+from .normalization import SYNONYMS
+
+RESULTS_FORMAT_VERSION = 1
+
+FILLER = [
+    'water', 'aqua', 'glycerin', 'citric acid', 'sorbitol', 'xanthan gum', 'tocopherol',
+    'natural flavor', 'sunflower oil', 'cellulose gum', 'titanium dioxide', 'fragrance',
+    'sodium benzoate', 'potassium sorbate', 'menthol', 'aloe barbadensis leaf juice',
+]
+FONTS = {
+    'default': None,
+    'sans': 'DejaVuSans.ttf',
+    'sans-bold': 'DejaVuSans-Bold.ttf',
+    'mono': 'DejaVuSansMono.ttf',
+}
+DEFAULT_SIZES = (800, 1600, 3000)
+DEFAULT_NOISE = (0, 12, 30)
+DEFAULT_CONDITIONS = ['Diabetes', 'High Blood Pressure']
+SECTIONS = ('ocr', 'parse', 'safety', 'brand', 'category', 'view')
+
+
+def known_ingredients() -> List[str]:
+    """Ingredient names the matchers recognise"""
+    names = set(SYNONYMS)
+    for products in DEFAULT_CATALOG.values():
+        for product in products:
+            names.update(name.lower() for name in product['key_ingredients'])
+    for signature in DEFAULT_SIGNATURES.values():
+        names.update(name.lower() for name in signature['indicators'])
+    for terms in HEALTH_RISKS.values():
+        names.update(term.lower() for term in terms)
+    return sorted(names)
+
+
+def synthetic_ingredients(count: int, seed: int = 0) -> List[str]:
+    """About one known ingredient in three, the rest filler"""
+    rng = random.Random(seed)
+    known = known_ingredients()
+    return [rng.choice(known) if rng.random() < 0.35 else rng.choice(FILLER) for _ in range(count)]
+
+
+def label_text(ingredients: Sequence[str], seed: int = 0) -> str:
+    """A label's text as OCR would return it, with a header, percentages and a footer"""
+    rng = random.Random(seed)
+    parts = [
+        f"{name} {rng.randint(1, 30)}%" if rng.random() < 0.1 else name
+        for name in ingredients
+    ]
+    return (
+        f"Net wt {rng.randint(50, 500)}g\nIngredients: " + ', '.join(parts)
+        + ".\nStore in a cool, dry place."
+    )
+
+
+def text_corpus(sizes: Iterable[int] = (10, 30, 80), labels: int = 20) -> Dict[int, List[str]]:
+    """``labels`` label texts for each ingredient count in ``sizes``"""
+    return {
+        size: [label_text(synthetic_ingredients(size, seed), seed) for seed in range(labels)]
+        for size in sizes
+    }
+
+
+def load_font(name: str, size: int):
+    path = FONTS[name]
+    if path is not None:
+        try:
+            return ImageFont.truetype(path, size)
+        except OSError:
+            pass
+    # Pillow's bundled font scales; older Pillow falls back to its bitmap font
+    try:
+        return ImageFont.load_default(size)
+    except TypeError:
+        return ImageFont.load_default()
+
+
+def _wrap(text: str, font, width: int, draw: ImageDraw.ImageDraw) -> List[str]:
+    lines = []
+    for paragraph in text.split('\n'):
+        line = ''
+        for word in paragraph.split(' '):
+            candidate = f'{line} {word}'.strip()
+            if line and draw.textlength(candidate, font=font) > width:
+                lines.append(line)
+                line = word
+            else:
+                line = candidate
+        lines.append(line)
+    return lines
+
+
+def render_label(text: str, width: int = 1600, font: str = 'sans', noise: float = 0,
+                 seed: int = 0, image_format: str = 'PNG') -> bytes:
+    """Render label text as a photo-like image: dark text on paper, with Gaussian noise"""
+    font_size = max(12, width // 45)
+    face = load_font(font, font_size)
+    margin = width // 20
+    scratch = ImageDraw.Draw(Image.new('L', (1, 1)))
+    lines = _wrap(text, face, width - 2 * margin, scratch)
+    line_height = int(font_size * 1.4)
+
+    canvas = Image.new('L', (width, 2 * margin + line_height * len(lines)), 245)
+    draw = ImageDraw.Draw(canvas)
+    for i, line in enumerate(lines):
+        draw.text((margin, margin + i * line_height), line, fill=20, font=face)
+
+    if noise:
+        pixels = np.asarray(canvas, dtype=np.float32)
+        pixels += np.random.default_rng(seed).normal(0, noise, pixels.shape)
+        canvas = Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8))
+
+    buffer = io.BytesIO()
+    canvas.convert('RGB').save(buffer, image_format, **({'quality': 90} if image_format == 'JPEG' else {}))
+    return buffer.getvalue()
+
+
+class ImageCase(NamedTuple):
+    width: int
+    font: str
+    noise: float
+    data: bytes
+
+
+def image_corpus(sizes: Iterable[int] = DEFAULT_SIZES, fonts: Iterable[str] = ('sans',),
+                 noise_levels: Iterable[float] = DEFAULT_NOISE, ingredients: int = 25,
+                 seed: int = 0) -> List[ImageCase]:
+    """One rendered label per (width, font, noise) combination, all showing the same text"""
+    text = label_text(synthetic_ingredients(ingredients, seed), seed)
+    return [
+        ImageCase(width, font, noise, render_label(text, width, font, noise, seed))
+        for width in sizes for font in fonts for noise in noise_levels
+    ]
+
+
+def measure(name: str, func: Callable[[int], object], iterations: int, params: Dict = None,
+            warmup: int = 1, check: Callable[[object], Optional[str]] = None) -> Dict:
+    """Time ``func(i)`` for ``iterations`` calls; failed calls are counted, not timed.
+
+    ``check`` inspects each result and returns why the call failed, or
+    None when it succeeded. Warm-up calls get indices from ``iterations``
+    on, so inputs picked by index aren't seen by a timed call first.
+    """
+    for i in range(iterations, iterations + warmup):
+        try:
+            func(i)
+        except Exception:
+            pass
+
+    latencies, errors, error = [], 0, None
+    start = time.perf_counter()
+    for i in range(iterations):
+        call_start = time.perf_counter()
+        try:
+            result = func(i)
+        except Exception as e:
+            errors += 1
+            error = error or str(e)
+            continue
+        failure = check(result) if check is not None else None
+        if failure:
+            errors += 1
+            error = error or failure[:200]
+            continue
+        latencies.append((time.perf_counter() - call_start) * 1000)
+    elapsed = time.perf_counter() - start
+
+    result = {'name': name, 'params': params or {}, 'iterations': iterations, 'errors': errors}
+    if error:
+        result['error'] = error
+    if latencies:
+        ordered = sorted(latencies)
+        result.update({
+            'mean_ms': round(statistics.fmean(ordered), 4),
+            'p50_ms': round(ordered[len(ordered) // 2], 4),
+            'p95_ms': round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))], 4),
+            'min_ms': round(ordered[0], 4),
+            'max_ms': round(ordered[-1], 4),
+            'ops_per_s': round(len(latencies) / elapsed, 2),
+        })
+    return result
+
+
+def bench_ocr(cases: Sequence[ImageCase], iterations: int) -> List[Dict]:
+    service = OCRService()
+    results = []
+    for case in cases:
+        encoded = open_encoded(io.BytesIO(case.data))
+        results.append(measure(
+            'ocr.extract_text', lambda i: service.extract_text(encoded), iterations,
+            {'width': case.width, 'font': case.font, 'noise': case.noise, 'bytes': len(case.data)},
+        ))
+    return results
+
+
+def _cycle(items: Sequence, i: int):
+    return items[i % len(items)]
+
+
+def bench_text(corpus: Dict[int, List[str]], iterations: int,
+               conditions: Sequence[str] = DEFAULT_CONDITIONS,
+               sections: Iterable[str] = SECTIONS) -> List[Dict]:
+    """Parsing and matching on label texts, per ingredient count"""
+    service = OCRService()
+    checker, matcher, detector = SafetyChecker(), BrandMatcher(), CategoryDetector()
+    results = []
+    for size, texts in corpus.items():
+        parsed = [service.extract_ingredients(text) for text in texts]
+        params = {'ingredients': size, 'labels': len(texts)}
+        benches = {
+            'parse': ('ocr.extract_ingredients', lambda i: service.extract_ingredients(_cycle(texts, i))),
+            'safety': ('safety.check_safety',
+                       lambda i: checker.check_safety(_cycle(texts, i), list(conditions))),
+            'brand': ('brand.identify_brand', lambda i: matcher.identify_brand(_cycle(parsed, i))),
+            'category': ('category.detect_category', lambda i: detector.detect_category(_cycle(parsed, i))),
+        }
+        for section, (name, func) in benches.items():
+            if section in sections:
+                results.append(measure(name, func, iterations, params))
+    return results
+
+
+def _view_failure(response) -> Optional[str]:
+    """Why an /api/analyze/ call failed, or None if it produced an analysis"""
+    if response.status_code != 200:
+        return f"HTTP {response.status_code}: {response.content.decode(errors='replace')}"
+    if 'analysis_id' in response.json():
+        return None
+    # The view answers failed analyses with sample data; the real error is on the upload
+    upload = UploadedImage.objects.filter(status=UploadedImage.Status.FAILED).order_by('-uploaded_at').first()
+    reason = upload.error if upload is not None else 'unknown error'
+    return f"HTTP 200 without analysis_id (sample-data fallback): {reason}"
+
+
+def bench_view(cases: Sequence[ImageCase], iterations: int,
+               conditions: Sequence[str] = DEFAULT_CONDITIONS) -> List[Dict]:
+    """POST /api/analyze/ through the test client against a throwaway database and media root.
+
+    Every iteration uploads a different image (the case's pixels plus a
+    seeded speck), so the duplicate-image cache never answers. Definition
+    lookups are served from an empty in-memory fetcher, keeping the
+    network out of the numbers.
+    """
+    from django.core.files.uploadedfile import SimpleUploadedFile
+    from django.db import connection
+    from django.test import Client
+    from django.test.utils import override_settings
+
+    from .definitions import DefinitionCache, StaticFetcher, get_definition_cache, set_definition_cache
+
+    previous_cache = get_definition_cache()
+    old_name = connection.settings_dict['NAME']
+    set_definition_cache(DefinitionCache(StaticFetcher(), persistent=False))
+    connection.creation.create_test_db(verbosity=0, serialize=False)
+    try:
+        with tempfile.TemporaryDirectory() as media_root, override_settings(
+            MEDIA_ROOT=media_root, ALLOWED_HOSTS=['*'],
+        ):
+            client = Client()
+            results = []
+            for case in cases:
+                variants = [_speckled(case.data, seed) for seed in range(iterations + 1)]
+
+                def post(i, variants=variants):
+                    upload = SimpleUploadedFile(f'label-{i}.png', variants[i % len(variants)])
+                    return client.post('/api/analyze/', {'image': upload, 'conditions[]': list(conditions)})
+
+                results.append(measure(
+                    'view.analyze', post, iterations,
+                    {'width': case.width, 'font': case.font, 'noise': case.noise},
+                    check=_view_failure,
+                ))
+            return results
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        set_definition_cache(previous_cache)
+
+
+def _speckled(data: bytes, seed: int) -> bytes:
+    image = Image.open(io.BytesIO(data))
+    pixels = np.array(image)
+    rng = np.random.default_rng(seed)
+    pixels[rng.integers(0, pixels.shape[0]), rng.integers(0, pixels.shape[1])] = rng.integers(0, 255)
+    buffer = io.BytesIO()
+    Image.fromarray(pixels).save(buffer, 'PNG')
+    return buffer.getvalue()
+
+
+def _git_revision() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=settings.BASE_DIR,
+            capture_output=True, text=True, timeout=5, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def environment() -> Dict:
+    """What a result depends on besides the code"""
+    return {
+        'revision': _git_revision(),
+        'created_at': timezone.now().isoformat(),
+        'python': platform.python_version(),
+        'django': django.get_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'ocr_engine': getattr(settings, 'OCR_ENGINE', {}),
+        'preprocessing_profile': getattr(settings, 'OCR_PREPROCESSING_PROFILE', 'default'),
+        'detect_region': getattr(settings, 'OCR_DETECT_INGREDIENTS_REGION', True),
+    }
+
+
+def run_suite(sections: Iterable[str] = SECTIONS, iterations: int = 20,
+              image_iterations: int = 3, sizes: Sequence[int] = DEFAULT_SIZES,
+              fonts: Sequence[str] = ('sans',), noise_levels: Sequence[float] = DEFAULT_NOISE,
+              text_sizes: Sequence[int] = (10, 30, 80),
+              progress: Callable[[Dict], None] = None) -> Dict:
+    """Run the selected benchmark sections and return the results document"""
+    sections = [section for section in SECTIONS if section in set(sections)]
+    results = []
+
+    def collect(batch: List[Dict]):
+        for result in batch:
+            results.append(result)
+            if progress is not None:
+                progress(result)
+
+    text_sections = [section for section in sections if section in ('parse', 'safety', 'brand', 'category')]
+    if text_sections:
+        collect(bench_text(text_corpus(text_sizes), iterations, sections=text_sections))
+    if 'ocr' in sections or 'view' in sections:
+        cases = image_corpus(sizes, fonts, noise_levels)
+        if 'ocr' in sections:
+            collect(bench_ocr(cases, image_iterations))
+        if 'view' in sections:
+            collect(bench_view(cases, image_iterations))
+
+    return {'version': RESULTS_FORMAT_VERSION, 'environment': environment(), 'results': results}
+
+
+def result_key(result: Dict) -> Tuple:
+    return (result['name'], tuple(sorted(result['params'].items())))
+
+
+class Comparison(NamedTuple):
+    name: str
+    params: Dict
+    baseline_ms: float
+    current_ms: float
+    change: float  # relative change of the median; positive is slower
+
+
+def compare(baseline: Dict, current: Dict, metric: str = 'p50_ms') -> List[Comparison]:
+    """Median latency of every benchmark present (and successful) in both runs"""
+    previous = {result_key(result): result for result in baseline.get('results', [])}
+    comparisons = []
+    for result in current['results']:
+        before = previous.get(result_key(result))
+        if before is None or metric not in before or metric not in result or not before[metric]:
+            continue
+        comparisons.append(Comparison(
+            result['name'], result['params'], before[metric], result[metric],
+            (result[metric] - before[metric]) / before[metric],
+        ))
+    return comparisons
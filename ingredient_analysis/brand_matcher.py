@@ -1,76 +1,136 @@
-from typing import List, Dict
-from difflib import SequenceMatcher
+from typing import List, Dict, FrozenSet, Iterable, Set, Tuple
+from collections import defaultdict
+
+from .normalization import IngredientVocabulary, get_vocabulary
+
+DEFAULT_CATALOG = {
+    'TOOTHPASTE': [
+        {
+            'name': 'Colgate Total 12',
+            'brand': 'Colgate',
+            'key_ingredients': ['Sodium Fluoride', 'Hydrated Silica'],
+            'confidence_weight': 0.95
+        },
+        {
+            'name': 'Sensodyne Repair',
+            'brand': 'Sensodyne',
+            'key_ingredients': ['Potassium Nitrate', 'Sodium Fluoride'],
+            'confidence_weight': 0.96
+        },
+    ],
+    'SHAMPOO': [
+        {
+            'name': 'Pantene Pro-V',
+            'brand': 'Pantene',
+            'key_ingredients': ['Sodium Laureth Sulfate', 'Panthenol'],
+            'confidence_weight': 0.93
+        },
+    ],
+}
+
+class BrandIndex:
+    """Inverted index from canonical key-ingredient ids to catalog products.
+
+    Detected ingredients are resolved to ids through the ingredient
+    vocabulary (exact, contained or fuzzy, memoized per surface form);
+    products are scored from the postings of those ids, so cost scales
+    with the matches rather than the catalog.
+
+    An index is never changed after it is built, so threads can search it
+    freely; catalog refreshes build a new one and swap it in.
+    """
+
+    def __init__(self, catalog: Dict[str, List[Dict]], vocabulary: IngredientVocabulary = None):
+        self.vocabulary = vocabulary or get_vocabulary()
+        self.products: List[Dict] = []
+        self.product_keys: List[FrozenSet[int]] = []
+        self.postings: Dict[int, Set[int]] = {}
+
+        for category, products in catalog.items():
+            for product in products:
+                self._add({**product, 'category': category})
+
+    @classmethod
+    def from_products(cls, products: Iterable[Dict], vocabulary: IngredientVocabulary = None) -> 'BrandIndex':
+        """Index product dicts that already carry their ``category``"""
+        index = cls({}, vocabulary)
+        for product in products:
+            index._add(product)
+        return index
+
+    def __len__(self) -> int:
+        return len(self.products)
+
+    def _add(self, product: Dict) -> None:
+        keys = frozenset(
+            key_id for key_id in (self.vocabulary.add(k) for k in product['key_ingredients'] if k)
+            if key_id is not None
+        )
+        product_id = len(self.products)
+        self.product_keys.append(keys)
+        self.products.append(product)
+        for key_id in keys:
+            self.postings.setdefault(key_id, set()).add(product_id)
+
+    def match_keys(self, detected: Iterable[str]) -> Set[int]:
+        """Return canonical ids of the ingredients found in detected"""
+        return set().union(*(self.vocabulary.resolve(d) for d in detected if d))
+
+    def search(self, detected: Iterable[str], top_k: int = 5) -> List[Tuple[float, Dict]]:
+        """Top-k ``(score, product)`` pairs, score being the share of key ingredients found"""
+        hits = defaultdict(int)
+        for key_id in self.match_keys(detected):
+            for product_id in self.postings.get(key_id, ()):
+                hits[product_id] += 1
+
+        ranked = sorted(
+            ((count / len(self.product_keys[product_id]), product_id) for product_id, count in hits.items()),
+            key=lambda item: (-item[0], item[1]),
+        )
+        return [(score, self.products[product_id]) for score, product_id in ranked[:top_k]]
+
+
+_default_index = None
+
+
+def _catalog_index() -> BrandIndex:
+    """Index of the database catalog, or of DEFAULT_CATALOG while that is empty"""
+    global _default_index
+    from brands.catalog import get_catalog_snapshot
+
+    snapshot = get_catalog_snapshot()
+    if snapshot is not None and len(snapshot.index):
+        return snapshot.index
+    if _default_index is None:
+        _default_index = BrandIndex(DEFAULT_CATALOG)
+    return _default_index
+
 
 class BrandMatcher:
     """Match ingredients to brands"""
-    
-    def __init__(self):
-        self.brands_database = {
-            'TOOTHPASTE': [
-                {
-                    'name': 'Colgate Total 12',
-                    'brand': 'Colgate',
-                    'key_ingredients': ['Sodium Fluoride', 'Hydrated Silica'],
-                    'confidence_weight': 0.95
-                },
-                {
-                    'name': 'Sensodyne Repair',
-                    'brand': 'Sensodyne',
-                    'key_ingredients': ['Potassium Nitrate', 'Sodium Fluoride'],
-                    'confidence_weight': 0.96
-                },
-            ],
-            'SHAMPOO': [
-                {
-                    'name': 'Pantene Pro-V',
-                    'brand': 'Pantene',
-                    'key_ingredients': ['Sodium Laureth Sulfate', 'Panthenol'],
-                    'confidence_weight': 0.93
-                },
-            ],
-        }
-    
-    def identify_brand(self, ingredients: List[str]) -> Dict:
+
+    def __init__(self, catalog: Dict[str, List[Dict]] = None):
+        self.index = _catalog_index() if catalog is None else BrandIndex(catalog)
+
+    def identify_brand(self, ingredients: List[str], top_k: int = 5) -> Dict:
         """Match ingredients to brand"""
-        best_match = None
-        best_score = 0
-        
-        for category, products in self.brands_database.items():
-            for product in products:
-                score = self._calculate_match_score(
-                    ingredients,
-                    product['key_ingredients']
-                )
-                
-                if score > best_score:
-                    best_score = score
-                    best_match = product
-        
-        if best_match:
-            return {
-                'brand': best_match['brand'],
-                'product_name': best_match['name'],
-                'confidence': best_score * 100,
+        ranked = self.index.search(ingredients, top_k=top_k)
+        candidates = [
+            {
+                'brand': product['brand'],
+                'product_name': product['name'],
+                'category': product['category'],
+                'confidence': score * 100,
             }
-        
+            for score, product in ranked
+        ]
+
+        if candidates:
+            return {**candidates[0], 'candidates': candidates}
+
         return {
             'brand': 'Unknown',
             'product_name': 'Generic Product',
             'confidence': 0,
+            'candidates': [],
         }
-    
-    def _calculate_match_score(self, detected: List[str], required: List[str]) -> float:
-        """Calculate match score"""
-        if not required:
-            return 0.0
-        
-        matches = sum(
-            1 for req in required
-            if any(self._fuzzy_match(req.lower(), d.lower()) > 0.8 for d in detected)
-        )
-        
-        return matches / len(required)
-    
-    def _fuzzy_match(self, str1: str, str2: str) -> float:
-        """Calculate string similarity"""
-        return SequenceMatcher(None, str1, str2).ratio()
@@ -1,49 +1,193 @@
-from typing import List, Dict
+"""Product category classification.
+
+Categories are described by signatures (indicator ingredients and a
+confidence). They are compiled into a weight matrix over canonical
+ingredient ids, so one matrix product scores every category for a whole
+batch of ingredient lists. A category's score is the share of its
+indicators present times its confidence; several categories can score
+at once.
+"""
+import json
+import os
+import threading
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from django.conf import settings
+
+from .normalization import IngredientVocabulary, get_vocabulary
+
+try:
+    from scipy import sparse
+except ImportError:
+    sparse = None
+
+DEFAULT_SIGNATURES = {
+    'TOOTHPASTE': {
+        'indicators': ['sodium fluoride', 'hydrated silica'],
+        'confidence': 0.9
+    },
+    'SHAMPOO': {
+        'indicators': ['sodium laureth sulfate', 'cocamidopropyl'],
+        'confidence': 0.85
+    },
+    'FACE_MOISTURIZER': {
+        'indicators': ['hyaluronic acid', 'ceramides'],
+        'confidence': 0.80
+    },
+    'SUNSCREEN': {
+        'indicators': ['zinc oxide', 'titanium dioxide'],
+        'confidence': 0.90
+    },
+}
+
+
+def load_signatures(path: Optional[str] = None) -> Dict[str, Dict]:
+    """Read category signatures from JSON, falling back to DEFAULT_SIGNATURES.
+
+    The file maps category names to ``{"indicators": [...], "confidence": 0.9}``;
+    ``indicators`` may also be a ``{ingredient: weight}`` mapping.
+    """
+    path = path or getattr(settings, 'INGREDIENT_CATEGORY_SOURCE', None)
+    if not path or not os.path.exists(path):
+        return DEFAULT_SIGNATURES
+    with open(path, encoding='utf-8') as fh:
+        return json.load(fh)
+
+
+class CategoryModel:
+    """Category signatures compiled to a sparse (features x categories) weight matrix"""
+
+    def __init__(self, signatures: Dict[str, Dict], vocabulary: IngredientVocabulary = None):
+        self.vocabulary = vocabulary or get_vocabulary()
+        self.categories: List[str] = list(signatures)
+        self.features: Dict[int, int] = {}
+
+        entries: List[Tuple[int, int, float]] = []
+        for column, data in enumerate(signatures.values()):
+            indicators = data['indicators']
+            if not isinstance(indicators, dict):
+                indicators = dict.fromkeys(indicators, 1.0)
+            ids: Dict[int, float] = {}
+            for name, weight in indicators.items():
+                ingredient_id = self.vocabulary.add(name)
+                if ingredient_id is not None:
+                    ids[ingredient_id] = ids.get(ingredient_id, 0.0) + float(weight)
+            total = sum(ids.values()) or 1.0
+            for ingredient_id, weight in ids.items():
+                row = self.features.setdefault(ingredient_id, len(self.features))
+                entries.append((row, column, data.get('confidence', 1.0) * weight / total))
+
+        # Weights are kept as CSR arrays (feature rows -> category columns):
+        # most ingredients indicate only a handful of categories
+        entries.sort()
+        rows = np.array([row for row, _, _ in entries], dtype=np.intp)
+        self.columns = np.array([column for _, column, _ in entries], dtype=np.intp)
+        self.values = np.array([weight for _, _, weight in entries], dtype=np.float64)
+        self.indptr = np.searchsorted(rows, np.arange(len(self.features) + 1))
+
+    def _encode(self, ingredient_lists: Sequence[Sequence[str]]) -> Tuple[np.ndarray, np.ndarray]:
+        """CSR-style (indices, indptr) of the feature rows present in each list"""
+        resolve, features = self.vocabulary.resolve, self.features
+        indices: List[int] = []
+        indptr = [0]
+        for ingredients in ingredient_lists:
+            indices.extend({
+                features[i] for ingredient in ingredients if ingredient
+                for i in resolve(ingredient) if i in features
+            })
+            indptr.append(len(indices))
+        return np.asarray(indices, dtype=np.intp), np.asarray(indptr, dtype=np.intp)
+
+    def scores(self, ingredient_lists: Sequence[Sequence[str]]) -> np.ndarray:
+        """(lists x categories) scores in [0, 1]"""
+        n, n_categories = len(ingredient_lists), len(self.categories)
+        if not n or not n_categories:
+            return np.zeros((n, n_categories))
+
+        indices, indptr = self._encode(ingredient_lists)
+        if sparse is not None:
+            x = sparse.csr_matrix(
+                (np.ones(len(indices)), indices, indptr), shape=(n, len(self.features)),
+            )
+            w = sparse.csr_matrix(
+                (self.values, self.columns, self.indptr), shape=(len(self.features), n_categories),
+            )
+            result = (x @ w).toarray()
+        else:
+            # Expand every (list, feature) pair into its (list, category, weight)
+            # entries and sum them with one bincount
+            starts = self.indptr[indices]
+            counts = self.indptr[indices + 1] - starts
+            offsets = np.repeat(starts - np.cumsum(counts) + counts, counts) + np.arange(counts.sum())
+            lists = np.repeat(np.repeat(np.arange(n), np.diff(indptr)), counts)
+            result = np.bincount(
+                lists * n_categories + self.columns[offsets],
+                weights=self.values[offsets],
+                minlength=n * n_categories,
+            ).reshape(n, n_categories)
+        return np.minimum(result, 1.0)
+
+    def classify_many(self, ingredient_lists: Sequence[Sequence[str]],
+                      top_k: int = 3, min_score: float = 0.0) -> List[List[Dict]]:
+        """Ranked ``{'category', 'confidence'}`` labels for each ingredient list"""
+        scores = self.scores(ingredient_lists)
+        k = min(top_k, len(self.categories))
+        if k == 0:
+            return [[] for _ in ingredient_lists]
+
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        top_scores = np.take_along_axis(scores, top, axis=1)
+        # Highest score first; ties go to the category declared first
+        order = np.lexsort((top, -top_scores), axis=1)
+        top = np.take_along_axis(top, order, axis=1)
+        top_scores = np.take_along_axis(top_scores, order, axis=1)
+
+        return [
+            [
+                {'category': self.categories[c], 'confidence': round(float(s), 4)}
+                for c, s in zip(row, row_scores) if s > min_score
+            ]
+            for row, row_scores in zip(top.tolist(), top_scores.tolist())
+        ]
+
+
+_lock = threading.Lock()
+_model: Optional[Tuple[Tuple, CategoryModel]] = None
+
+
+def get_category_model() -> CategoryModel:
+    """Process-wide model, rebuilt when the signature file changes"""
+    global _model
+    path = getattr(settings, 'INGREDIENT_CATEGORY_SOURCE', None)
+    try:
+        stamp = (path, os.stat(path).st_mtime) if path else (None, None)
+    except OSError:
+        stamp = (path, None)
+
+    cached = _model
+    if cached is not None and cached[0] == stamp:
+        return cached[1]
+    with _lock:
+        if _model is None or _model[0] != stamp:
+            _model = (stamp, CategoryModel(load_signatures(path)))
+        return _model[1]
+
 
 class CategoryDetector:
     """Detect product category from ingredients"""
-    
-    def __init__(self):
-        self.category_signatures = {
-            'TOOTHPASTE': {
-                'indicators': ['sodium fluoride', 'hydrated silica'],
-                'confidence': 0.9
-            },
-            'SHAMPOO': {
-                'indicators': ['sodium laureth sulfate', 'cocamidopropyl'],
-                'confidence': 0.85
-            },
-            'FACE_MOISTURIZER': {
-                'indicators': ['hyaluronic acid', 'ceramides'],
-                'confidence': 0.80
-            },
-            'SUNSCREEN': {
-                'indicators': ['zinc oxide', 'titanium dioxide'],
-                'confidence': 0.90
-            },
-        }
-    
-    def detect_category(self, ingredients: List[str]) -> Dict:
+
+    def __init__(self, model: CategoryModel = None):
+        self.model = model or get_category_model()
+
+    def detect_category(self, ingredients: List[str], top_k: int = 3) -> Dict:
         """Detect product category"""
-        ingredient_lower = [ing.lower() for ing in ingredients]
-        
-        best_category = None
-        best_confidence = 0
-        
-        for category, data in self.category_signatures.items():
-            matches = sum(
-                1 for indicator in data['indicators']
-                if any(indicator in ing for ing in ingredient_lower)
-            )
-            
-            if matches > 0:
-                confidence = (matches / len(data['indicators'])) * data['confidence']
-                
-                if confidence > best_confidence:
-                    best_confidence = confidence
-                    best_category = category
-        
-        return {
-            'category': best_category or 'UNKNOWN',
-            'confidence': min(best_confidence, 1.0),
-        }
+        return self.detect_categories([ingredients], top_k)[0]
+
+    def detect_categories(self, ingredient_lists: Sequence[Sequence[str]], top_k: int = 3) -> List[Dict]:
+        """Detect categories for many products in one pass"""
+        results = []
+        for labels in self.model.classify_many(ingredient_lists, top_k=top_k):
+            best = labels[0] if labels else {'category': 'UNKNOWN', 'confidence': 0}
+            results.append({**best, 'labels': labels})
+        return results
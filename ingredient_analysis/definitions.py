@@ -0,0 +1,301 @@
+import asyncio
+import threading
+import time
+import weakref
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Dict, Optional
+
+from django.conf import settings
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+DEFINITION_NOT_FOUND = "Definition not found."
+DEFINITION_UNAVAILABLE = "Could not fetch definition."
+MAX_DEFINITION_LENGTH = 300
+
+DEFAULTS = {
+    'FETCHER': 'ingredient_analysis.definitions.WikipediaFetcher',
+    'TTL': 30 * 24 * 3600,
+    'NEGATIVE_TTL': 24 * 3600,
+    'LRU_SIZE': 2048,
+    'PERSISTENT': True,
+}
+
+
+class DefinitionFetcher(ABC):
+    """Source of ingredient definitions.
+
+    ``fetch`` returns the definition text, ``None`` when the ingredient is
+    unknown, and raises on transient failures (which are never cached).
+    """
+
+    @abstractmethod
+    def fetch(self, ingredient: str) -> Optional[str]:
+        ...
+
+    async def afetch(self, ingredient: str) -> Optional[str]:
+        """Async ``fetch``; fetchers without a native version run ``fetch`` in a thread"""
+        return await asyncio.to_thread(self.fetch, ingredient)
+
+
+class WikipediaFetcher(DefinitionFetcher):
+    """Fetch page summaries from Wikipedia"""
+
+    timeout = 5.0
+
+    def __init__(self, language: str = "en", user_agent: str = "IngredientAnalyzer/1.0"):
+        self.language = language
+        self.user_agent = user_agent
+        self._local = threading.local()
+        # One pooled httpx client per event loop (clients can't cross loops)
+        self._async_clients = weakref.WeakKeyDictionary()
+
+    def _client(self):
+        # wikipediaapi clients hold a HTTP session, which isn't thread-safe
+        client = getattr(self._local, 'client', None)
+        if client is None:
+            import wikipediaapi
+            client = wikipediaapi.Wikipedia(user_agent=self.user_agent, language=self.language)
+            self._local.client = client
+        return client
+
+    def fetch(self, ingredient: str) -> Optional[str]:
+        page = self._client().page(ingredient)
+        if page.exists():
+            return page.summary[:MAX_DEFINITION_LENGTH]
+        return None
+
+    def _async_client(self):
+        loop = asyncio.get_running_loop()
+        client = self._async_clients.get(loop)
+        if client is None:
+            import httpx
+            client = httpx.AsyncClient(
+                base_url=f"https://{self.language}.wikipedia.org",
+                headers={'User-Agent': self.user_agent},
+                timeout=self.timeout,
+            )
+            self._async_clients[loop] = client
+        return client
+
+    async def afetch(self, ingredient: str) -> Optional[str]:
+        # The same intro extract wikipediaapi reads for ``page.summary``
+        response = await self._async_client().get('/w/api.php', params={
+            'action': 'query',
+            'prop': 'extracts',
+            'exintro': 1,
+            'explaintext': 1,
+            'redirects': 1,
+            'format': 'json',
+            'titles': ingredient,
+        })
+        response.raise_for_status()
+        for page in response.json().get('query', {}).get('pages', {}).values():
+            if 'missing' not in page and page.get('extract'):
+                return page['extract'].strip()[:MAX_DEFINITION_LENGTH]
+        return None
+
+
+class StaticFetcher(DefinitionFetcher):
+    """Serve definitions from a local mapping, for tests and offline deployments"""
+
+    def __init__(self, definitions: Dict[str, str] = None):
+        self.definitions = {k.lower(): v for k, v in (definitions or {}).items()}
+
+    def fetch(self, ingredient: str) -> Optional[str]:
+        return self.definitions.get(ingredient.lower())
+
+    async def afetch(self, ingredient: str) -> Optional[str]:
+        return self.fetch(ingredient)
+
+
+class _LRU:
+    """Small thread-safe LRU with per-entry expiry"""
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._data: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            value, expires = item
+            if expires <= time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key: str, value, ttl: float) -> None:
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+
+class DefinitionCache:
+    """Two-tier (in-process LRU + database) cache in front of a fetcher.
+
+    Cached values are ``(found, text)`` pairs so "not found" answers are
+    cached too, with their own (shorter) TTL.
+    """
+
+    def __init__(
+        self,
+        fetcher: DefinitionFetcher,
+        ttl: float = DEFAULTS['TTL'],
+        negative_ttl: float = DEFAULTS['NEGATIVE_TTL'],
+        lru_size: int = DEFAULTS['LRU_SIZE'],
+        persistent: bool = True,
+    ):
+        self.fetcher = fetcher
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.persistent = persistent
+        self.memory = _LRU(lru_size)
+
+    @staticmethod
+    def key(ingredient: str) -> str:
+        return ' '.join(ingredient.lower().split())[:255]
+
+    def _ttl_for(self, found: bool) -> float:
+        return self.ttl if found else self.negative_ttl
+
+    def lookup(self, ingredient: str):
+        """Return a cached ``(found, text)`` pair, or None on a miss"""
+        key = self.key(ingredient)
+        cached = self.memory.get(key)
+        if cached is not None:
+            return cached
+
+        if not self.persistent:
+            return None
+
+        from .models import IngredientDefinition
+
+        row = IngredientDefinition.objects.filter(name=key).first()
+        if row is None:
+            return None
+
+        age = (timezone.now() - row.fetched_at).total_seconds()
+        remaining = self._ttl_for(row.found) - age
+        if remaining <= 0:
+            return None
+
+        cached = (row.found, row.definition)
+        self.memory.set(key, cached, remaining)
+        return cached
+
+    async def alookup(self, ingredient: str):
+        """``lookup`` for async callers (the database tier uses the async ORM)"""
+        key = self.key(ingredient)
+        cached = self.memory.get(key)
+        if cached is not None or not self.persistent:
+            return cached
+
+        from .models import IngredientDefinition
+
+        row = await IngredientDefinition.objects.filter(name=key).afirst()
+        if row is None:
+            return None
+
+        remaining = self._ttl_for(row.found) - (timezone.now() - row.fetched_at).total_seconds()
+        if remaining <= 0:
+            return None
+
+        cached = (row.found, row.definition)
+        self.memory.set(key, cached, remaining)
+        return cached
+
+    def remember(self, ingredient: str, text: Optional[str]) -> tuple:
+        """Cache a fetcher answer in the in-process tier only (thread-safe)"""
+        found = text is not None
+        value = (found, text or "")
+        self.memory.set(self.key(ingredient), value, self._ttl_for(found))
+        return value
+
+    def store(self, ingredient: str, text: Optional[str]) -> None:
+        """Cache a fetcher answer (``None`` meaning not found) in both tiers"""
+        key = self.key(ingredient)
+        found, definition = self.remember(ingredient, text)
+
+        if self.persistent:
+            from .models import IngredientDefinition
+
+            IngredientDefinition.objects.update_or_create(
+                name=key,
+                defaults={'definition': definition, 'found': found, 'fetched_at': timezone.now()},
+            )
+
+    async def astore(self, ingredient: str, text: Optional[str]) -> None:
+        """``store`` for async callers"""
+        key = self.key(ingredient)
+        found, definition = self.remember(ingredient, text)
+
+        if self.persistent:
+            from .models import IngredientDefinition
+
+            await IngredientDefinition.objects.aupdate_or_create(
+                name=key,
+                defaults={'definition': definition, 'found': found, 'fetched_at': timezone.now()},
+            )
+
+    def get(self, ingredient: str) -> str:
+        """Return the definition text for an ingredient, fetching on a miss"""
+        cached = self.lookup(ingredient)
+        if cached is None:
+            try:
+                text = self.fetcher.fetch(ingredient)
+            except Exception:
+                return DEFINITION_UNAVAILABLE
+            self.store(ingredient, text)
+            cached = (text is not None, text or "")
+
+        found, text = cached
+        return text if found else DEFINITION_NOT_FOUND
+
+
+def _build_default_cache() -> DefinitionCache:
+    config = {**DEFAULTS, **getattr(settings, 'INGREDIENT_DEFINITIONS', {})}
+    fetcher = config['FETCHER']
+    if isinstance(fetcher, str):
+        fetcher = import_string(fetcher)()
+    return DefinitionCache(
+        fetcher,
+        ttl=config['TTL'],
+        negative_ttl=config['NEGATIVE_TTL'],
+        lru_size=config['LRU_SIZE'],
+        persistent=config['PERSISTENT'],
+    )
+
+
+_cache_lock = threading.Lock()
+_default_cache: Optional[DefinitionCache] = None
+
+
+def get_definition_cache() -> DefinitionCache:
+    """Return the process-wide definition cache configured from settings"""
+    global _default_cache
+    if _default_cache is None:
+        with _cache_lock:
+            if _default_cache is None:
+                _default_cache = _build_default_cache()
+    return _default_cache
+
+
+def set_definition_cache(cache: Optional[DefinitionCache]) -> None:
+    """Swap the process-wide cache (``None`` rebuilds it from settings)"""
+    global _default_cache
+    with _cache_lock:
+        _default_cache = cache
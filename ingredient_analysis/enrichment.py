@@ -0,0 +1,184 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from typing import Dict, List, Optional, Tuple
+
+from django.conf import settings
+from django.db import close_old_connections
+
+from .definitions import DEFINITION_NOT_FOUND, DEFINITION_UNAVAILABLE, DefinitionCache, get_definition_cache
+
+DEFAULT_TIMEOUT = 2.0
+DEFAULT_WORKERS = 8
+
+_executor_lock = threading.Lock()
+_executor: Optional[ThreadPoolExecutor] = None
+
+# Async lookups still running after their request's deadline; the event
+# loop only holds weak references to tasks
+_late_tasks = set()
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    """Shared pool for definition lookups; never shut down per request"""
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=getattr(settings, 'INGREDIENT_ENRICHMENT_WORKERS', DEFAULT_WORKERS),
+                    thread_name_prefix='enrichment',
+                )
+    return _executor
+
+
+def fetch_and_store(cache: DefinitionCache, ingredient: str) -> Optional[str]:
+    """Fetch and cache a definition; answers that miss the deadline are kept too"""
+    # Pool threads keep their own connections; treat each lookup like a request
+    close_old_connections()
+    try:
+        text = cache.fetcher.fetch(ingredient)
+        cache.store(ingredient, text)
+        return text
+    finally:
+        close_old_connections()
+
+
+def _forget_late(task: asyncio.Task) -> None:
+    _late_tasks.discard(task)
+    if not task.cancelled():
+        # Retrieved, so a failed late lookup isn't logged as unhandled
+        task.exception()
+
+
+def fetch_definitions(
+    ingredients: List[str],
+    timeout: float = None,
+    cache: DefinitionCache = None,
+) -> Dict[str, Tuple[str, Optional[str]]]:
+    """Look up definitions concurrently, bounded by an overall deadline.
+
+    Returns ``{ingredient: (status, definition)}`` where status is one of
+    ``ready``, ``error`` or ``pending`` (definition is None when pending).
+    """
+    cache = cache or get_definition_cache()
+    if timeout is None:
+        timeout = getattr(settings, 'INGREDIENT_ENRICHMENT_TIMEOUT', DEFAULT_TIMEOUT)
+    deadline = time.monotonic() + timeout
+
+    results = {}
+    futures = {}
+    for ingredient in dict.fromkeys(ingredients):
+        cached = cache.lookup(ingredient)
+        if cached is not None:
+            found, text = cached
+            results[ingredient] = ('ready', text if found else DEFINITION_NOT_FOUND)
+        else:
+            futures[_get_executor().submit(fetch_and_store, cache, ingredient)] = ingredient
+
+    if futures:
+        done, not_done = wait(futures, timeout=max(0.0, deadline - time.monotonic()))
+
+        for future in done:
+            ingredient = futures[future]
+            try:
+                text = future.result()
+            except Exception:
+                results[ingredient] = ('error', DEFINITION_UNAVAILABLE)
+                continue
+            results[ingredient] = ('ready', text if text is not None else DEFINITION_NOT_FOUND)
+
+        for future in not_done:
+            results[futures[future]] = ('pending', None)
+
+    return results
+
+
+async def afetch_definitions(
+    ingredients: List[str],
+    timeout: float = None,
+    cache: DefinitionCache = None,
+) -> Dict[str, Tuple[str, Optional[str]]]:
+    """``fetch_definitions`` on the event loop, using the fetcher's ``afetch``.
+
+    At most INGREDIENT_ENRICHMENT_WORKERS lookups of one request are in
+    flight at a time. Lookups still running at the deadline keep going
+    and are stored in both cache tiers when they finish, as in the
+    threaded version.
+    """
+    cache = cache or get_definition_cache()
+    if timeout is None:
+        timeout = getattr(settings, 'INGREDIENT_ENRICHMENT_TIMEOUT', DEFAULT_TIMEOUT)
+    deadline = time.monotonic() + timeout
+    slots = asyncio.Semaphore(getattr(settings, 'INGREDIENT_ENRICHMENT_WORKERS', DEFAULT_WORKERS))
+
+    async def fetch(ingredient: str) -> Optional[str]:
+        async with slots:
+            text = await cache.fetcher.afetch(ingredient)
+        await cache.astore(ingredient, text)
+        return text
+
+    results = {}
+    tasks = {}
+    for ingredient in dict.fromkeys(ingredients):
+        cached = await cache.alookup(ingredient)
+        if cached is not None:
+            found, text = cached
+            results[ingredient] = ('ready', text if found else DEFINITION_NOT_FOUND)
+        else:
+            tasks[asyncio.ensure_future(fetch(ingredient))] = ingredient
+
+    if tasks:
+        done, not_done = await asyncio.wait(tasks, timeout=max(0.0, deadline - time.monotonic()))
+
+        for task in done:
+            ingredient = tasks[task]
+            try:
+                text = task.result()
+            except Exception:
+                results[ingredient] = ('error', DEFINITION_UNAVAILABLE)
+                continue
+            results[ingredient] = ('ready', text if text is not None else DEFINITION_NOT_FOUND)
+
+        for task in not_done:
+            _late_tasks.add(task)
+            task.add_done_callback(_forget_late)
+            results[tasks[task]] = ('pending', None)
+
+    return results
+
+
+def _with_definitions(safety_checker, unsafe_raw: List[Tuple[str, str]], definitions: Dict) -> List[Dict]:
+    unsafe_ingredients = []
+    for ingredient, effect in unsafe_raw:
+        status, definition = definitions[ingredient]
+        unsafe_ingredients.append({
+            'ingredient': ingredient,
+            'effect': effect,
+            'definition': definition,
+            'definition_status': status,
+            'safety': safety_checker.safety_rating(ingredient),
+        })
+
+    return unsafe_ingredients
+
+
+def enrich_unsafe_ingredients(
+    safety_checker,
+    unsafe_raw: List[Tuple[str, str]],
+    timeout: float = None,
+) -> List[Dict]:
+    """Attach definitions and safety ratings to ``check_safety`` output"""
+    definitions = fetch_definitions([ingredient for ingredient, _ in unsafe_raw], timeout=timeout)
+    return _with_definitions(safety_checker, unsafe_raw, definitions)
+
+
+async def aenrich_unsafe_ingredients(
+    safety_checker,
+    unsafe_raw: List[Tuple[str, str]],
+    timeout: float = None,
+) -> List[Dict]:
+    """``enrich_unsafe_ingredients`` for async callers"""
+    definitions = await afetch_definitions([ingredient for ingredient, _ in unsafe_raw], timeout=timeout)
+    return _with_definitions(safety_checker, unsafe_raw, definitions)
@@ -0,0 +1,165 @@
+"""Paginated listing of past analyses for /api/analyses/.
+
+Pages are cut with a keyset cursor on ``(created_at, id)`` rather than
+an offset, so every page costs one index range scan however deep it is.
+A page is resolved in two steps. First only its primary keys are
+fetched, which is enough to compute the ETag, because analyses are
+never modified after they are written. Only when the client's copy is
+stale are the rows loaded, in a single joined query. That query
+projects the summary columns; the large text and JSON columns are added
+only when the client asks for them with ``fields``.
+"""
+import base64
+import hashlib
+import json
+import uuid
+from datetime import datetime
+from typing import Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+from django.db.models import Q, QuerySet
+from django.utils.dateparse import parse_datetime
+
+from .models import AnalysisResult
+
+DEFAULT_LIMIT = 20
+MAX_LIMIT = 100
+
+SUMMARY_FIELDS = (
+    'id', 'created_at', 'identified_brand', 'identified_product', 'product_category',
+    'confidence_score', 'category_confidence', 'health_conditions',
+    'ocr_result__id', 'ocr_result__confidence',
+    'ocr_result__image__id', 'ocr_result__image__thumbnail',
+)
+# Opt-in response keys -> the (large) columns they need
+DETAIL_FIELDS = {
+    'unsafe_ingredients': 'unsafe_ingredients',
+    'ingredients': 'ocr_result__extracted_ingredients',
+    'extracted_text': 'ocr_result__raw_text',
+    'recommendations': 'recommendations',
+    'timings': 'stage_timings',
+}
+
+
+class HistoryError(ValueError):
+    """Raised for invalid history query parameters"""
+
+
+class HistoryPage(NamedTuple):
+    """Primary keys of one page, in display order, plus the cursor for the next"""
+    keys: List[uuid.UUID]
+    next_cursor: Optional[str]
+    fields: Tuple[str, ...]
+
+    @property
+    def etag(self) -> str:
+        digest = hashlib.sha256()
+        for part in (*map(str, self.keys), self.next_cursor or '', *self.fields):
+            digest.update(part.encode())
+            digest.update(b'\0')
+        return f'"{digest.hexdigest()[:32]}"'
+
+
+def encode_cursor(created_at: datetime, pk: uuid.UUID) -> str:
+    raw = f'{created_at.isoformat()}|{pk}'.encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, uuid.UUID]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+        created_at, pk = raw.split('|')
+        parsed = parse_datetime(created_at)
+        if parsed is None:
+            raise ValueError(created_at)
+        return parsed, uuid.UUID(pk)
+    except ValueError:
+        raise HistoryError("Invalid cursor")
+
+
+def _limit(value: Optional[str]) -> int:
+    if not value:
+        return DEFAULT_LIMIT
+    try:
+        limit = int(value)
+    except ValueError:
+        raise HistoryError("limit must be an integer")
+    return max(1, min(limit, MAX_LIMIT))
+
+
+def _fields(value: Optional[str]) -> Tuple[str, ...]:
+    fields = tuple(sorted({field.strip() for field in (value or '').split(',') if field.strip()}))
+    unknown = [field for field in fields if field not in DETAIL_FIELDS]
+    if unknown:
+        raise HistoryError(
+            f"Unknown fields: {', '.join(unknown)}. Available: {', '.join(DETAIL_FIELDS)}"
+        )
+    return fields
+
+
+def filtered_analyses(params) -> QuerySet:
+    """Analyses matching the brand, category and unsafe-ingredient filters"""
+    queryset = AnalysisResult.objects.all()
+    if params.get('brand'):
+        queryset = queryset.filter(identified_brand__iexact=params['brand'])
+    if params.get('category'):
+        queryset = queryset.filter(product_category=params['category'].upper())
+    if params.get('unsafe'):
+        # The column is searched as JSON text, which works on every backend;
+        # SQLite, PostgreSQL and MySQL all render members as "key": "value"
+        member = json.dumps({'ingredient': params['unsafe'].strip()})[1:-1]
+        queryset = queryset.filter(unsafe_ingredients__icontains=member)
+    return queryset
+
+
+def history_page(params) -> HistoryPage:
+    """Resolve the primary keys of the page selected by ``cursor`` and ``limit``"""
+    limit = _limit(params.get('limit'))
+    fields = _fields(params.get('fields'))
+    queryset = filtered_analyses(params).order_by('-created_at', '-id')
+    if params.get('cursor'):
+        created_at, pk = decode_cursor(params['cursor'])
+        queryset = queryset.filter(Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=pk))
+
+    rows = list(queryset.values_list('created_at', 'id')[:limit + 1])
+    next_cursor = encode_cursor(*rows[limit - 1]) if len(rows) > limit else None
+    return HistoryPage([pk for _, pk in rows[:limit]], next_cursor, fields)
+
+
+def _serialize(analysis: AnalysisResult, fields: Sequence[str]) -> Dict:
+    ocr_result = analysis.ocr_result
+    image = ocr_result.image
+    item = {
+        'analysis_id': str(analysis.id),
+        'created_at': analysis.created_at.isoformat(),
+        'identified_brand': {
+            'name': analysis.identified_brand,
+            'product_name': analysis.identified_product,
+            'confidence': analysis.confidence_score,
+        },
+        'product_category': analysis.product_category,
+        'category_confidence': analysis.category_confidence,
+        'health_conditions': analysis.health_conditions,
+        'ocr_confidence': ocr_result.confidence,
+        'image_id': str(image.id),
+        'thumbnail': image.thumbnail.url if image.thumbnail else None,
+    }
+    for field in fields:
+        if field == 'ingredients':
+            item[field] = ocr_result.extracted_ingredients
+        elif field == 'extracted_text':
+            item[field] = ocr_result.raw_text
+        else:
+            item[field] = getattr(analysis, DETAIL_FIELDS[field])
+    return item
+
+
+def load_page(page: HistoryPage) -> List[Dict]:
+    """Fetch and serialize a page's rows with one joined, projected query"""
+    columns = SUMMARY_FIELDS + tuple(DETAIL_FIELDS[field] for field in page.fields)
+    analyses = (
+        AnalysisResult.objects
+        .select_related('ocr_result__image')
+        .only(*columns)
+        .in_bulk(page.keys)
+    )
+    return [_serialize(analyses[pk], page.fields) for pk in page.keys if pk in analyses]
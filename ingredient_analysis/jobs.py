@@ -0,0 +1,158 @@
+"""Database-backed job queue for asynchronous analyses.
+
+Each queued ``UploadedImage`` is a job; its ``status`` column is the queue
+state. Workers claim jobs with a conditional UPDATE, so any number of
+worker processes can poll the same table without an external broker.
+"""
+import logging
+import multiprocessing
+import os
+import signal
+import time
+from datetime import timedelta
+from typing import List, Optional
+
+from django.conf import settings
+from django.db import close_old_connections, connections
+from django.utils import timezone
+
+from ocr.dedup import store_upload
+from ocr.engine import build_ocr_engine, set_ocr_engine
+from ocr.models import UploadedImage
+from ocr.preprocessing import profile_name
+from .pipeline import run_analysis
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_QUEUE_MAX_DEPTH = 100
+DEFAULT_POLL_INTERVAL = 1.0
+DEFAULT_JOB_TIMEOUT = 300
+
+class QueueFull(Exception):
+    """Raised when the job queue has reached ANALYSIS_QUEUE_MAX_DEPTH"""
+
+
+def queue_depth() -> int:
+    return UploadedImage.objects.filter(status=UploadedImage.Status.QUEUED).count()
+
+
+def enqueue(image_file, user_conditions: List[str], duplicate: UploadedImage = None, preprocess=True,
+            **fields) -> UploadedImage:
+    """Persist an upload as a queued job, refusing when the queue is full.
+
+    ``preprocess`` is the request's preprocessing option; the job runs
+    with the profile it names.
+    """
+    max_depth = getattr(settings, 'ANALYSIS_QUEUE_MAX_DEPTH', DEFAULT_QUEUE_MAX_DEPTH)
+    if queue_depth() >= max_depth:
+        raise QueueFull(f"Analysis queue is full ({max_depth} jobs)")
+
+    return store_upload(
+        image_file,
+        duplicate,
+        health_conditions=user_conditions,
+        preprocess_profile=profile_name(preprocess),
+        status=UploadedImage.Status.QUEUED,
+        **fields
+    )
+
+
+def requeue_stale_jobs() -> int:
+    """Put jobs whose worker died mid-run back on the queue"""
+    timeout = getattr(settings, 'ANALYSIS_JOB_TIMEOUT', DEFAULT_JOB_TIMEOUT)
+    return UploadedImage.objects.filter(
+        status=UploadedImage.Status.RUNNING,
+        started_at__lt=timezone.now() - timedelta(seconds=timeout),
+    ).update(status=UploadedImage.Status.QUEUED, started_at=None)
+
+
+def claim_next_job() -> Optional[UploadedImage]:
+    """Atomically move the oldest queued job to running and return it"""
+    candidates = (
+        UploadedImage.objects
+        .filter(status=UploadedImage.Status.QUEUED)
+        .order_by('uploaded_at')
+        .values_list('pk', flat=True)[:5]
+    )
+    for pk in candidates:
+        claimed = UploadedImage.objects.filter(
+            pk=pk, status=UploadedImage.Status.QUEUED,
+        ).update(status=UploadedImage.Status.RUNNING, started_at=timezone.now())
+        if claimed:
+            return UploadedImage.objects.get(pk=pk)
+    return None
+
+
+def process_job(job: UploadedImage) -> None:
+    """Run the analysis pipeline for a claimed job and record the outcome"""
+    try:
+        run_analysis(job, job.health_conditions, preprocess=job.preprocess_profile or True)
+    except Exception as e:
+        logger.exception("Analysis job %s failed", job.pk)
+        UploadedImage.objects.filter(pk=job.pk).update(
+            status=UploadedImage.Status.FAILED,
+            error=str(e),
+        )
+
+
+def worker_loop(drain: bool = False) -> int:
+    """Poll for and process jobs until signalled (or, with ``drain``, until the queue is empty)"""
+    poll_interval = getattr(settings, 'ANALYSIS_WORKER_POLL_INTERVAL', DEFAULT_POLL_INTERVAL)
+    stopping = []
+    signal.signal(signal.SIGTERM, lambda *args: stopping.append(True))
+
+    processed = 0
+    while not stopping:
+        close_old_connections()
+        job = claim_next_job()
+        if job is None:
+            if drain:
+                break
+            time.sleep(poll_interval)
+            continue
+        process_job(job)
+        processed += 1
+
+    return processed
+
+
+def _worker_main() -> None:
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    # The job workers already use every core; an OCR pool of its own in
+    # each of them would run Tesseract in workers x OCR_ENGINE['WORKERS']
+    # processes
+    set_ocr_engine(build_ocr_engine(workers=0))
+    worker_loop()
+
+
+def run_worker_pool(concurrency: int = None) -> None:
+    """Run and supervise ``concurrency`` worker processes until interrupted"""
+    concurrency = concurrency or getattr(settings, 'ANALYSIS_WORKER_CONCURRENCY', None) or os.cpu_count() or 1
+    context = multiprocessing.get_context('fork')
+
+    def start_worker():
+        # Children must open their own database connections
+        connections.close_all()
+        process = context.Process(target=_worker_main, daemon=True)
+        process.start()
+        return process
+
+    requeue_stale_jobs()
+    workers = [start_worker() for _ in range(concurrency)]
+
+    try:
+        while True:
+            time.sleep(DEFAULT_POLL_INTERVAL)
+            for i, process in enumerate(workers):
+                if not process.is_alive():
+                    logger.warning("Analysis worker %s exited with %s; restarting", process.pid, process.exitcode)
+                    requeue_stale_jobs()
+                    workers[i] = start_worker()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for process in workers:
+            if process.is_alive():
+                process.terminate()
+        for process in workers:
+            process.join()
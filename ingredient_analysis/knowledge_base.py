@@ -0,0 +1,207 @@
+import json
+import os
+import threading
+from types import MappingProxyType
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from django.conf import settings
+
+from monitoring.metrics import counter, gauge
+from .matcher import IngredientAutomaton
+from .normalization import build_vocabulary
+
+SNAPSHOT_FORMAT_VERSION = 1
+
+HEALTH_RISKS = {
+    "Diabetes": ["sugar", "high fructose corn syrup", "aspartame", "maltodextrin"],
+    "High Blood Pressure": ["salt", "sodium", "msg", "sodium nitrate"],
+    "Thyroid Issues": ["soy", "fluoride", "bromate"],
+    "Heart Disease": ["trans fat", "palm oil", "cholesterol"],
+    "Kidney Disease": ["phosphate", "potassium chloride"],
+    "Cancer Risks": ["aspartame", "sodium nitrate", "bht", "bpa"]
+}
+# Rated HARMFUL by SafetyChecker.safety_rating; other restricted ingredients are MODERATE
+RATED_HARMFUL = ("aspartame", "trans fat", "sodium nitrate", "bht", "bpa")
+
+
+class KnowledgeBase:
+    """Immutable, compiled view of the harmful-ingredient data.
+
+    Instances are shared between requests (and threads) of a worker, so
+    nothing on them may be mutated after construction. Each one builds
+    its own vocabulary with every ingredient it knows; afterwards that
+    vocabulary is only read.
+    """
+
+    def __init__(
+        self,
+        harmful: Iterable[Tuple[str, str]],
+        health_risks: Dict[str, Iterable[str]] = None,
+        source_path: Optional[str] = None,
+        source_mtime: Optional[float] = None,
+    ):
+        self.harmful: Tuple[Tuple[str, str], ...] = tuple(
+            (str(name).lower(), effect or "Found in database") for name, effect in harmful
+        )
+        self.health_risks = MappingProxyType({
+            condition: tuple(terms)
+            for condition, terms in (health_risks if health_risks is not None else HEALTH_RISKS).items()
+        })
+        self.source_path = source_path
+        self.source_mtime = source_mtime
+        self.vocabulary = build_vocabulary()
+        self.harmful_ids, self.condition_ids = self._index_ids()
+        self.rated_harmful_ids = frozenset(
+            ingredient_id for ingredient_id in map(self.vocabulary.add, RATED_HARMFUL) if ingredient_id is not None
+        )
+        self.automaton = self._build_automaton()
+
+    def __len__(self) -> int:
+        return len(self.harmful)
+
+    def _index_ids(self):
+        """Map canonical ids to harmful entries and to restricted condition terms"""
+        harmful_ids: Dict[int, Tuple[str, str]] = {}
+        for ingredient, effect in self.harmful:
+            ingredient_id = self.vocabulary.add(ingredient)
+            if ingredient_id is not None:
+                harmful_ids.setdefault(ingredient_id, (ingredient, effect))
+
+        condition_ids: Dict[int, List[Tuple[str, str]]] = {}
+        for condition, restricted_terms in self.health_risks.items():
+            for restricted in restricted_terms:
+                ingredient_id = self.vocabulary.add(restricted)
+                if ingredient_id is not None:
+                    condition_ids.setdefault(ingredient_id, []).append((restricted.lower(), condition))
+
+        return MappingProxyType(harmful_ids), MappingProxyType(condition_ids)
+
+    def _build_automaton(self) -> IngredientAutomaton:
+        """Compile every surface form of the known ingredients into one matcher.
+
+        Payloads are canonical ids; the automaton is meant to scan text
+        that went through ``normalize_text``.
+        """
+        automaton = IngredientAutomaton()
+        for ingredient_id in {*self.harmful_ids, *self.condition_ids}:
+            surfaces = self.vocabulary.surfaces(ingredient_id)
+            for surface in {*surfaces, *(s.replace(' ', '') for s in surfaces)}:
+                automaton.add(surface, ingredient_id)
+        return automaton.build()
+
+    def to_snapshot(self) -> Dict:
+        """Serialize to the JSON snapshot format"""
+        return {
+            'version': SNAPSHOT_FORMAT_VERSION,
+            'source_mtime': self.source_mtime,
+            'harmful': [list(row) for row in self.harmful],
+            'health_risks': {k: list(v) for k, v in self.health_risks.items()},
+        }
+
+
+def default_source_path() -> str:
+    return str(getattr(
+        settings,
+        'INGREDIENT_KB_SOURCE',
+        os.path.join(settings.BASE_DIR, 'static_data', 'harmful_ingredients.xlsx'),
+    ))
+
+
+def default_snapshot_path(source_path: str) -> str:
+    configured = getattr(settings, 'INGREDIENT_KB_SNAPSHOT', None)
+    if configured and source_path == default_source_path():
+        return str(configured)
+    return os.path.splitext(source_path)[0] + '.json'
+
+
+def _mtime(path: str) -> Optional[float]:
+    try:
+        return os.stat(path).st_mtime
+    except OSError:
+        return None
+
+
+def read_workbook(path: str) -> List[Tuple[str, str]]:
+    """Parse (ingredient, effect) rows from the harmful-ingredients workbook"""
+    import openpyxl
+
+    wb = openpyxl.load_workbook(path, read_only=True, data_only=True)
+    try:
+        rows = []
+        for row in wb.active.iter_rows(min_row=2, values_only=True):
+            if not row or not row[0]:
+                continue
+            effect = row[1] if len(row) > 1 else ""
+            rows.append((str(row[0]), str(effect) if effect else ""))
+        return rows
+    finally:
+        wb.close()
+
+
+def load_knowledge_base(source_path: str, snapshot_path: Optional[str] = None) -> KnowledgeBase:
+    """Build a KnowledgeBase, preferring a snapshot compiled from the same source"""
+    source_mtime = _mtime(source_path)
+    snapshot_path = snapshot_path or default_snapshot_path(source_path)
+
+    try:
+        with open(snapshot_path, encoding='utf-8') as fh:
+            snapshot = json.load(fh)
+        if (
+            snapshot.get('version') == SNAPSHOT_FORMAT_VERSION
+            and (source_mtime is None or snapshot.get('source_mtime') == source_mtime)
+        ):
+            return KnowledgeBase(
+                snapshot['harmful'],
+                snapshot.get('health_risks'),
+                source_path=source_path,
+                source_mtime=source_mtime,
+            )
+    except (OSError, ValueError, KeyError):
+        pass
+
+    harmful = []
+    if source_mtime is not None:
+        try:
+            harmful = read_workbook(source_path)
+        except Exception:
+            harmful = []
+
+    return KnowledgeBase(harmful, source_path=source_path, source_mtime=source_mtime)
+
+
+def write_snapshot(kb: KnowledgeBase, snapshot_path: str) -> None:
+    """Atomically write a knowledge base snapshot to disk"""
+    tmp_path = f"{snapshot_path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as fh:
+        json.dump(kb.to_snapshot(), fh, ensure_ascii=False, separators=(',', ':'))
+    os.replace(tmp_path, snapshot_path)
+
+
+KB_LOADS = counter('knowledge_base_loads', "Knowledge base loads, initial or after its files changed",
+                   ['reason'])
+KB_SIZE = gauge('knowledge_base_entries', "Ingredients in the loaded knowledge base", ['kind'])
+
+_lock = threading.Lock()
+_loaded: Dict[str, Tuple[Tuple[Optional[float], Optional[float]], KnowledgeBase]] = {}
+
+
+def get_knowledge_base(source_path: Optional[str] = None) -> KnowledgeBase:
+    """Return the process-wide knowledge base, reloading it if its files changed"""
+    source_path = str(source_path or default_source_path())
+    snapshot_path = default_snapshot_path(source_path)
+    stamp = (_mtime(source_path), _mtime(snapshot_path))
+
+    cached = _loaded.get(source_path)
+    if cached and cached[0] == stamp:
+        return cached[1]
+
+    with _lock:
+        cached = _loaded.get(source_path)
+        if cached and cached[0] == stamp:
+            return cached[1]
+        kb = load_knowledge_base(source_path, snapshot_path)
+        _loaded[source_path] = (stamp, kb)
+        KB_LOADS.inc(reason='reload' if cached else 'initial')
+        KB_SIZE.set(len(kb), kind='harmful')
+        KB_SIZE.set(len(kb.condition_ids), kind='condition')
+        return kb
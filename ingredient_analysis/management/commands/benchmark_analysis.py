@@ -0,0 +1,92 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from ingredient_analysis.benchmarks import (
+    DEFAULT_NOISE, DEFAULT_SIZES, FONTS, SECTIONS, compare, run_suite,
+)
+
+
+class Command(BaseCommand):
+    help = "Benchmark OCR, parsing, matching and /api/analyze/ on a synthetic label corpus"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--only', nargs='+', choices=SECTIONS, default=list(SECTIONS),
+                            help="Benchmark sections to run")
+        parser.add_argument('--iterations', type=int, default=50,
+                            help="Timed calls per text benchmark")
+        parser.add_argument('--image-iterations', type=int, default=3,
+                            help="Timed calls per image for the OCR and view benchmarks")
+        parser.add_argument('--sizes', type=int, nargs='+', default=list(DEFAULT_SIZES),
+                            help="Label image widths in pixels")
+        parser.add_argument('--fonts', nargs='+', choices=list(FONTS), default=['sans'])
+        parser.add_argument('--noise', type=float, nargs='+', default=list(DEFAULT_NOISE),
+                            help="Gaussian noise levels (standard deviation in grey levels)")
+        parser.add_argument('--ingredients', type=int, nargs='+', default=[10, 30, 80],
+                            help="Ingredient counts per label for the text benchmarks")
+        parser.add_argument('--output', help="Write the results as JSON to this file")
+        parser.add_argument('--compare', help="Baseline results JSON to compare against")
+        parser.add_argument('--threshold', type=float, default=0.10,
+                            help="Median slowdown counted as a regression (0.10 = 10%%)")
+        parser.add_argument('--fail-on-regression', action='store_true',
+                            help="Exit with an error when any benchmark regressed")
+
+    def handle(self, *args, **options):
+        baseline = None
+        if options['compare']:
+            try:
+                with open(options['compare'], encoding='utf-8') as fh:
+                    baseline = json.load(fh)
+            except (OSError, ValueError) as e:
+                raise CommandError(f"Can't read baseline {options['compare']}: {e}")
+
+        self.stdout.write(f"{'benchmark':<26} {'params':<42} {'p50 ms':>9} {'p95 ms':>9} {'ops/s':>9} {'err':>4}")
+        results = run_suite(
+            sections=options['only'],
+            iterations=options['iterations'],
+            image_iterations=options['image_iterations'],
+            sizes=options['sizes'],
+            fonts=options['fonts'],
+            noise_levels=options['noise'],
+            text_sizes=options['ingredients'],
+            progress=self._report,
+        )
+
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as fh:
+                json.dump(results, fh, indent=2)
+            self.stdout.write(f"Results written to {options['output']}")
+
+        if baseline is not None:
+            self._compare(baseline, results, options['threshold'], options['fail_on_regression'])
+
+    def _report(self, result):
+        params = ' '.join(f'{key}={value}' for key, value in result['params'].items())
+        if 'p50_ms' in result:
+            self.stdout.write(
+                f"{result['name']:<26} {params:<42} {result['p50_ms']:>9.3f} {result['p95_ms']:>9.3f} "
+                f"{result['ops_per_s']:>9.1f} {result['errors']:>4}"
+            )
+        else:
+            self.stdout.write(self.style.WARNING(
+                f"{result['name']:<26} {params:<42} failed: {result.get('error', 'no successful calls')}"
+            ))
+
+    def _compare(self, baseline, results, threshold, fail):
+        revision = baseline.get('environment', {}).get('revision') or 'baseline'
+        self.stdout.write(f"\nMedian latency vs {revision}:")
+        regressions = 0
+        for item in compare(baseline, results):
+            params = ' '.join(f'{key}={value}' for key, value in item.params.items())
+            line = (f"{item.name:<26} {params:<42} {item.baseline_ms:>9.3f} -> "
+                    f"{item.current_ms:>9.3f} ({item.change:+.1%})")
+            if item.change > threshold:
+                regressions += 1
+                self.stdout.write(self.style.ERROR(line))
+            elif item.change < -threshold:
+                self.stdout.write(self.style.SUCCESS(line))
+            else:
+                self.stdout.write(line)
+
+        if regressions and fail:
+            raise CommandError(f"{regressions} benchmark(s) regressed by more than {threshold:.0%}")
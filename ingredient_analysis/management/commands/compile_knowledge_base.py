@@ -0,0 +1,37 @@
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+from ingredient_analysis.knowledge_base import (
+    KnowledgeBase,
+    default_snapshot_path,
+    default_source_path,
+    read_workbook,
+    write_snapshot,
+)
+
+
+class Command(BaseCommand):
+    help = "Precompile the harmful-ingredients workbook into a JSON snapshot"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--source', help="Path to harmful_ingredients.xlsx")
+        parser.add_argument('--output', help="Where to write the snapshot")
+
+    def handle(self, *args, **options):
+        source = options['source'] or default_source_path()
+        output = options['output'] or default_snapshot_path(source)
+
+        if not os.path.exists(source):
+            raise CommandError(f"Source workbook not found: {source}")
+
+        kb = KnowledgeBase(
+            read_workbook(source),
+            source_path=source,
+            source_mtime=os.stat(source).st_mtime,
+        )
+        write_snapshot(kb, output)
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Compiled {len(kb)} ingredients from {source} into {output}"
+        ))
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from ingredient_analysis.jobs import run_worker_pool, worker_loop
+
+
+class Command(BaseCommand):
+    help = "Process queued analysis jobs with a pool of worker processes"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, help="Number of worker processes")
+        parser.add_argument('--once', action='store_true', help="Drain the queue in this process and exit")
+
+    def handle(self, *args, **options):
+        if options['once']:
+            processed = worker_loop(drain=True)
+            self.stdout.write(self.style.SUCCESS(f"Processed {processed} jobs"))
+            return
+
+        run_worker_pool(options['concurrency'])
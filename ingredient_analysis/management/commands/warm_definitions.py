@@ -0,0 +1,48 @@
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from ingredient_analysis.definitions import get_definition_cache
+from ingredient_analysis.enrichment import DEFAULT_WORKERS, fetch_and_store
+from ingredient_analysis.knowledge_base import get_knowledge_base
+
+
+class Command(BaseCommand):
+    help = "Pre-fetch definitions for every ingredient in the knowledge base"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--source', help="Path to harmful_ingredients.xlsx")
+        parser.add_argument('--force', action='store_true', help="Refetch entries that are still fresh")
+        parser.add_argument(
+            '--workers', type=int,
+            default=getattr(settings, 'INGREDIENT_ENRICHMENT_WORKERS', DEFAULT_WORKERS),
+            help="Lookups in flight at once (default: INGREDIENT_ENRICHMENT_WORKERS)",
+        )
+
+    def handle(self, *args, **options):
+        kb = get_knowledge_base(options['source'])
+        cache = get_definition_cache()
+
+        names = {name for name, _ in kb.harmful}
+        for terms in kb.health_risks.values():
+            names.update(term.lower() for term in terms)
+
+        missing = sorted(name for name in names if options['force'] or cache.lookup(name) is None)
+        skipped = len(names) - len(missing)
+
+        fetched = failed = 0
+        with ThreadPoolExecutor(max_workers=max(1, options['workers']),
+                                thread_name_prefix='warm-definitions') as pool:
+            futures = {pool.submit(fetch_and_store, cache, name): name for name in missing}
+            for future in as_completed(futures):
+                try:
+                    future.result()
+                    fetched += 1
+                except Exception as e:
+                    failed += 1
+                    self.stderr.write(f"{futures[future]}: {e}")
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Fetched {fetched}, already cached {skipped}, failed {failed}"
+        ))
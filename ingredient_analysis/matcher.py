@@ -0,0 +1,152 @@
+from collections import deque
+from typing import Any, Dict, Iterable, List, NamedTuple, Tuple
+
+
+class Match(NamedTuple):
+    """A single pattern hit inside the scanned text"""
+    start: int
+    end: int
+    pattern: str
+    values: Tuple[Any, ...]
+
+
+def _lower_preserving_offsets(text: str) -> str:
+    """Lowercase text without changing its length"""
+    lowered = text.lower()
+    if len(lowered) == len(text):
+        return lowered
+    return ''.join(c if len(c.lower()) != 1 else c.lower() for c in text)
+
+
+class IngredientAutomaton:
+    """Aho-Corasick automaton over lowercased ingredient names.
+
+    Patterns are added with an arbitrary payload, compiled once with
+    ``build()`` and then matched against any number of texts in a single
+    left-to-right pass each.
+    """
+
+    def __init__(self, word_boundaries: bool = True):
+        self.word_boundaries = word_boundaries
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._output: List[List[int]] = [[]]
+        self._patterns: List[str] = []
+        self._values: List[List[Any]] = []
+        self._index: Dict[str, int] = {}
+        self._built = False
+
+    def __len__(self) -> int:
+        return len(self._patterns)
+
+    def add(self, pattern: str, value: Any = None) -> None:
+        """Register a pattern (case-insensitive) with a payload"""
+        pattern = ' '.join(pattern.lower().split())
+        if not pattern:
+            return
+
+        if pattern in self._index:
+            self._values[self._index[pattern]].append(value)
+            return
+
+        node = 0
+        for char in pattern:
+            nxt = self._goto[node].get(char)
+            if nxt is None:
+                nxt = len(self._goto)
+                self._goto[node][char] = nxt
+                self._goto.append({})
+                self._fail.append(0)
+                self._output.append([])
+            node = nxt
+
+        pattern_id = len(self._patterns)
+        self._patterns.append(pattern)
+        self._values.append([value])
+        self._index[pattern] = pattern_id
+        self._output[node].append(pattern_id)
+        self._built = False
+
+    def add_many(self, items: Iterable[Tuple[str, Any]]) -> None:
+        """Register several ``(pattern, value)`` pairs"""
+        for pattern, value in items:
+            self.add(pattern, value)
+
+    def build(self) -> 'IngredientAutomaton':
+        """Compute failure links; must be called before ``search``"""
+        queue = deque()
+        for nxt in self._goto[0].values():
+            self._fail[nxt] = 0
+            queue.append(nxt)
+
+        while queue:
+            node = queue.popleft()
+            for char, nxt in self._goto[node].items():
+                queue.append(nxt)
+                fail = self._fail[node]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                target = self._goto[fail].get(char, 0)
+                self._fail[nxt] = target if target != nxt else 0
+                self._output[nxt] = self._output[nxt] + self._output[self._fail[nxt]]
+
+        self._built = True
+        return self
+
+    def search(self, text: str) -> List[Match]:
+        """Return every pattern occurrence in text with its offsets"""
+        if not self._built:
+            self.build()
+        if not text or not self._patterns:
+            return []
+
+        haystack = _lower_preserving_offsets(text)
+        goto, fail, output = self._goto, self._fail, self._output
+        length = len(haystack)
+        matches = []
+        node = 0
+
+        for pos, char in enumerate(haystack):
+            # Collapse whitespace runs so "sodium\nnitrate" still matches
+            if char.isspace():
+                if pos + 1 < length and haystack[pos + 1].isspace():
+                    continue
+                char = ' '
+
+            while node and char not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(char, 0)
+
+            for pattern_id in output[node]:
+                end = pos + 1
+                start = self._match_start(haystack, end, self._patterns[pattern_id])
+                if self.word_boundaries and not self._on_boundary(haystack, start, end):
+                    continue
+                matches.append(Match(
+                    start,
+                    end,
+                    self._patterns[pattern_id],
+                    tuple(self._values[pattern_id]),
+                ))
+
+        return matches
+
+    @staticmethod
+    def _match_start(haystack: str, end: int, pattern: str) -> int:
+        """Walk back from end to find where a (whitespace-collapsed) match began"""
+        pos = end
+        for char in reversed(pattern):
+            pos -= 1
+            if char == ' ':
+                while pos > 0 and haystack[pos - 1].isspace():
+                    pos -= 1
+        return pos
+
+    @staticmethod
+    def _on_boundary(haystack: str, start: int, end: int) -> bool:
+        """True when the match is not glued to surrounding word characters"""
+        if start > 0 and haystack[start - 1].isalnum():
+            return False
+        if end < len(haystack) and haystack[end].isalnum():
+            return False
+        return True
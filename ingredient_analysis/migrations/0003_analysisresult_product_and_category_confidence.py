@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ingredient_analysis', '0002_ingredientdefinition'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='analysisresult',
+            name='category_confidence',
+            field=models.FloatField(default=0.0),
+        ),
+        migrations.AddField(
+            model_name='analysisresult',
+            name='identified_product',
+            field=models.CharField(blank=True, max_length=255, null=True),
+        ),
+    ]
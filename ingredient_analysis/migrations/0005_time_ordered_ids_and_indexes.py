@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:50
+
+import ocr.ids
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ingredient_analysis', '0004_stage_timings'),
+        ('ocr', '0006_time_ordered_ids_and_indexes'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='analysisresult',
+            name='id',
+            field=models.UUIDField(default=ocr.ids.uuid7, editable=False, primary_key=True, serialize=False),
+        ),
+        migrations.AddIndex(
+            model_name='analysisresult',
+            index=models.Index(fields=['product_category', '-created_at'], name='analysis_category_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='analysisresult',
+            index=models.Index(fields=['-created_at'], name='analysis_recent_idx'),
+        ),
+    ]
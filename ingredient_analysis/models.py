@@ -1,16 +1,36 @@
 from django.db import models
-import uuid
+
+from ocr.ids import uuid7
 
 class AnalysisResult(models.Model):
-    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    id = models.UUIDField(primary_key=True, default=uuid7, editable=False)
     ocr_result = models.OneToOneField('ocr.OCRResult', on_delete=models.CASCADE)
     unsafe_ingredients = models.JSONField(default=list)
     health_conditions = models.JSONField(default=list)
     identified_brand = models.CharField(max_length=255, blank=True, null=True)
+    identified_product = models.CharField(max_length=255, blank=True, null=True)
     product_category = models.CharField(max_length=100, blank=True, null=True)
     confidence_score = models.FloatField(default=0.0)
+    category_confidence = models.FloatField(default=0.0)
     recommendations = models.TextField(blank=True)
+    stage_timings = models.JSONField(default=dict)
     created_at = models.DateTimeField(auto_now_add=True)
     
+    class Meta:
+        indexes = [
+            # Admin category + date filters and per-category history
+            models.Index(fields=['product_category', '-created_at'], name='analysis_category_idx'),
+            models.Index(fields=['-created_at'], name='analysis_recent_idx'),
+        ]
+    
     def __str__(self):
         return f"Analysis {self.id}"
+
+class IngredientDefinition(models.Model):
+    name = models.CharField(max_length=255, primary_key=True)
+    definition = models.TextField(blank=True)
+    found = models.BooleanField(default=True)
+    fetched_at = models.DateTimeField(db_index=True)
+    
+    def __str__(self):
+        return self.name
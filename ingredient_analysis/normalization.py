@@ -0,0 +1,245 @@
+"""Canonical ingredient names and ids.
+
+``normalize`` turns any surface form of an ingredient into a comparable
+key: Unicode-folded, lowercased, punctuation-free, British spellings
+Americanized and common OCR digit/letter confusions undone.
+
+``IngredientVocabulary`` assigns every canonical ingredient a small
+integer id and maps all of its known surface forms (INCI names, common
+names, abbreviations) to that id, so the safety, category and brand
+matchers compare ids instead of strings.
+"""
+import heapq
+import re
+import threading
+import unicodedata
+from collections import defaultdict
+from difflib import SequenceMatcher
+from functools import lru_cache
+from typing import Dict, FrozenSet, Iterable, List, Optional, Set
+
+from django.conf import settings
+
+from .matcher import IngredientAutomaton
+
+FUZZY_THRESHOLD = 0.88
+FUZZY_CANDIDATES = 25
+RESOLVE_CACHE_SIZE = 16384
+
+# Canonical name -> other names for the same ingredient
+SYNONYMS: Dict[str, List[str]] = {
+    'sodium lauryl sulfate': ['sls', 'sodium dodecyl sulfate'],
+    'sodium laureth sulfate': ['sles', 'sodium lauryl ether sulfate'],
+    'ammonium lauryl sulfate': ['als'],
+    'sodium fluoride': ['naf'],
+    'butylated hydroxytoluene': ['bht'],
+    'butylated hydroxyanisole': ['bha'],
+    'bisphenol a': ['bpa'],
+    'monosodium glutamate': ['msg', 'e621'],
+    'high fructose corn syrup': ['hfcs', 'glucose fructose syrup'],
+    'aspartame': ['e951'],
+    'sodium nitrate': ['e251'],
+    'sodium nitrite': ['e250'],
+    'salt': ['sodium chloride'],
+    'water': ['aqua', 'eau'],
+    'glycerin': ['glycerol', 'glycerine'],
+    'titanium dioxide': ['ci 77891', 'e171'],
+    'zinc oxide': ['ci 77947'],
+    'tocopherol': ['vitamin e'],
+    'ascorbic acid': ['vitamin c', 'e300'],
+    'panthenol': ['provitamin b5', 'd panthenol', 'dexpanthenol'],
+    'hyaluronic acid': ['sodium hyaluronate'],
+    'fragrance': ['parfum'],
+    'trans fat': ['partially hydrogenated oil', 'partially hydrogenated vegetable oil'],
+}
+
+_SPELLING_RE = re.compile(r'sulph|aluminium|colour|flavour|caesium')
+_SPELLING = {
+    'sulph': 'sulf',
+    'aluminium': 'aluminum',
+    'colour': 'color',
+    'flavour': 'flavor',
+    'caesium': 'cesium',
+}
+# OCR reads l/i as 1 or |, o as 0 and s as 5 inside words
+_OCR_INNER_RE = re.compile(r'(?<=[a-z])[015|](?=[a-z])')
+_OCR_LEADING_RE = re.compile(r'\b0(?=[a-z]{3})')
+_OCR_DIGITS = {'0': 'o', '1': 'l', '5': 's', '|': 'l'}
+# Letters and digits of any script survive; | is kept for the OCR fix-up below
+_NON_WORD_RE = re.compile(r'(?:[^\w|]|_)+')
+
+
+def normalize_text(text: str) -> str:
+    """Apply the ingredient normalization to free text such as a whole OCR page"""
+    text = unicodedata.normalize('NFKD', text or '')
+    text = ''.join(c for c in text if not unicodedata.combining(c)).casefold()
+    text = _NON_WORD_RE.sub(' ', text)
+    text = _OCR_INNER_RE.sub(lambda m: _OCR_DIGITS[m.group()], text)
+    text = _OCR_LEADING_RE.sub('o', text)
+    text = _SPELLING_RE.sub(lambda m: _SPELLING[m.group()], text)
+    return ' '.join(text.replace('|', ' ').split())
+
+
+@lru_cache(maxsize=RESOLVE_CACHE_SIZE)
+def normalize(text: str) -> str:
+    """Canonical comparison key for an ingredient string (memoized)"""
+    return normalize_text(text)
+
+
+def _compact(key: str) -> str:
+    return key.replace(' ', '')
+
+
+def _trigrams(text: str) -> Set[str]:
+    padded = f'  {text} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class IngredientVocabulary:
+    """Registry of canonical ingredients and the surface forms that map to them.
+
+    Lookups are memoized; adding ingredients clears the memo and marks
+    the containment automaton for a rebuild on next use.
+    """
+
+    def __init__(self, synonyms: Dict[str, Iterable[str]] = None, threshold: float = FUZZY_THRESHOLD):
+        self.threshold = threshold
+        self._names: List[str] = []
+        self._surfaces: List[List[str]] = []
+        self._ids: Dict[str, int] = {}
+        self._compact_ids: Dict[str, int] = {}
+        self._trigram_index: Dict[str, List[str]] = defaultdict(list)
+        self._automaton: Optional[IngredientAutomaton] = None
+        self._lock = threading.RLock()
+        self.resolve = lru_cache(maxsize=RESOLVE_CACHE_SIZE)(self._resolve)
+
+        for name, others in (synonyms or {}).items():
+            self.add(name, others)
+
+    def __len__(self) -> int:
+        return len(self._names)
+
+    def add(self, name: str, synonyms: Iterable[str] = ()) -> Optional[int]:
+        """Register an ingredient and its synonyms; returns its id.
+
+        Names that are already known keep their id, so registering the
+        same ingredient from several sources unifies them.
+        """
+        keys = [key for key in (normalize(n) for n in (name, *synonyms)) if key]
+        if not keys:
+            return None
+
+        with self._lock:
+            known = next((self._ids[key] for key in keys if key in self._ids), None)
+            if known is not None and all(key in self._ids for key in keys):
+                return known
+
+            if known is None:
+                known = len(self._names)
+                self._names.append(keys[0])
+                self._surfaces.append([])
+            for key in keys:
+                if key in self._ids:
+                    continue
+                self._ids[key] = known
+                self._compact_ids.setdefault(_compact(key), known)
+                self._surfaces[known].append(key)
+                for gram in _trigrams(key):
+                    self._trigram_index[gram].append(key)
+
+            self._automaton = None
+            self.resolve.cache_clear()
+            return known
+
+    def add_many(self, names: Iterable[str]) -> List[Optional[int]]:
+        return [self.add(name) for name in names]
+
+    def name(self, ingredient_id: int) -> str:
+        return self._names[ingredient_id]
+
+    def surfaces(self, ingredient_id: int) -> List[str]:
+        """Every normalized surface form registered for an id"""
+        return list(self._surfaces[ingredient_id])
+
+    def lookup(self, text: str) -> Optional[int]:
+        """Exact id for a surface form, ignoring case, punctuation and spacing"""
+        key = normalize(text)
+        found = self._ids.get(key)
+        if found is None:
+            found = self._compact_ids.get(_compact(key))
+        return found
+
+    def _get_automaton(self) -> IngredientAutomaton:
+        automaton = self._automaton
+        if automaton is None:
+            with self._lock:
+                if self._automaton is None:
+                    built = IngredientAutomaton()
+                    built.add_many(self._ids.items())
+                    self._automaton = built.build()
+                automaton = self._automaton
+        return automaton
+
+    def _fuzzy(self, key: str) -> Optional[int]:
+        # Only the surfaces sharing the most trigrams are worth a SequenceMatcher
+        shared: Dict[str, int] = defaultdict(int)
+        for gram in _trigrams(key):
+            for surface in self._trigram_index.get(gram, ()):
+                shared[surface] += 1
+        candidates = heapq.nlargest(FUZZY_CANDIDATES, shared, key=shared.__getitem__)
+
+        best, best_ratio = None, self.threshold
+        for surface in candidates:
+            # SequenceMatcher.ratio() can't exceed 2*min(len)/(sum of lens)
+            if 2 * min(len(surface), len(key)) <= best_ratio * (len(surface) + len(key)):
+                continue
+            matcher = SequenceMatcher(None, surface, key)
+            if matcher.quick_ratio() > best_ratio:
+                ratio = matcher.ratio()
+                if ratio > best_ratio:
+                    best, best_ratio = self._ids[surface], ratio
+        return best
+
+    def _resolve(self, text: str) -> FrozenSet[int]:
+        """Ids for an ingredient string (memoized as ``resolve``).
+
+        The ingredient's own id when it is known; otherwise the ids of
+        known ingredients it contains ("aqua/water" -> water) plus the id
+        of its closest fuzzy match ("sodium fluorid" -> sodium fluoride).
+        """
+        key = normalize(text)
+        if not key:
+            return frozenset()
+
+        exact = self.lookup(key)
+        if exact is not None:
+            return frozenset((exact,))
+
+        found = {
+            ingredient_id
+            for match in self._get_automaton().search(key)
+            for ingredient_id in match.values
+        }
+        fuzzy = self._fuzzy(key)
+        if fuzzy is not None:
+            found.add(fuzzy)
+        return frozenset(found)
+
+
+def build_vocabulary() -> IngredientVocabulary:
+    """A new vocabulary seeded from SYNONYMS and INGREDIENT_SYNONYMS"""
+    return IngredientVocabulary({**SYNONYMS, **getattr(settings, 'INGREDIENT_SYNONYMS', {})})
+
+
+_vocabulary_lock = threading.Lock()
+_vocabulary: Optional[IngredientVocabulary] = None
+
+
+def get_vocabulary() -> IngredientVocabulary:
+    """Process-wide vocabulary seeded from SYNONYMS and INGREDIENT_SYNONYMS"""
+    global _vocabulary
+    if _vocabulary is None:
+        with _vocabulary_lock:
+            if _vocabulary is None:
+                _vocabulary = build_vocabulary()
+    return _vocabulary
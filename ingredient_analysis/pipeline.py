@@ -0,0 +1,589 @@
+"""The analysis pipeline shared by every entry point.
+
+Views, batch requests, queued jobs, streaming and async callers all run
+``AnalysisPipeline``: OCR, then the safety check, brand and category
+detection (independent of each other), then definition enrichment of
+the unsafe ingredients. ``save_outcome`` writes the result rows.
+"""
+import asyncio
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, Iterator, List, NamedTuple, Optional, Sequence, Tuple
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import Q
+
+from monitoring.metrics import counter, histogram
+from ocr.dedup import find_duplicate
+from ocr.models import UploadedImage, OCRResult
+from ocr.services import OCRService
+from ocr.storage import save_derivatives
+from ocr.uploads import EncodedImage
+from .models import AnalysisResult
+from .classifier import SafetyChecker
+from .enrichment import aenrich_unsafe_ingredients, enrich_unsafe_ingredients
+from .brand_matcher import BrandMatcher
+from .category_detector import CategoryDetector
+
+DEFAULT_WORKERS = 4
+DEFAULT_BLOCKING_THREADS = 32
+DEFAULT_ASYNC_OCR_THREADS = 4
+
+STAGE_SECONDS = histogram('analysis_stage_duration_seconds', "Time spent in each analysis stage", ['stage'])
+STAGE_RUNS = counter('analysis_stage_runs', "Analysis stages by outcome (ran, cached, skipped, failed)",
+                     ['stage', 'status'])
+DB_WRITE_SECONDS = histogram(
+    'analysis_db_write_seconds', "Time to write analysis result rows, per transaction", ['path'],
+)
+
+
+def build_response(analysis: AnalysisResult) -> Dict:
+    """Serialize a stored analysis in the shape returned by /api/analyze/"""
+    ocr_result = analysis.ocr_result
+    return {
+        'status': 'success',
+        'analysis_id': str(analysis.id),
+        'extracted_text': ocr_result.raw_text,
+        'ingredients': ocr_result.extracted_ingredients,
+        'unsafe_ingredients': analysis.unsafe_ingredients,
+        'identified_brand': {
+            'name': analysis.identified_brand,
+            'product_name': analysis.identified_product,
+            'confidence': analysis.confidence_score
+        },
+        'product_category': analysis.product_category,
+        'overall_confidence': (analysis.confidence_score + (analysis.category_confidence * 100)) / 2,
+        'recommendations': analysis.recommendations,
+        'ocr_confidence': ocr_result.confidence,
+    }
+
+
+def _cached_analyses(duplicate: UploadedImage, user_conditions: List[str]):
+    # Conditions are stored sorted; rows from before that match as given
+    conditions = Q(health_conditions=sorted(user_conditions)) | Q(health_conditions=list(user_conditions))
+    return (
+        AnalysisResult.objects
+        .select_related('ocr_result')
+        .filter(conditions, ocr_result__image__content_hash=duplicate.content_hash)
+        .order_by('created_at')
+    )
+
+
+def find_cached_analysis(duplicate: UploadedImage, user_conditions: List[str]) -> Optional[AnalysisResult]:
+    """Return a stored analysis of the same image run with the same health conditions"""
+    return _cached_analyses(duplicate, user_conditions).first()
+
+
+async def afind_cached_analysis(duplicate: UploadedImage, user_conditions: List[str]) -> Optional[AnalysisResult]:
+    """``find_cached_analysis`` for async callers"""
+    return await _cached_analyses(duplicate, user_conditions).afirst()
+
+
+@contextmanager
+def _timed(timings: Dict, stage: str):
+    """Record the wall-clock duration of a block in milliseconds"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[stage] = (time.perf_counter() - start) * 1000
+
+
+class AnalysisOutcome(NamedTuple):
+    """Unsaved result rows for one image plus its API payload"""
+    ocr_result: OCRResult
+    analysis: AnalysisResult
+    response: Dict
+
+
+class OCROutput(NamedTuple):
+    """What the OCR half of the pipeline hands to the analysis half"""
+    raw_text: str
+    ingredients: List[str]
+    confidence: float
+    processing_time: float
+    timings: Dict
+    memory: Dict
+    cached: bool
+
+
+def run_ocr(uploaded_image: UploadedImage, preprocess=True,
+            duplicate: Optional[UploadedImage] = None,
+            image: Optional[EncodedImage] = None) -> OCROutput:
+    """OCR an upload and parse its ingredients (blocking: CPU work and the OCR pool).
+
+    ``image`` is the upload's bytes borrowed from the request (see
+    ``ocr.uploads.open_encoded``); without it the stored file is mapped.
+    When ``duplicate`` (an earlier upload of the same image) is given its
+    OCR output is reused and Tesseract is skipped. Otherwise the working
+    copy and thumbnail are written from the decoded pixels (see
+    ``ocr.storage``).
+    """
+    if duplicate is not None:
+        # Same image seen before: reuse its OCR output and skip Tesseract
+        previous = duplicate.ocrresult
+        return OCROutput(
+            previous.raw_text, previous.extracted_ingredients, previous.confidence, 0.0, {}, {}, True,
+        )
+
+    ocr_service = OCRService()
+    raw_text = ocr_service.extract_text(
+        image if image is not None else uploaded_image.source_file.path, preprocess=preprocess,
+    )
+    timings = ocr_service.timings
+    if not uploaded_image.working_copy:
+        with _timed(timings, 'store'):
+            save_derivatives(uploaded_image, ocr_service.decoded)
+    ocr_service.decoded = None
+    with _timed(timings, 'parse'):
+        extracted_ingredients = ocr_service.extract_ingredients(raw_text)
+    return OCROutput(
+        raw_text, extracted_ingredients, ocr_service.confidence, ocr_service.processing_time,
+        timings, ocr_service.memory, False,
+    )
+
+
+def assemble_outcome(uploaded_image: UploadedImage, user_conditions: List[str], ocr: OCROutput,
+                     unsafe_ingredients: List[Dict], brand_result: Dict, category_result: Dict,
+                     analysis_timings: Dict) -> AnalysisOutcome:
+    """Build the unsaved result rows and the API payload from the stage outputs"""
+    ocr_result = OCRResult(
+        image=uploaded_image,
+        raw_text=ocr.raw_text if ocr.raw_text else "No text detected",
+        extracted_ingredients=ocr.ingredients if ocr.ingredients else [],
+        confidence=ocr.confidence,
+        processing_time=ocr.processing_time,
+        stage_timings=_flatten(ocr.timings),
+    )
+
+    analysis = AnalysisResult(
+        ocr_result=ocr_result,
+        unsafe_ingredients=unsafe_ingredients,
+        health_conditions=sorted(user_conditions),
+        identified_brand=brand_result['brand'],
+        identified_product=brand_result['product_name'],
+        product_category=category_result['category'],
+        confidence_score=brand_result['confidence'],
+        category_confidence=category_result['confidence'],
+        recommendations="Analysis complete. Check ingredients.",
+        stage_timings=_flatten(analysis_timings),
+    )
+
+    response = build_response(analysis)
+    response['extracted_text'] = ocr.raw_text
+    response['ingredients'] = ocr.ingredients
+    response['cache'] = {'ocr': 'hit' if ocr.cached else 'miss', 'analysis': 'miss'}
+    response['timings'] = _flatten({**ocr.timings, **analysis_timings})
+    if ocr.memory:
+        response['memory'] = ocr.memory
+    return AnalysisOutcome(ocr_result, analysis, response)
+
+
+class Stage(NamedTuple):
+    """One declared step of the analysis.
+
+    ``func`` takes the AnalysisContext and returns the stage's result;
+    ``afunc`` is its native async version, if any. ``after`` names the
+    stages whose results it reads. ``cache`` may return a stored result
+    (skipping ``func``) and ``default`` supplies the result when the
+    stage is skipped. Stages with ``timed`` set report their duration
+    in the analysis timings. ``blocking`` stages mostly wait on the
+    network; they run on a pool of their own, so a slow lookup never
+    holds a thread the other stages need.
+    """
+    name: str
+    func: Callable
+    after: Tuple[str, ...] = ()
+    afunc: Optional[Callable] = None
+    cache: Optional[Callable] = None
+    default: Optional[Callable] = None
+    timed: bool = True
+    blocking: bool = False
+
+
+class AnalysisContext:
+    """Inputs of one analysis and the stage results gathered so far"""
+
+    def __init__(self, uploaded_image: UploadedImage, user_conditions: List[str], preprocess=True,
+                 duplicate: Optional[UploadedImage] = None, image: Optional[EncodedImage] = None):
+        self.uploaded_image = uploaded_image
+        self.user_conditions = user_conditions
+        self.preprocess = preprocess
+        self.duplicate = duplicate
+        self.image = image
+        self.results: Dict[str, object] = {}
+        self.timings: Dict[str, float] = {}
+
+
+def _ocr(ctx: AnalysisContext) -> OCROutput:
+    return run_ocr(ctx.uploaded_image, ctx.preprocess, None, ctx.image)
+
+
+async def _aocr(ctx: AnalysisContext) -> OCROutput:
+    # CPU work and the wait on the OCR process pool, off the event loop
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_get_async_executor(), _ocr, ctx)
+
+
+def _reused_ocr(ctx: AnalysisContext) -> Optional[OCROutput]:
+    if ctx.duplicate is None:
+        return None
+    return run_ocr(ctx.uploaded_image, ctx.preprocess, ctx.duplicate)
+
+
+def _safety(ctx: AnalysisContext) -> Tuple[SafetyChecker, List[Tuple[str, str]]]:
+    safety_checker = SafetyChecker()
+    return safety_checker, safety_checker.check_safety(ctx.results['ocr'].raw_text, ctx.user_conditions)
+
+
+def _no_safety(ctx: AnalysisContext) -> Tuple[SafetyChecker, List[Tuple[str, str]]]:
+    return SafetyChecker(), []
+
+
+def _brand(ctx: AnalysisContext) -> Dict:
+    return BrandMatcher().identify_brand(ctx.results['ocr'].ingredients)
+
+
+def _no_brand(ctx: AnalysisContext) -> Dict:
+    return {'brand': 'Unknown', 'product_name': 'Generic Product', 'confidence': 0, 'candidates': []}
+
+
+def _category(ctx: AnalysisContext) -> Dict:
+    return CategoryDetector().detect_category(ctx.results['ocr'].ingredients)
+
+
+def _no_category(ctx: AnalysisContext) -> Dict:
+    return {'category': 'UNKNOWN', 'confidence': 0, 'labels': []}
+
+
+def _enrichment(ctx: AnalysisContext) -> List[Dict]:
+    return enrich_unsafe_ingredients(*ctx.results['safety'])
+
+
+async def _aenrichment(ctx: AnalysisContext) -> List[Dict]:
+    return await aenrich_unsafe_ingredients(*ctx.results['safety'])
+
+
+def _no_enrichment(ctx: AnalysisContext) -> List[Dict]:
+    safety_checker, unsafe_raw = ctx.results['safety']
+    return [
+        {'ingredient': ingredient, 'effect': effect, 'definition': None,
+         'definition_status': 'skipped', 'safety': safety_checker.safety_rating(ingredient)}
+        for ingredient, effect in unsafe_raw
+    ]
+
+
+# OCR records its own breakdown (decode, preprocess, ocr, ...) on OCRResult.
+# Only OCR has a stage cache; the in-memory stages after it are cheap to
+# rerun, and a whole stored analysis is reused before the pipeline starts
+# (find_cached_analysis).
+STAGES = (
+    Stage('ocr', _ocr, afunc=_aocr, cache=_reused_ocr, timed=False),
+    Stage('safety', _safety, after=('ocr',), default=_no_safety),
+    Stage('brand', _brand, after=('ocr',), default=_no_brand),
+    Stage('category', _category, after=('ocr',), default=_no_category),
+    Stage('enrichment', _enrichment, after=('safety',), afunc=_aenrichment, default=_no_enrichment,
+          blocking=True),
+)
+
+_stats_lock = threading.Lock()
+_stage_stats: Dict[str, Dict[str, float]] = {}
+
+
+def record_stage(stage: str, status: str, duration: float) -> None:
+    """Default instrumentation hook: per-stage counts by status and total milliseconds.
+
+    Also exported as the analysis_stage_* metrics; only stages that ran
+    go into the duration histogram.
+    """
+    with _stats_lock:
+        stats = _stage_stats.setdefault(
+            stage, {'ran': 0, 'cached': 0, 'skipped': 0, 'failed': 0, 'total_ms': 0.0},
+        )
+        stats[status] += 1
+        stats['total_ms'] += duration
+    STAGE_RUNS.inc(stage=stage, status=status)
+    if status == 'ran':
+        STAGE_SECONDS.observe(duration / 1000, stage=stage)
+
+
+def stage_stats() -> Dict[str, Dict[str, float]]:
+    """Stage counts and timings seen by this process"""
+    with _stats_lock:
+        return {stage: dict(stats) for stage, stats in _stage_stats.items()}
+
+
+_executor_lock = threading.Lock()
+_executor: Optional[ThreadPoolExecutor] = None
+_blocking_executor: Optional[ThreadPoolExecutor] = None
+_async_executor: Optional[ThreadPoolExecutor] = None
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    """Threads that run independent stages side by side"""
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=getattr(settings, 'ANALYSIS_PIPELINE_WORKERS', DEFAULT_WORKERS),
+                    thread_name_prefix='pipeline',
+                )
+    return _executor
+
+
+def _get_blocking_executor() -> ThreadPoolExecutor:
+    """Threads for stages that wait on I/O, sized for every analysis in flight"""
+    global _blocking_executor
+    if _blocking_executor is None:
+        with _executor_lock:
+            if _blocking_executor is None:
+                _blocking_executor = ThreadPoolExecutor(
+                    max_workers=getattr(settings, 'ANALYSIS_PIPELINE_BLOCKING_THREADS', DEFAULT_BLOCKING_THREADS),
+                    thread_name_prefix='pipeline-io',
+                )
+    return _blocking_executor
+
+
+def _stage_executor(stage: Stage) -> ThreadPoolExecutor:
+    return _get_blocking_executor() if stage.blocking else _get_executor()
+
+
+def _get_async_executor() -> ThreadPoolExecutor:
+    """Threads that run (and wait on) OCR for async callers"""
+    global _async_executor
+    if _async_executor is None:
+        with _executor_lock:
+            if _async_executor is None:
+                _async_executor = ThreadPoolExecutor(
+                    max_workers=getattr(settings, 'ANALYSIS_ASYNC_OCR_THREADS', DEFAULT_ASYNC_OCR_THREADS),
+                    thread_name_prefix='async-ocr',
+                )
+    return _async_executor
+
+
+def _pooled(func: Callable, *args):
+    # Pool threads keep their own connections; treat each call like a request
+    close_old_connections()
+    try:
+        return func(*args)
+    finally:
+        close_old_connections()
+
+
+class AnalysisPipeline:
+    """OCR -> safety, brand, category -> enrichment, as declared stages.
+
+    A stage starts as soon as the stages it reads have finished; with
+    ``concurrent`` the ones that are ready together (safety, brand and
+    category, then enrichment alongside whatever is still running) go
+    to shared thread pools. Stages named in ``skip`` are replaced by
+    their default result, and ``bypass_cache`` makes a stage run even
+    when its cache has a result. Every stage reports
+    ``(stage, status, milliseconds)`` to ``instrument``, with status one
+    of ran, cached, skipped or failed.
+    """
+
+    def __init__(self, stages: Sequence[Stage] = STAGES, skip: Iterable[str] = (),
+                 bypass_cache: Iterable[str] = (), concurrent: bool = True,
+                 instrument: Callable[[str, str, float], None] = record_stage):
+        names = [stage.name for stage in stages]
+        for stage in stages:
+            missing = [name for name in stage.after if name not in names[:names.index(stage.name)]]
+            if missing:
+                raise ValueError(f"Stage {stage.name!r} must come after {', '.join(missing)}")
+        self.skip = frozenset(skip)
+        self.bypass_cache = frozenset(bypass_cache)
+        for name in self.skip | self.bypass_cache:
+            if name not in names:
+                raise ValueError(f"Unknown stage {name!r}. Available: {', '.join(names)}")
+        for stage in stages:
+            if stage.name in self.skip and stage.default is None:
+                raise ValueError(f"Stage {stage.name!r} can't be skipped")
+        self.stages = tuple(stages)
+        self.concurrent = concurrent
+        self.instrument = instrument
+
+    def _prepare(self, stage: Stage, ctx: AnalysisContext) -> Optional[str]:
+        """Resolve a skipped or cached stage; returns its status, or None if it must run"""
+        start = time.perf_counter()
+        status = None
+        if stage.name in self.skip:
+            ctx.results[stage.name] = stage.default(ctx)
+            status = 'skipped'
+        elif stage.cache is not None and stage.name not in self.bypass_cache:
+            cached = stage.cache(ctx)
+            if cached is not None:
+                ctx.results[stage.name] = cached
+                status = 'cached'
+        if status is not None:
+            self.instrument(stage.name, status, (time.perf_counter() - start) * 1000)
+        return status
+
+    def _finish(self, stage: Stage, ctx: AnalysisContext, start: float, result=None, failed=False) -> None:
+        duration = (time.perf_counter() - start) * 1000
+        self.instrument(stage.name, 'failed' if failed else 'ran', duration)
+        if not failed:
+            ctx.results[stage.name] = result
+            if stage.timed:
+                ctx.timings[stage.name] = duration
+
+    def _run_stage(self, stage: Stage, ctx: AnalysisContext) -> None:
+        if self._prepare(stage, ctx) is not None:
+            return
+        start = time.perf_counter()
+        try:
+            result = stage.func(ctx)
+        except Exception:
+            self._finish(stage, ctx, start, failed=True)
+            raise
+        self._finish(stage, ctx, start, result)
+
+    def _ready(self, pending: List[Stage], ctx: AnalysisContext) -> List[Stage]:
+        ready = [stage for stage in pending if all(name in ctx.results for name in stage.after)]
+        for stage in ready:
+            pending.remove(stage)
+        return ready
+
+    def iter_stages(self, ctx: AnalysisContext) -> Iterator[Tuple[str, object]]:
+        """Run every stage, yielding ``(stage, result)`` as each one finishes"""
+        pending = list(self.stages)
+        running = {}
+        while pending or running:
+            ready = self._ready(pending, ctx)
+            if self.concurrent and (len(ready) > 1 or running):
+                for stage in ready:
+                    running[_stage_executor(stage).submit(_pooled, self._run_stage, stage, ctx)] = stage
+            else:
+                # A lone stage runs on the calling thread
+                for stage in ready:
+                    self._run_stage(stage, ctx)
+                    yield stage.name, ctx.results[stage.name]
+                continue
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                stage = running.pop(future)
+                future.result()
+                yield stage.name, ctx.results[stage.name]
+
+    def outcome(self, ctx: AnalysisContext) -> AnalysisOutcome:
+        """Build the unsaved result rows once every stage has finished"""
+        return assemble_outcome(
+            ctx.uploaded_image, ctx.user_conditions, ctx.results['ocr'],
+            ctx.results['enrichment'], ctx.results['brand'], ctx.results['category'], ctx.timings,
+        )
+
+    def run(self, uploaded_image: UploadedImage, user_conditions: List[str], preprocess=True,
+            duplicate: Optional[UploadedImage] = None,
+            image: Optional[EncodedImage] = None) -> AnalysisOutcome:
+        """Run OCR and ingredient analysis for an upload without saving the result rows.
+
+        See ``run_ocr`` for ``duplicate`` and ``image``. Stage timings (ms)
+        go on the OCRResult (decode, region, preprocess, ocr, store, parse)
+        and AnalysisResult (safety, brand, category, enrichment) rows.
+        """
+        ctx = AnalysisContext(uploaded_image, user_conditions, preprocess, duplicate, image)
+        for _ in self.iter_stages(ctx):
+            pass
+        return self.outcome(ctx)
+
+    async def _arun_stage(self, stage: Stage, ctx: AnalysisContext) -> None:
+        if self._prepare(stage, ctx) is not None:
+            return
+        start = time.perf_counter()
+        try:
+            if stage.afunc is not None:
+                result = await stage.afunc(ctx)
+            else:
+                # The stage pool rather than sync_to_async's single shared
+                # thread, so independent stages still overlap
+                loop = asyncio.get_running_loop()
+                result = await loop.run_in_executor(_stage_executor(stage), _pooled, stage.func, ctx)
+        except Exception:
+            self._finish(stage, ctx, start, failed=True)
+            raise
+        self._finish(stage, ctx, start, result)
+
+    async def arun(self, uploaded_image: UploadedImage, user_conditions: List[str], preprocess=True,
+                   duplicate: Optional[UploadedImage] = None,
+                   image: Optional[EncodedImage] = None) -> AnalysisOutcome:
+        """``run`` for async callers: native async stages are awaited, the rest run on the stage pool"""
+        ctx = AnalysisContext(uploaded_image, user_conditions, preprocess, duplicate, image)
+        pending = list(self.stages)
+        running = {}
+        while pending or running:
+            for stage in self._ready(pending, ctx):
+                running[asyncio.ensure_future(self._arun_stage(stage, ctx))] = stage
+            done, _ = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                running.pop(task)
+                task.result()
+        return self.outcome(ctx)
+
+
+_pipeline_lock = threading.Lock()
+_pipeline: Optional[AnalysisPipeline] = None
+
+
+def get_pipeline() -> AnalysisPipeline:
+    """The pipeline configured by ANALYSIS_PIPELINE_SKIP and ANALYSIS_PIPELINE_WORKERS"""
+    global _pipeline
+    if _pipeline is None:
+        with _pipeline_lock:
+            if _pipeline is None:
+                _pipeline = AnalysisPipeline(
+                    skip=getattr(settings, 'ANALYSIS_PIPELINE_SKIP', ()),
+                    concurrent=getattr(settings, 'ANALYSIS_PIPELINE_WORKERS', DEFAULT_WORKERS) > 1,
+                )
+    return _pipeline
+
+
+def analyze_image(uploaded_image: UploadedImage, user_conditions: List[str], preprocess=True,
+                  duplicate: Optional[UploadedImage] = None,
+                  image: Optional[EncodedImage] = None,
+                  pipeline: Optional[AnalysisPipeline] = None) -> AnalysisOutcome:
+    """Run ``pipeline`` (by default the configured one) without saving the result rows"""
+    pipeline = pipeline or get_pipeline()
+    return pipeline.run(uploaded_image, user_conditions, preprocess, duplicate, image)
+
+
+def save_outcome(uploaded_image: UploadedImage, outcome: AnalysisOutcome) -> None:
+    """Insert the result rows and mark the upload done, in one transaction (a single commit)"""
+    db_timings = {}
+    with _timed(db_timings, 'db'), transaction.atomic():
+        outcome.ocr_result.save(force_insert=True)
+        outcome.analysis.save(force_insert=True)
+
+        uploaded_image.processed = True
+        uploaded_image.status = UploadedImage.Status.DONE
+        uploaded_image.save(update_fields=['processed', 'status', 'working_copy', 'thumbnail'])
+
+    DB_WRITE_SECONDS.observe(db_timings['db'] / 1000, path='single')
+    outcome.response['timings'].update(_flatten(db_timings))
+
+
+def run_analysis(uploaded_image: UploadedImage, user_conditions: List[str], preprocess=True,
+                 image: Optional[EncodedImage] = None,
+                 pipeline: Optional[AnalysisPipeline] = None) -> Dict:
+    """Run OCR and ingredient analysis for a stored upload and persist the results"""
+    duplicate = find_duplicate(uploaded_image.content_hash, exclude=uploaded_image.pk)
+    outcome = analyze_image(uploaded_image, user_conditions, preprocess, duplicate, image, pipeline)
+    save_outcome(uploaded_image, outcome)
+    return outcome.response
+
+
+def _flatten(timings: Dict) -> Dict[str, float]:
+    """Flatten nested stage timings ({'preprocess': {'deskew': ..}}) to dotted keys"""
+    flat = {}
+    for stage, value in timings.items():
+        if isinstance(value, dict):
+            for sub_stage, sub_value in value.items():
+                flat[f'{stage}.{sub_stage}'] = round(sub_value, 3)
+            flat[stage] = round(sum(value.values()), 3)
+        else:
+            flat[stage] = round(value, 3)
+    return flat
@@ -0,0 +1,103 @@
+"""Stage-by-stage streaming of a single analysis (/api/analyze/stream/).
+
+Each pipeline stage is sent as soon as it finishes: OCR text and parsed
+ingredients, then the unsafe list, brand and category, then the enriched
+definitions. A client can therefore show the OCR result after the OCR
+latency instead of waiting for the whole pipeline. The last event,
+``complete``, carries the same payload /api/analyze/ returns, after the
+result rows are saved. A failure ends the stream with an ``error``
+event.
+
+Events are NDJSON lines (``{"stage": ..., ...}``) by default, like the
+batch endpoint, or Server-Sent Events when the client accepts
+``text/event-stream``.
+"""
+import json
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from ocr.models import UploadedImage
+from ocr.uploads import EncodedImage
+from .pipeline import AnalysisContext, AnalysisPipeline, get_pipeline, save_outcome
+
+NDJSON = 'application/x-ndjson'
+SSE = 'text/event-stream'
+
+
+def stream_format(request) -> str:
+    """SSE when the client asks for it, NDJSON otherwise"""
+    return SSE if SSE in request.headers.get('Accept', '') else NDJSON
+
+
+def encode_event(stage: str, payload: Dict, content_type: str = NDJSON) -> str:
+    if content_type == SSE:
+        return f'event: {stage}\ndata: {json.dumps(payload)}\n\n'
+    return json.dumps({'stage': stage, **payload}) + '\n'
+
+
+def stream_cached(response: Dict, content_type: str = NDJSON) -> Iterator[str]:
+    """A stored analysis needs no stages, only the final event"""
+    yield encode_event('complete', response, content_type)
+
+
+def stage_events(stage: str, result) -> Iterator[Tuple[str, Dict]]:
+    """The client-facing events for one finished pipeline stage"""
+    if stage == 'ocr':
+        yield 'ocr', {
+            'extracted_text': result.raw_text,
+            'ocr_confidence': result.confidence,
+            'cache': {'ocr': 'hit' if result.cached else 'miss', 'analysis': 'miss'},
+        }
+        yield 'ingredients', {'ingredients': result.ingredients}
+    elif stage == 'safety':
+        safety_checker, unsafe_raw = result
+        yield 'unsafe', {'unsafe_ingredients': [
+            {'ingredient': ingredient, 'effect': effect,
+             'safety': safety_checker.safety_rating(ingredient)}
+            for ingredient, effect in unsafe_raw
+        ]}
+    elif stage == 'brand':
+        yield 'brand', {'identified_brand': {
+            'name': result['brand'],
+            'product_name': result['product_name'],
+            'confidence': result['confidence'],
+        }}
+    elif stage == 'category':
+        yield 'category', {
+            'product_category': result['category'],
+            'category_confidence': result['confidence'],
+        }
+    elif stage == 'enrichment':
+        yield 'definitions', {'unsafe_ingredients': result}
+
+
+def stream_analysis(uploaded_image: UploadedImage, user_conditions: List[str], preprocess=True,
+                    duplicate: Optional[UploadedImage] = None,
+                    image: Optional[EncodedImage] = None,
+                    content_type: str = NDJSON,
+                    pipeline: Optional[AnalysisPipeline] = None) -> Iterator[str]:
+    """Analyze a stored upload, yielding encoded events as stages finish, then save the results"""
+    pipeline = pipeline or get_pipeline()
+    ctx = AnalysisContext(uploaded_image, user_conditions, preprocess, duplicate, image)
+    try:
+        for stage, result in pipeline.iter_stages(ctx):
+            for event, payload in stage_events(stage, result):
+                yield encode_event(event, payload, content_type)
+        outcome = pipeline.outcome(ctx)
+        save_outcome(uploaded_image, outcome)
+    except GeneratorExit:
+        # The client went away mid-analysis; nothing is left to finish it
+        _mark_failed(uploaded_image, "Stream closed before the analysis finished")
+        raise
+    except Exception as e:
+        _mark_failed(uploaded_image, str(e))
+        yield encode_event('error', {'error': f'Error: {str(e)}'}, content_type)
+        return
+
+    yield encode_event('complete', outcome.response, content_type)
+
+
+def _mark_failed(uploaded_image: UploadedImage, error: str) -> None:
+    UploadedImage.objects.filter(pk=uploaded_image.pk).update(
+        status=UploadedImage.Status.FAILED,
+        error=error,
+    )
@@ -1,3 +1,757 @@
-from django.test import TestCase
+import asyncio
+import io
+import json
+import os
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from difflib import SequenceMatcher
+from itertools import product
+from unittest import mock, skipUnless
 
-# Create your tests here.
+import numpy as np
+from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import DatabaseError, connection
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+from PIL import Image
+
+from ocr.engine import get_ocr_engine, set_ocr_engine
+from ocr.models import OCRResult, UploadedImage
+from ocr.preprocessing import UnknownProfile
+from ocr.storage import discard_upload_files
+from . import category_detector, normalization
+from .async_pipeline import AnalysisBusy, analysis_slot
+from .batch import _abandon, run_batch
+from .brand_matcher import BrandIndex
+from .category_detector import DEFAULT_SIGNATURES, CategoryDetector, CategoryModel, load_signatures
+from .classifier import SafetyChecker
+from .definitions import (
+    DEFINITION_NOT_FOUND, DEFINITION_UNAVAILABLE, DefinitionCache, DefinitionFetcher,
+    get_definition_cache, set_definition_cache,
+)
+from .enrichment import afetch_definitions, fetch_definitions
+from .history import HistoryError, decode_cursor, history_page, load_page
+from .jobs import (
+    QueueFull, _worker_main, claim_next_job, enqueue, process_job, queue_depth, requeue_stale_jobs,
+)
+from .knowledge_base import SNAPSHOT_FORMAT_VERSION, KnowledgeBase
+from .matcher import IngredientAutomaton
+from .models import AnalysisResult, IngredientDefinition
+from .normalization import FUZZY_CANDIDATES, IngredientVocabulary
+from .pipeline import AnalysisContext, AnalysisOutcome, AnalysisPipeline, OCROutput, Stage, save_outcome
+from .streaming import NDJSON, SSE, stream_analysis, stream_cached, stream_format
+
+
+class FuzzyCandidateTests(SimpleTestCase):
+    def setUp(self):
+        self.vocabulary = IngredientVocabulary()
+        # Hundreds of surfaces as long as the misspelling and sharing most of its trigrams
+        for a, b in product('bcdfghjklmpqstvwxyz', repeat=2):
+            self.vocabulary.add(f'sodium fluo{a}{b}x')
+        self.fluoride = self.vocabulary.add('sodium fluoride')
+
+    def test_only_the_top_trigram_matches_are_compared(self):
+        with mock.patch.object(normalization, 'SequenceMatcher', wraps=SequenceMatcher) as matcher:
+            self.assertIn(self.fluoride, self.vocabulary.resolve('sodium fluorid'))
+        self.assertLessEqual(matcher.call_count, FUZZY_CANDIDATES)
+
+    def test_brand_index_matches_misspelled_key_ingredients(self):
+        index = BrandIndex({'TOOTHPASTE': [{
+            'name': 'Colgate Total 12', 'brand': 'Colgate',
+            'key_ingredients': ['Sodium Fluoride', 'Hydrated Silica'],
+        }]}, self.vocabulary)
+        [(score, match)] = index.search(['sodium fluorid', 'hydrated silica'])
+        self.assertEqual(score, 1.0)
+        self.assertEqual(match['name'], 'Colgate Total 12')
+
+
+class CategoryModelTests(SimpleTestCase):
+    def setUp(self):
+        self.model = CategoryModel({
+            'TOOTHPASTE': {'indicators': ['Sodium Fluoride', 'Hydrated Silica'], 'confidence': 0.9},
+            'MOUTHWASH': {'indicators': {'sodium fluoride': 3, 'cetylpyridinium chloride': 1}},
+            'GUM': {'indicators': ['xylitol'], 'confidence': 0.45},
+        }, IngredientVocabulary({'sodium fluoride': ['naf']}))
+        self.lists = [
+            ['NaF'],
+            ['Sodium Fluoride', 'Hydrated Silica', 'Cetylpyridinium Chloride'],
+            ['Hydrated Silica', 'Xylitol'],
+            ['Water'],
+        ]
+
+    def test_every_category_is_scored_and_ranked(self):
+        self.assertEqual(self.model.classify_many(self.lists, top_k=2), [
+            [{'category': 'MOUTHWASH', 'confidence': 0.75}, {'category': 'TOOTHPASTE', 'confidence': 0.45}],
+            [{'category': 'MOUTHWASH', 'confidence': 1.0}, {'category': 'TOOTHPASTE', 'confidence': 0.9}],
+            # Ties go to the category declared first
+            [{'category': 'TOOTHPASTE', 'confidence': 0.45}, {'category': 'GUM', 'confidence': 0.45}],
+            [],
+        ])
+
+    def test_detector_falls_back_to_unknown(self):
+        detector = CategoryDetector(self.model)
+        self.assertEqual(detector.detect_category(['Water']), {'category': 'UNKNOWN', 'confidence': 0, 'labels': []})
+        self.assertEqual(
+            [result['category'] for result in detector.detect_categories(self.lists)],
+            ['MOUTHWASH', 'MOUTHWASH', 'TOOTHPASTE', 'UNKNOWN'],
+        )
+
+    @skipUnless(category_detector.sparse, 'SciPy is not installed')
+    def test_sparse_product_matches_the_numpy_fallback(self):
+        expected = self.model.scores(self.lists)
+        with mock.patch.object(category_detector, 'sparse', None):
+            np.testing.assert_allclose(self.model.scores(self.lists), expected)
+
+    def test_signatures_are_read_from_the_configured_file(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'categories.json')
+            with open(path, 'w', encoding='utf-8') as fh:
+                json.dump({'SOAP': {'indicators': ['sodium tallowate']}}, fh)
+            self.assertEqual(load_signatures(path), {'SOAP': {'indicators': ['sodium tallowate']}})
+            self.assertIs(load_signatures(os.path.join(directory, 'missing.json')), DEFAULT_SIGNATURES)
+
+
+class VocabularyTests(SimpleTestCase):
+    def test_letters_of_every_script_survive_normalization(self):
+        self.assertEqual(normalization.normalize_text('Crème, Вода; 水_砂糖'), 'creme вода 水 砂糖')
+        self.assertEqual(normalization.normalize_text('G|ycerin'), 'glycerin')
+
+    def test_knowledge_base_leaves_the_shared_vocabulary_alone(self):
+        shared = normalization.get_vocabulary()
+        size = len(shared)
+        knowledge_base = KnowledgeBase([('Zylitholene', 'Made up')])
+
+        self.assertEqual(len(shared), size)
+        self.assertIsNone(shared.lookup('zylitholene'))
+        self.assertIsNotNone(knowledge_base.vocabulary.lookup('zylitholene'))
+
+    def test_safety_checker_only_reads_the_vocabulary(self):
+        knowledge_base = KnowledgeBase([('Aspartame', 'Sweetener')])
+        SafetyChecker(knowledge_base=knowledge_base).safety_rating('Aspartame')
+        cached = knowledge_base.vocabulary.resolve.cache_info().currsize
+
+        checker = SafetyChecker(knowledge_base=knowledge_base)
+        self.assertEqual(knowledge_base.vocabulary.resolve.cache_info().currsize, cached)
+        self.assertEqual(checker.safety_rating('Aspartame'), 'HARMFUL')
+        self.assertEqual(checker.safety_rating('Sugar'), 'MODERATE')
+
+
+class AutomatonTests(SimpleTestCase):
+    def setUp(self):
+        self.automaton = IngredientAutomaton()
+        self.automaton.add_many([
+            ('Sodium Lauryl Sulfate', 'sls'),
+            ('lauryl', 'lauryl'),
+            ('Sulfate', 'sulfate'),
+            ('salt', 'salt'),
+        ])
+
+    def search(self, text):
+        return [(text[match.start:match.end], match.values) for match in self.automaton.search(text)]
+
+    def test_overlapping_patterns_are_all_reported(self):
+        self.assertEqual(self.search('Water, Sodium Lauryl Sulfate'), [
+            ('Lauryl', ('lauryl',)),
+            ('Sodium Lauryl Sulfate', ('sls',)),
+            ('Sulfate', ('sulfate',)),
+        ])
+
+    def test_whitespace_runs_match_a_single_space(self):
+        self.assertIn(('sodium\n  lauryl   sulfate', ('sls',)), self.search('sodium\n  lauryl   sulfate'))
+
+    def test_word_boundaries(self):
+        self.assertEqual(self.search('Saltwater, Sea salt'), [('salt', ('salt',))])
+        loose = IngredientAutomaton(word_boundaries=False)
+        loose.add('salt')
+        self.assertEqual(len(loose.search('Saltwater, Sea salt')), 2)
+
+    def test_duplicate_patterns_collect_their_values(self):
+        self.automaton.add('SALT', 'sodium chloride')
+        self.assertEqual(len(self.automaton), 4)
+        self.assertEqual(self.search('salt'), [('salt', ('salt', 'sodium chloride'))])
+
+    def test_patterns_added_after_a_search_are_matched(self):
+        self.assertEqual(self.search('glycerin'), [])
+        self.automaton.add('glycerin', 'glycerin')
+        self.assertEqual(self.search('Glycerin'), [('Glycerin', ('glycerin',))])
+
+
+class PipelineTests(SimpleTestCase):
+    def setUp(self):
+        self.events = []
+        self.lock = threading.Lock()
+
+    def instrument(self, stage, status, duration):
+        with self.lock:
+            self.events.append((stage, status))
+
+    def stage(self, name, after=(), **options):
+        def func(ctx):
+            for dependency in after:
+                self.assertIn(dependency, ctx.results)
+            return f'{name} result'
+        return Stage(name, mock.Mock(side_effect=func), tuple(after), **options)
+
+    def run_stages(self, stages, **options):
+        pipeline = AnalysisPipeline(stages, instrument=self.instrument, **options)
+        ctx = AnalysisContext(None, [])
+        order = [name for name, _ in pipeline.iter_stages(ctx)]
+        return ctx, order
+
+    def test_stages_run_after_the_stages_they_read(self):
+        stages = [
+            self.stage('ocr'),
+            self.stage('brand', after=['ocr']),
+            self.stage('safety', after=['ocr']),
+            self.stage('enrichment', after=['safety']),
+        ]
+        for concurrent in (False, True):
+            with self.subTest(concurrent=concurrent):
+                ctx, order = self.run_stages(stages, concurrent=concurrent)
+                self.assertEqual(order[0], 'ocr')
+                self.assertLess(order.index('safety'), order.index('enrichment'))
+                self.assertEqual(ctx.results['enrichment'], 'enrichment result')
+                self.assertEqual(set(ctx.timings), {'ocr', 'brand', 'safety', 'enrichment'})
+
+    def test_skipped_stage_uses_its_default(self):
+        safety = self.stage('safety', default=lambda ctx: 'default')
+        ctx, _ = self.run_stages([safety, self.stage('enrichment', after=['safety'])], skip=['safety'])
+        safety.func.assert_not_called()
+        self.assertEqual(ctx.results['safety'], 'default')
+        self.assertNotIn('safety', ctx.timings)
+        self.assertIn(('safety', 'skipped'), self.events)
+
+    def test_cached_result_replaces_the_stage(self):
+        ocr = self.stage('ocr', cache=lambda ctx: 'cached')
+        ctx, _ = self.run_stages([ocr])
+        ocr.func.assert_not_called()
+        self.assertEqual(ctx.results['ocr'], 'cached')
+        self.assertEqual(self.events, [('ocr', 'cached')])
+
+        ctx, _ = self.run_stages([ocr], bypass_cache=['ocr'])
+        self.assertEqual(ctx.results['ocr'], 'ocr result')
+
+    def test_empty_cache_runs_the_stage(self):
+        ctx, _ = self.run_stages([self.stage('ocr', cache=lambda ctx: None)])
+        self.assertEqual(ctx.results['ocr'], 'ocr result')
+        self.assertEqual(self.events, [('ocr', 'ran')])
+
+    def test_failed_stage_is_reported_and_raised(self):
+        ocr = self.stage('ocr')
+        ocr.func.side_effect = RuntimeError('OCR failed')
+        with self.assertRaisesMessage(RuntimeError, 'OCR failed'):
+            self.run_stages([ocr, self.stage('safety', after=['ocr'])])
+        self.assertEqual(self.events, [('ocr', 'failed')])
+
+    def test_blocking_stages_run_on_their_own_pool(self):
+        threads = {}
+        enriching = threading.Event()
+
+        def record(name):
+            def func(ctx):
+                threads[name] = threading.current_thread().name
+                if name == 'brand':
+                    self.assertTrue(enriching.wait(5))
+                elif name == 'enrichment':
+                    enriching.set()
+            return func
+
+        # brand is still running when enrichment becomes ready
+        stages = [
+            Stage('ocr', record('ocr')),
+            Stage('brand', record('brand'), ('ocr',)),
+            Stage('safety', record('safety'), ('ocr',)),
+            Stage('enrichment', record('enrichment'), ('safety',), blocking=True),
+        ]
+        self.run_stages(stages)
+        self.assertTrue(threads['brand'].startswith('pipeline_'))
+        self.assertTrue(threads['enrichment'].startswith('pipeline-io_'))
+
+    def test_invalid_configurations(self):
+        with self.assertRaisesMessage(ValueError, "Stage 'safety' must come after ocr"):
+            AnalysisPipeline([self.stage('safety', after=['ocr']), self.stage('ocr')])
+        with self.assertRaisesMessage(ValueError, "Unknown stage 'brand'"):
+            AnalysisPipeline([self.stage('ocr')], skip=['brand'])
+        with self.assertRaisesMessage(ValueError, "Stage 'ocr' can't be skipped"):
+            AnalysisPipeline([self.stage('ocr')], skip=['ocr'])
+
+
+class HistoryTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.analyses = []
+        now = timezone.now()
+        for i, brand in enumerate(['Colgate', 'Crest', 'Colgate', 'Sensodyne', 'Colgate']):
+            image = UploadedImage.objects.create(status=UploadedImage.Status.DONE)
+            ocr_result = OCRResult.objects.create(
+                image=image, raw_text=f'label {i}', extracted_ingredients=['Water'], processing_time=0.1,
+            )
+            analysis = AnalysisResult.objects.create(
+                ocr_result=ocr_result, identified_brand=brand, product_category='TOOTHPASTE',
+                unsafe_ingredients=[{'ingredient': 'Triclosan'}] if brand == 'Crest' else [],
+            )
+            cls.analyses.append(analysis)
+        # Two rows share a timestamp, so the cursor has to break the tie on id
+        for analysis, created_at in zip(cls.analyses, [now, now, now - timedelta(1), now - timedelta(2), now - timedelta(3)]):
+            AnalysisResult.objects.filter(pk=analysis.pk).update(created_at=created_at)
+
+    def pages(self, **params):
+        keys, cursor = [], None
+        while True:
+            page = history_page({**params, **({'cursor': cursor} if cursor else {})})
+            keys.append(page.keys)
+            cursor = page.next_cursor
+            if cursor is None:
+                return keys
+
+    def test_cursor_walks_every_row_once_newest_first(self):
+        expected = list(AnalysisResult.objects.order_by('-created_at', '-id').values_list('id', flat=True))
+        pages = self.pages(limit='2')
+        self.assertEqual([len(keys) for keys in pages], [2, 2, 1])
+        self.assertEqual([pk for keys in pages for pk in keys], expected)
+
+    def test_filters_apply_to_every_page(self):
+        pages = self.pages(limit='1', brand='colgate')
+        self.assertEqual(len(pages), 3)
+        self.assertEqual(history_page({'unsafe': 'Triclosan'}).keys, [self.analyses[1].pk])
+
+    def test_etag_follows_the_page_contents(self):
+        before = history_page({'limit': '2'})
+        self.assertEqual(before.etag, history_page({'limit': '2'}).etag)
+        self.assertNotEqual(before.etag, history_page({'limit': '2', 'fields': 'timings'}).etag)
+        self.analyses[0].delete()
+        self.assertNotEqual(before.etag, history_page({'limit': '2'}).etag)
+
+    def test_detail_fields_are_opt_in(self):
+        [item] = load_page(history_page({'limit': '1', 'fields': 'ingredients'}))
+        self.assertEqual(item['ingredients'], ['Water'])
+        self.assertNotIn('extracted_text', item)
+
+    def test_invalid_parameters(self):
+        for params in ({'cursor': 'not-a-cursor'}, {'limit': 'ten'}, {'fields': 'password'}):
+            with self.subTest(params=params), self.assertRaises(HistoryError):
+                history_page(params)
+        with self.assertRaises(HistoryError):
+            decode_cursor('')
+
+
+class CountingFetcher(DefinitionFetcher):
+    def __init__(self, definitions, barrier=None):
+        self.definitions = definitions
+        self.barrier = barrier
+        self.calls = []
+
+    def fetch(self, ingredient):
+        self.calls.append(ingredient)
+        if self.barrier is not None:
+            self.barrier.wait()
+        if ingredient == 'flaky':
+            raise ConnectionError('timed out')
+        return self.definitions.get(ingredient.lower())
+
+
+class DefinitionCacheTests(TestCase):
+    def setUp(self):
+        self.fetcher = CountingFetcher({'glycerin': 'A sugar alcohol.'})
+        self.cache = DefinitionCache(self.fetcher, ttl=3600, negative_ttl=60)
+
+    def test_fetchers_must_implement_fetch(self):
+        with self.assertRaises(TypeError):
+            DefinitionFetcher()
+
+    def test_answers_are_cached_in_both_tiers(self):
+        self.assertEqual(self.cache.get('Glycerin'), 'A sugar alcohol.')
+        self.assertEqual(self.cache.get('glycerin '), 'A sugar alcohol.')
+        self.assertEqual(self.fetcher.calls, ['Glycerin'])
+
+        fresh = DefinitionCache(self.fetcher, ttl=3600)
+        self.assertEqual(fresh.lookup('GLYCERIN'), (True, 'A sugar alcohol.'))
+
+    def test_not_found_is_cached_with_the_negative_ttl(self):
+        self.assertEqual(self.cache.get('unobtainium'), DEFINITION_NOT_FOUND)
+        self.assertEqual(self.cache.get('unobtainium'), DEFINITION_NOT_FOUND)
+        self.assertEqual(self.fetcher.calls, ['unobtainium'])
+
+        IngredientDefinition.objects.filter(name='unobtainium').update(
+            fetched_at=timezone.now() - timedelta(seconds=61),
+        )
+        self.assertIsNone(DefinitionCache(self.fetcher, negative_ttl=60).lookup('unobtainium'))
+
+    def test_failures_are_not_cached(self):
+        self.assertEqual(self.cache.get('flaky'), DEFINITION_UNAVAILABLE)
+        self.assertEqual(self.cache.get('flaky'), DEFINITION_UNAVAILABLE)
+        self.assertEqual(self.fetcher.calls, ['flaky', 'flaky'])
+        self.assertFalse(IngredientDefinition.objects.exists())
+
+
+class WarmDefinitionsTests(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.source = os.path.join(directory.name, 'harmful.xlsx')
+        with open(os.path.join(directory.name, 'harmful.json'), 'w', encoding='utf-8') as fh:
+            json.dump({'version': SNAPSHOT_FORMAT_VERSION, 'source_mtime': None, 'health_risks': {},
+                       'harmful': [['paraben', ''], ['triclosan', ''], ['flaky', '']]}, fh)
+        self.addCleanup(set_definition_cache, get_definition_cache())
+
+    def warm(self, fetcher, *args):
+        cache = DefinitionCache(fetcher, persistent=False)
+        set_definition_cache(cache)
+        stdout, stderr = io.StringIO(), io.StringIO()
+        call_command('warm_definitions', '--source', self.source, *args, stdout=stdout, stderr=stderr)
+        return cache, stdout.getvalue(), stderr.getvalue()
+
+    def test_lookups_run_concurrently(self):
+        # Every lookup waits for the others, so a serial warm-up would time out
+        fetcher = CountingFetcher({'paraben': 'A preservative.'}, threading.Barrier(3, timeout=5))
+        cache, stdout, stderr = self.warm(fetcher, '--workers', '3')
+        self.assertIn('Fetched 2, already cached 0, failed 1', stdout)
+        self.assertIn('flaky: timed out', stderr)
+        self.assertEqual(cache.lookup('paraben'), (True, 'A preservative.'))
+        self.assertEqual(cache.lookup('triclosan'), (False, ''))
+
+    def test_fresh_entries_are_skipped_unless_forced(self):
+        fetcher = CountingFetcher({})
+        cache = DefinitionCache(fetcher, persistent=False)
+        cache.store('paraben', 'A preservative.')
+        set_definition_cache(cache)
+        call_command('warm_definitions', '--source', self.source, stdout=io.StringIO(), stderr=io.StringIO())
+        self.assertEqual(sorted(fetcher.calls), ['flaky', 'triclosan'])
+
+
+class SlowFetcher(DefinitionFetcher):
+    def __init__(self):
+        self.release = threading.Event()
+        self.finished = threading.Event()
+
+    def fetch(self, ingredient):
+        if ingredient == 'slow':
+            self.release.wait(5)
+            self.finished.set()
+        if ingredient == 'flaky':
+            raise ConnectionError('timed out')
+        return f'{ingredient} definition'
+
+
+class EnrichmentDeadlineTests(SimpleTestCase):
+    def setUp(self):
+        self.fetcher = SlowFetcher()
+        self.addCleanup(self.fetcher.release.set)
+        self.cache = DefinitionCache(self.fetcher, persistent=False)
+
+    def test_lookups_missing_the_deadline_are_pending(self):
+        self.cache.store('salt', None)
+        start = time.monotonic()
+        results = fetch_definitions(['sugar', 'slow', 'flaky', 'salt', 'sugar'], timeout=0.2, cache=self.cache)
+        self.assertLess(time.monotonic() - start, 2)
+        self.assertEqual(results, {
+            'sugar': ('ready', 'sugar definition'),
+            'slow': ('pending', None),
+            'flaky': ('error', DEFINITION_UNAVAILABLE),
+            'salt': ('ready', DEFINITION_NOT_FOUND),
+        })
+
+        # The late answer is still cached for the next request
+        self.fetcher.release.set()
+        self.fetcher.finished.wait(5)
+        for _ in range(50):
+            if self.cache.lookup('slow') is not None:
+                break
+            time.sleep(0.01)
+        self.assertEqual(self.cache.lookup('slow'), (True, 'slow definition'))
+
+    def test_async_lookups_share_the_deadline(self):
+        async def enrich():
+            results = await afetch_definitions(['sugar', 'slow'], timeout=0.2, cache=self.cache)
+            self.fetcher.release.set()
+            return results
+
+        results = asyncio.run(enrich())
+        self.assertEqual(results, {'sugar': ('ready', 'sugar definition'), 'slow': ('pending', None)})
+
+
+class AnalysisSlotTests(SimpleTestCase):
+    @override_settings(ANALYSIS_ASYNC_MAX_IN_FLIGHT=1)
+    def test_slots_are_refused_rather_than_queued(self):
+        async def scenario():
+            async with analysis_slot():
+                with self.assertRaises(AnalysisBusy):
+                    async with analysis_slot():
+                        pass
+            async with analysis_slot():
+                return True
+
+        self.assertTrue(asyncio.run(scenario()))
+
+
+class JobQueueTests(TestCase):
+    def setUp(self):
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        self.enterContext(override_settings(MEDIA_ROOT=media_root.name))
+
+    def upload(self, **fields):
+        return UploadedImage.objects.create(**fields)
+
+    def test_uploads_are_not_queued_by_default(self):
+        self.upload()
+        self.assertEqual(queue_depth(), 0)
+        self.assertIsNone(claim_next_job())
+
+    def test_enqueue_queues_and_refuses_when_full(self):
+        with override_settings(ANALYSIS_QUEUE_MAX_DEPTH=1):
+            job = enqueue(SimpleUploadedFile('label.png', b'png'), ['Diabetes'])
+            self.assertEqual(job.status, UploadedImage.Status.QUEUED)
+            self.assertEqual(job.health_conditions, ['Diabetes'])
+            with self.assertRaises(QueueFull):
+                enqueue(SimpleUploadedFile('label.png', b'png'), [])
+
+    def test_jobs_are_claimed_oldest_first_and_once(self):
+        second = self.upload(status=UploadedImage.Status.QUEUED)
+        first = self.upload(status=UploadedImage.Status.QUEUED)
+        UploadedImage.objects.filter(pk=first.pk).update(uploaded_at=second.uploaded_at - timedelta(1))
+        claimed = claim_next_job()
+        self.assertEqual(claimed.pk, first.pk)
+        self.assertEqual(claimed.status, UploadedImage.Status.RUNNING)
+        self.assertIsNotNone(claimed.started_at)
+        self.assertEqual(claim_next_job().pk, second.pk)
+        self.assertIsNone(claim_next_job())
+
+    def test_only_stale_running_jobs_are_requeued(self):
+        now = timezone.now()
+        stale = self.upload(status=UploadedImage.Status.RUNNING, started_at=now - timedelta(seconds=301))
+        self.upload(status=UploadedImage.Status.RUNNING, started_at=now)
+        self.upload(status=UploadedImage.Status.DONE, started_at=now - timedelta(seconds=301))
+        with override_settings(ANALYSIS_JOB_TIMEOUT=300):
+            self.assertEqual(requeue_stale_jobs(), 1)
+        stale.refresh_from_db()
+        self.assertEqual(stale.status, UploadedImage.Status.QUEUED)
+        self.assertIsNone(stale.started_at)
+
+    def test_jobs_run_with_the_requests_preprocessing_profile(self):
+        job = enqueue(SimpleUploadedFile('label.png', b'png'), [], preprocess='none')
+        self.assertEqual(job.preprocess_profile, 'none')
+        with mock.patch('ingredient_analysis.jobs.run_analysis') as run_analysis:
+            process_job(claim_next_job())
+        self.assertEqual(run_analysis.call_args.kwargs, {'preprocess': 'none'})
+
+        with self.assertRaises(UnknownProfile):
+            enqueue(SimpleUploadedFile('label.png', b'png'), [], preprocess='sharpest')
+
+    def test_job_workers_run_ocr_inline(self):
+        self.addCleanup(set_ocr_engine, None)
+        with mock.patch('ingredient_analysis.jobs.signal.signal'), \
+                mock.patch('ingredient_analysis.jobs.worker_loop') as worker_loop:
+            _worker_main()
+        worker_loop.assert_called_once_with()
+        self.assertEqual(get_ocr_engine().workers, 0)
+
+    def test_failed_job_records_its_error(self):
+        job = self.upload(status=UploadedImage.Status.RUNNING)
+        with mock.patch('ingredient_analysis.jobs.run_analysis', side_effect=RuntimeError('OCR Error: boom')), \
+                self.assertLogs('ingredient_analysis.jobs', 'ERROR'):
+            process_job(job)
+        response = self.client.get(f'/api/analyze/{job.pk}/')
+        self.assertEqual(response.json(), {'status': 'failed', 'job_id': str(job.pk), 'error': 'OCR Error: boom'})
+
+
+class SaveOutcomeTests(TestCase):
+    def setUp(self):
+        self.image = UploadedImage.objects.create(status=UploadedImage.Status.RUNNING)
+        ocr_result = OCRResult(image=self.image, raw_text='Water', processing_time=0.1)
+        analysis = AnalysisResult(ocr_result=ocr_result, product_category='TOOTHPASTE')
+        self.outcome = AnalysisOutcome(ocr_result, analysis, {'status': 'success', 'timings': {}})
+
+    def test_rows_and_status_are_written_together(self):
+        save_outcome(self.image, self.outcome)
+        self.image.refresh_from_db()
+        self.assertEqual(self.image.status, UploadedImage.Status.DONE)
+        self.assertEqual(AnalysisResult.objects.get().ocr_result.image, self.image)
+        self.assertIn('db', self.outcome.response['timings'])
+
+    def test_a_failed_insert_leaves_nothing_behind(self):
+        with mock.patch.object(AnalysisResult, 'save', side_effect=DatabaseError('disk I/O error')):
+            with self.assertRaises(DatabaseError):
+                save_outcome(self.image, self.outcome)
+        self.image.refresh_from_db()
+        self.assertEqual(self.image.status, UploadedImage.Status.RUNNING)
+        self.assertFalse(OCRResult.objects.exists())
+
+    def test_new_rows_get_time_ordered_ids(self):
+        save_outcome(self.image, self.outcome)
+        self.assertEqual({self.image.pk.version, self.outcome.ocr_result.pk.version,
+                          self.outcome.analysis.pk.version}, {7})
+
+
+class DatabaseProfileTests(TestCase):
+    def test_category_history_reads_its_index(self):
+        plan = AnalysisResult.objects.filter(product_category='TOOTHPASTE').order_by('-created_at').explain()
+        self.assertIn('analysis_category_idx', plan)
+
+    @skipUnless(connection.vendor == 'sqlite', 'SQLite pragmas')
+    def test_connections_apply_the_sqlite_pragmas(self):
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA cache_size')
+            self.assertEqual(cursor.fetchone()[0], -32000)
+            cursor.execute('PRAGMA temp_store')
+            self.assertEqual(cursor.fetchone()[0], 2)
+
+
+class StreamingTests(TestCase):
+    def setUp(self):
+        self.image = UploadedImage.objects.create(status=UploadedImage.Status.RUNNING)
+        self.pipeline = mock.Mock()
+        self.pipeline.iter_stages.side_effect = self.stages
+        self.pipeline.outcome.side_effect = self.outcome
+        self.fail_at = None
+
+    def stages(self, ctx):
+        for stage, result in (
+            ('ocr', OCROutput('Water, Salt', ['Water', 'Salt'], 0.9, 0.1, {}, {}, False)),
+            ('brand', {'brand': 'Colgate', 'product_name': 'Total 12', 'confidence': 0.8}),
+            ('category', {'category': 'TOOTHPASTE', 'confidence': 0.9}),
+        ):
+            if stage == self.fail_at:
+                raise RuntimeError(f'{stage} failed')
+            yield stage, result
+
+    def outcome(self, ctx):
+        ocr_result = OCRResult(image=self.image, raw_text='Water, Salt', processing_time=0.1)
+        analysis = AnalysisResult(ocr_result=ocr_result)
+        return AnalysisOutcome(ocr_result, analysis, {'status': 'success', 'analysis_id': str(analysis.pk),
+                                                      'timings': {}})
+
+    def stream(self, content_type=NDJSON):
+        return stream_analysis(self.image, [], content_type=content_type, pipeline=self.pipeline)
+
+    def test_stages_are_sent_as_they_finish_and_complete_after_saving(self):
+        events = self.stream()
+        first = json.loads(next(events))
+        self.assertEqual((first['stage'], first['extracted_text']), ('ocr', 'Water, Salt'))
+        self.assertFalse(AnalysisResult.objects.exists())
+
+        rest = [json.loads(line) for line in events]
+        self.assertEqual([event['stage'] for event in rest], ['ingredients', 'brand', 'category', 'complete'])
+        self.assertEqual(rest[-1]['analysis_id'], str(AnalysisResult.objects.get().pk))
+        self.image.refresh_from_db()
+        self.assertEqual(self.image.status, UploadedImage.Status.DONE)
+
+    def test_server_sent_events(self):
+        first = next(self.stream(SSE))
+        self.assertTrue(first.startswith('event: ocr\ndata: {'))
+        self.assertTrue(first.endswith('\n\n'))
+        self.assertEqual(list(stream_cached({'analysis_id': '1'}, SSE)),
+                         ['event: complete\ndata: {"analysis_id": "1"}\n\n'])
+
+    def test_a_failed_stage_ends_the_stream_with_an_error(self):
+        self.fail_at = 'brand'
+        events = [json.loads(line) for line in self.stream()]
+        self.assertEqual([event['stage'] for event in events], ['ocr', 'ingredients', 'error'])
+        self.image.refresh_from_db()
+        self.assertEqual((self.image.status, self.image.error), (UploadedImage.Status.FAILED, 'brand failed'))
+
+    def test_closing_the_stream_marks_the_upload_failed(self):
+        events = self.stream()
+        next(events)
+        events.close()
+        self.image.refresh_from_db()
+        self.assertEqual(self.image.status, UploadedImage.Status.FAILED)
+        self.assertFalse(AnalysisResult.objects.exists())
+
+    def test_format_follows_the_accept_header(self):
+        factory = RequestFactory()
+        self.assertEqual(stream_format(factory.post('/', headers={'Accept': 'text/event-stream'})), SSE)
+        self.assertEqual(stream_format(factory.post('/')), NDJSON)
+
+
+def png(color):
+    buffer = io.BytesIO()
+    Image.new('RGB', (32, 32), color).save(buffer, 'PNG')
+    return buffer.getvalue()
+
+
+class BatchTests(TestCase):
+    def setUp(self):
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        self.enterContext(override_settings(MEDIA_ROOT=media_root.name))
+        self.media_root = media_root.name
+        self.release = threading.Event()
+        self.addCleanup(self.release.set)
+
+    def analyze(self, uploaded_image, user_conditions, preprocess, duplicate, image, pipeline):
+        name = os.path.basename(uploaded_image.image.name)
+        if name.startswith('slow'):
+            self.release.wait(5)
+        if name.startswith('broken'):
+            raise RuntimeError('OCR Error: unreadable')
+        ocr_result = OCRResult(image=uploaded_image, raw_text='Water', processing_time=0.1)
+        analysis = AnalysisResult(ocr_result=ocr_result, health_conditions=user_conditions)
+        return AnalysisOutcome(ocr_result, analysis, {'status': 'success', 'analysis_id': str(analysis.pk)})
+
+    def run_batch(self, *files):
+        self.enterContext(mock.patch('ingredient_analysis.batch.analyze_image', side_effect=self.analyze))
+        return run_batch([ContentFile(data, name=name) for name, data in files], ['Diabetes'])
+
+    def stored_files(self):
+        return [name for _, _, names in os.walk(self.media_root) for name in names]
+
+    def test_results_are_bulk_inserted_before_their_lines(self):
+        lines = self.run_batch(('red.png', png('red')), ('broken.png', png('blue')), ('again.png', png('red')))
+        # bulk_create never calls save()
+        with mock.patch.object(UploadedImage, 'save', side_effect=AssertionError), \
+                mock.patch.object(AnalysisResult, 'save', side_effect=AssertionError):
+            results = [json.loads(line) for line in lines]
+
+        by_name = {result.get('filename'): result for result in results}
+        self.assertTrue(AnalysisResult.objects.filter(pk=by_name['red.png']['analysis_id']).exists())
+        self.assertEqual(by_name['again.png']['duplicate_of'], 0)
+        self.assertEqual(by_name['broken.png']['error'], 'OCR Error: unreadable')
+        self.assertEqual(results[-1], {'status': 'complete', 'analyzed': 1, 'cached': 1, 'failed': 1})
+        self.assertEqual(
+            dict(UploadedImage.objects.values_list('status', 'error')),
+            {UploadedImage.Status.DONE: '', UploadedImage.Status.FAILED: 'OCR Error: unreadable'},
+        )
+        self.assertEqual(OCRResult.objects.count(), 1)
+
+    def test_unsaved_images_lose_their_files(self):
+        with mock.patch('ingredient_analysis.batch._save', side_effect=DatabaseError('disk full')):
+            results = [json.loads(line) for line in self.run_batch(('red.png', png('red')))]
+        self.assertEqual(results[0]['error'], 'Could not save the result: disk full')
+        self.assertEqual(results[-1]['failed'], 1)
+        self.assertEqual(self.stored_files(), [])
+
+    def test_images_in_flight_are_abandoned_when_the_client_leaves(self):
+        lines = self.run_batch(('red.png', png('red')), ('slow.png', png('blue')))
+        self.assertEqual(json.loads(next(lines))['filename'], 'red.png')
+        lines.close()
+        self.release.set()
+        for _ in range(100):
+            if len(self.stored_files()) == 1:
+                break
+            time.sleep(0.01)
+        self.assertEqual(len(self.stored_files()), 1)
+        self.assertEqual(UploadedImage.objects.count(), 1)
+
+    def upload_with_files(self):
+        uploaded_image = UploadedImage()
+        uploaded_image.image.save('label.png', ContentFile(png('red')), save=False)
+        uploaded_image.thumbnail.save('label.webp', ContentFile(b'webp'), save=False)
+        return uploaded_image
+
+    def test_discard_upload_files_deletes_every_stored_copy(self):
+        uploaded_image = self.upload_with_files()
+        self.assertEqual(len(self.stored_files()), 2)
+        self.assertEqual(discard_upload_files(uploaded_image), 2)
+        self.assertEqual(self.stored_files(), [])
+
+    def test_abandon_keeps_files_it_does_not_own(self):
+        uploaded_image = self.upload_with_files()
+        _abandon(uploaded_image, False, None)
+        self.assertEqual(len(self.stored_files()), 2)
+        _abandon(uploaded_image, True, None)
+        self.assertEqual(self.stored_files(), [])
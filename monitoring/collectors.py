@@ -0,0 +1,43 @@
+"""Metrics read from their owners when /metrics is scraped"""
+from typing import Iterator
+
+from django.db import DatabaseError
+
+from .metrics import MetricFamily, Sample, register_collector
+
+
+def ocr_queue() -> Iterator[MetricFamily]:
+    from ocr import engine
+
+    # Don't start the OCR pool just to report that it's idle
+    if engine._engine is None:
+        return
+    yield MetricFamily('ocr_queue_pages', 'gauge', "OCR pages submitted and not yet finished",
+                       [Sample('ocr_queue_pages', {}, engine._engine.pending)])
+    yield MetricFamily('ocr_queue_capacity', 'gauge', "Pages the OCR queue admits (OCR_ENGINE['MAX_QUEUE'])",
+                       [Sample('ocr_queue_capacity', {}, engine._engine.capacity)])
+
+
+def image_cache() -> Iterator[MetricFamily]:
+    from ocr.dedup import cache_stats
+
+    yield MetricFamily('image_cache_lookups', 'counter', "Duplicate-image lookups by result", [
+        Sample('image_cache_lookups_total', {'result': result}, count)
+        for result, count in cache_stats().items()
+    ])
+
+
+def analysis_jobs() -> Iterator[MetricFamily]:
+    from ingredient_analysis.jobs import queue_depth
+
+    try:
+        depth = queue_depth()
+    except DatabaseError:
+        return
+    yield MetricFamily('analysis_jobs_queued', 'gauge', "Analysis jobs waiting for a worker",
+                       [Sample('analysis_jobs_queued', {}, depth)])
+
+
+def register_default_collectors() -> None:
+    for collector in (ocr_queue, image_cache, analysis_jobs):
+        register_collector(collector)
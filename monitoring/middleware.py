@@ -0,0 +1,128 @@
+import cProfile
+import os
+import random
+import threading
+import time
+from typing import Dict
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.utils import timezone
+
+from .metrics import histogram
+
+REQUEST_SECONDS = histogram(
+    'http_request_duration_seconds', "Time until the view returned its response",
+    ['view', 'method', 'status'],
+)
+
+PROFILING_DEFAULTS = {
+    # Profile one in SAMPLE_RATE requests; 0 turns the profiler off
+    'SAMPLE_RATE': 0,
+    # Only profiles of requests at least this slow are written
+    'SLOW_MS': 1000,
+    'DIRECTORY': 'profiles',
+    # Oldest profiles are deleted beyond this many
+    'MAX_FILES': 200,
+}
+
+
+def profiling_settings() -> Dict:
+    return {**PROFILING_DEFAULTS, **getattr(settings, 'PROFILING', {})}
+
+
+def _view_name(request) -> str:
+    # URL names, not paths, keep the label set small
+    match = getattr(request, 'resolver_match', None)
+    return match.view_name if match is not None else 'unmatched'
+
+
+class MetricsMiddleware:
+    """Record the latency of every request by view, method and status code.
+
+    Works natively in both sync and async stacks, so async views stay
+    async. For streaming responses the time is measured to the first
+    byte, when the view returns.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        start = time.perf_counter()
+        response = self.get_response(request)
+        self._observe(request, response, start)
+        return response
+
+    async def __acall__(self, request):
+        start = time.perf_counter()
+        response = await self.get_response(request)
+        self._observe(request, response, start)
+        return response
+
+    def _observe(self, request, response, start: float) -> None:
+        REQUEST_SECONDS.observe(
+            time.perf_counter() - start,
+            view=_view_name(request), method=request.method, status=response.status_code,
+        )
+
+
+class SamplingProfilerMiddleware:
+    """Run cProfile on one in PROFILING['SAMPLE_RATE'] requests, keeping the slow ones.
+
+    Profiles of sampled requests slower than ``SLOW_MS`` are written to
+    ``DIRECTORY`` as ``.prof`` files (open them with ``pstats`` or
+    snakeviz). At most one request per process is profiled at a time.
+    cProfile sees only the request thread: time spent in the OCR and
+    pipeline pools shows up as waits. Under ASGI this middleware is sync
+    only, so turn it on while investigating rather than permanently.
+    """
+
+    def __init__(self, get_response):
+        options = profiling_settings()
+        if not options['SAMPLE_RATE']:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.rate = options['SAMPLE_RATE']
+        self.slow = options['SLOW_MS'] / 1000
+        self.directory = os.path.join(settings.BASE_DIR, options['DIRECTORY'])
+        self.max_files = options['MAX_FILES']
+        self._busy = threading.Lock()
+
+    def __call__(self, request):
+        if random.random() * self.rate >= 1 or not self._busy.acquire(blocking=False):
+            return self.get_response(request)
+        try:
+            profiler = cProfile.Profile()
+            start = time.perf_counter()
+            profiler.enable()
+            try:
+                response = self.get_response(request)
+            finally:
+                profiler.disable()
+            elapsed = time.perf_counter() - start
+            if elapsed >= self.slow:
+                self._dump(profiler, request, elapsed)
+            return response
+        finally:
+            self._busy.release()
+
+    def _dump(self, profiler: cProfile.Profile, request, elapsed: float) -> None:
+        os.makedirs(self.directory, exist_ok=True)
+        stamp = timezone.now().strftime('%Y%m%dT%H%M%S%f')
+        view = _view_name(request).replace(':', '-')
+        profiler.dump_stats(os.path.join(self.directory, f'{stamp}-{view}-{elapsed * 1000:.0f}ms.prof'))
+
+        profiles = sorted(name for name in os.listdir(self.directory) if name.endswith('.prof'))
+        for name in profiles[:-self.max_files]:
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except OSError:
+                pass
@@ -0,0 +1,80 @@
+from django.test import SimpleTestCase, TestCase, override_settings
+
+from .metrics import Counter, Gauge, Histogram, Metric, MetricFamily, Registry, Sample
+
+
+class ExpositionTests(SimpleTestCase):
+    def setUp(self):
+        self.registry = Registry()
+
+    def test_counter_and_gauge(self):
+        requests = self.registry.get_or_create(Counter, 'http_requests', 'Requests served', ['method'])
+        requests.inc(method='GET')
+        requests.inc(2, method='GET')
+        self.registry.get_or_create(Gauge, 'queue_depth', 'Jobs waiting').set(1.5)
+        self.assertEqual(self.registry.exposition(), (
+            '# HELP http_requests Requests served\n'
+            '# TYPE http_requests counter\n'
+            'http_requests_total{method="GET"} 3\n'
+            '# HELP queue_depth Jobs waiting\n'
+            '# TYPE queue_depth gauge\n'
+            'queue_depth 1.5\n'
+        ))
+
+    def test_histogram_buckets_are_cumulative(self):
+        latency = self.registry.get_or_create(Histogram, 'latency_seconds', 'Latency', buckets=(0.1, 1.0))
+        for value in (0.05, 0.1, 0.5, 3):
+            latency.observe(value)
+        lines = self.registry.exposition().splitlines()[2:]
+        self.assertEqual(lines, [
+            'latency_seconds_bucket{le="0.1"} 2',
+            'latency_seconds_bucket{le="1"} 3',
+            'latency_seconds_bucket{le="+Inf"} 4',
+            'latency_seconds_sum 3.65',
+            'latency_seconds_count 4',
+        ])
+
+    def test_help_and_label_values_are_escaped(self):
+        errors = self.registry.get_or_create(Counter, 'errors', 'Errors\nby "path" \\ kind', ['path'])
+        errors.inc(path='/a"b\\c\nd')
+        self.assertEqual(self.registry.exposition().splitlines(), [
+            '# HELP errors Errors\\nby "path" \\\\ kind',
+            '# TYPE errors counter',
+            'errors_total{path="/a\\"b\\\\c\\nd"} 1',
+        ])
+
+    def test_collectors_are_read_at_scrape_time(self):
+        depth = []
+        self.registry.register_collector(
+            lambda: [MetricFamily('ocr_queue', 'gauge', 'Queued OCR jobs', [Sample('ocr_queue', {}, len(depth))])]
+        )
+        depth.append(1)
+        self.assertIn('ocr_queue 1\n', self.registry.exposition())
+
+    def test_labels_must_match_the_declaration(self):
+        requests = self.registry.get_or_create(Counter, 'http_requests', 'Requests served', ['method'])
+        with self.assertRaises(ValueError):
+            requests.inc(status='200')
+        self.assertIs(self.registry.get_or_create(Counter, 'http_requests', 'Requests served', ['method']), requests)
+        with self.assertRaises(ValueError):
+            self.registry.get_or_create(Gauge, 'http_requests', 'Requests served', ['method'])
+
+    def test_metric_kinds_must_implement_collect(self):
+        class Summary(Metric):
+            kind = 'summary'
+
+        with self.assertRaises(TypeError):
+            self.registry.get_or_create(Summary, 'latency', 'Latency')
+
+
+class MetricsViewTests(TestCase):
+    def test_exposition_content_type(self):
+        response = self.client.get('/metrics')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'text/plain; version=0.0.4; charset=utf-8')
+
+    @override_settings(METRICS_TOKEN='secret')
+    def test_token_is_required_when_configured(self):
+        self.assertEqual(self.client.get('/metrics').status_code, 401)
+        response = self.client.get('/metrics', headers={'Authorization': 'Bearer secret'})
+        self.assertEqual(response.status_code, 200)
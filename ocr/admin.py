@@ -3,8 +3,9 @@ from .models import UploadedImage, OCRResult
 
 @admin.register(UploadedImage)
 class UploadedImageAdmin(admin.ModelAdmin):
-    list_display = ['id', 'uploaded_at', 'processed']
-    list_filter = ['uploaded_at', 'processed']
+    list_display = ['id', 'uploaded_at', 'status', 'processed']
+    readonly_fields = ['working_copy', 'thumbnail']
+    list_filter = ['uploaded_at', 'status', 'processed']
 
 @admin.register(OCRResult)
 class OCRResultAdmin(admin.ModelAdmin):
@@ -0,0 +1,72 @@
+import hashlib
+import threading
+from typing import Dict, Optional
+
+from .models import UploadedImage
+
+_stats_lock = threading.Lock()
+_stats = {'hit': 0, 'miss': 0}
+
+
+def record_cache_lookup(hit: bool) -> None:
+    with _stats_lock:
+        _stats['hit' if hit else 'miss'] += 1
+
+
+def cache_stats() -> Dict[str, int]:
+    """Image cache hits/misses seen by this process"""
+    with _stats_lock:
+        return dict(_stats)
+
+
+def content_digest(image_file) -> str:
+    """SHA-256 of an uploaded file's bytes"""
+    # Image uploads are hashed by the upload handler as they stream in
+    precomputed = getattr(image_file, 'content_hash', None)
+    if precomputed:
+        return precomputed
+    digest = hashlib.sha256()
+    for chunk in image_file.chunks():
+        digest.update(chunk)
+    image_file.seek(0)
+    return digest.hexdigest()
+
+
+def _duplicate_candidates(exclude=None):
+    candidates = UploadedImage.objects.filter(ocrresult__isnull=False).select_related('ocrresult')
+    if exclude is not None:
+        candidates = candidates.exclude(pk=exclude)
+    return candidates.order_by('uploaded_at')
+
+
+def find_duplicate(content_hash: str, exclude=None) -> Optional[UploadedImage]:
+    """Return an earlier upload of the same bytes that already has OCR results.
+
+    Only exact content matches count: a duplicate's files and analyses are
+    reused as this upload's own.
+    """
+    if not content_hash:
+        return None
+    return _duplicate_candidates(exclude).filter(content_hash=content_hash).first()
+
+
+async def afind_duplicate(content_hash: str, exclude=None) -> Optional[UploadedImage]:
+    """``find_duplicate`` for async callers"""
+    if not content_hash:
+        return None
+    return await _duplicate_candidates(exclude).filter(content_hash=content_hash).afirst()
+
+
+def store_upload(image_file, duplicate: Optional[UploadedImage] = None, **fields) -> UploadedImage:
+    """Create an UploadedImage, pointing at the duplicate's files instead of saving new copies.
+
+    ``duplicate`` must come from ``find_duplicate``, i.e. hold the same bytes.
+    """
+    if duplicate is None:
+        return UploadedImage.objects.create(image=image_file, **fields)
+    return UploadedImage.objects.create(
+        image=duplicate.image.name,
+        working_copy=duplicate.working_copy.name,
+        thumbnail=duplicate.thumbnail.name,
+        **fields
+    )
@@ -0,0 +1,323 @@
+"""Pool of long-lived OCR worker processes.
+
+Each worker loads Tesseract once (through tesserocr when it is installed,
+so the language model stays resident) and then serves pages from a
+bounded queue. Without tesserocr the workers fall back to pytesseract,
+which still moves OCR off the web thread and onto every core.
+
+Every page carries a deadline that the worker enforces itself (Tesseract's
+own cancel for tesserocr, a killed child process for pytesseract), so a
+page the caller stopped waiting for doesn't keep its worker busy.
+"""
+import os
+import shlex
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor, TimeoutError
+from multiprocessing import get_context
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pytesseract
+from django.conf import settings
+
+from monitoring.metrics import counter
+
+DEFAULTS = {
+    'WORKERS': os.cpu_count() or 1,
+    'MAX_QUEUE': 64,
+    'TIMEOUT': 30,
+    'LANG': 'eng',
+    'CONFIG': '',
+}
+
+
+OCR_FAILURES = counter('ocr_failures', "OCR pages that failed, by reason", ['reason'])
+
+
+class OCRQueueFull(Exception):
+    """Raised when more pages are waiting than OCR_ENGINE['MAX_QUEUE']"""
+
+
+class OCRTimeout(Exception):
+    """Raised when a page takes longer than OCR_ENGINE['TIMEOUT']"""
+
+
+# Per-process worker state, set up once by _init_worker
+_api = None
+_lang = DEFAULTS['LANG']
+_config = DEFAULTS['CONFIG']
+_timeout = DEFAULTS['TIMEOUT']
+
+
+def parse_config(config: str) -> Tuple[Optional[int], Optional[int], Dict[str, str]]:
+    """``(psm, oem, variables)`` from a Tesseract command-line config string.
+
+    Understands ``--psm N``, ``--oem N``, ``--dpi N`` and ``-c name=value``,
+    which is what tesserocr needs to match the pytesseract fallback.
+    """
+    psm = oem = None
+    variables = {}
+    args = iter(shlex.split(config))
+    for arg in args:
+        value = next(args, None)
+        if value is None:
+            break
+        if arg == '--psm':
+            psm = int(value)
+        elif arg == '--oem':
+            oem = int(value)
+        elif arg == '--dpi':
+            variables['user_defined_dpi'] = value
+        elif arg == '-c' and '=' in value:
+            name, _, setting = value.partition('=')
+            variables[name] = setting
+    return psm, oem, variables
+
+
+def _init_worker(lang: str, config: str, timeout: float) -> None:
+    global _api, _lang, _config, _timeout
+    _lang, _config, _timeout = lang, config, timeout
+    try:
+        import tesserocr
+        psm, oem, variables = parse_config(config)
+        if oem is None:
+            _api = tesserocr.PyTessBaseAPI(lang=lang)
+        else:
+            _api = tesserocr.PyTessBaseAPI(lang=lang, oem=oem)
+        if psm is not None:
+            _api.SetPageSegMode(psm)
+        for name, value in variables.items():
+            _api.SetVariable(name, value)
+    except Exception:
+        _api = None
+
+
+def _tesserocr_recognize(image: np.ndarray, timeout: Optional[float]) -> None:
+    from PIL import Image
+    _api.SetImage(Image.fromarray(image))
+    # Tesseract checks the deadline while recognizing and gives up past it
+    if not _api.Recognize(timeout=int(timeout * 1000) if timeout else 0):
+        raise OCRTimeout(f"OCR did not finish within {timeout}s")
+
+
+def _pytesseract(func, image: np.ndarray, timeout: Optional[float], **kwargs):
+    # pytesseract kills the tesseract child itself once the timeout expires
+    try:
+        return func(image, lang=_lang, config=_config, timeout=timeout or 0, **kwargs)
+    except RuntimeError as e:
+        if 'timeout' in str(e).lower():
+            raise OCRTimeout(f"OCR did not finish within {timeout}s")
+        raise
+
+
+def _recognize(image: np.ndarray, timeout: Optional[float] = None) -> str:
+    if _api is None:
+        return _pytesseract(pytesseract.image_to_string, image, timeout)
+    _tesserocr_recognize(image, timeout)
+    return _api.GetUTF8Text()
+
+
+WORD_FIELDS = ('text', 'conf', 'left', 'top', 'width', 'height', 'block_num', 'par_num', 'line_num')
+
+
+def _recognize_data(image: np.ndarray, timeout: Optional[float] = None) -> Dict[str, List]:
+    """Word-level results in pytesseract's ``image_to_data`` dict layout"""
+    if _api is None:
+        data = _pytesseract(
+            pytesseract.image_to_data, image, timeout, output_type=pytesseract.Output.DICT,
+        )
+        return {field: data[field] for field in WORD_FIELDS}
+
+    from tesserocr import RIL, iterate_level
+
+    _tesserocr_recognize(image, timeout)
+    data = {field: [] for field in WORD_FIELDS}
+    block = par = line = 0
+    for word in iterate_level(_api.GetIterator(), RIL.WORD):
+        if word.IsAtBeginningOf(RIL.BLOCK):
+            block, par, line = block + 1, 0, 0
+        if word.IsAtBeginningOf(RIL.PARA):
+            par, line = par + 1, 0
+        if word.IsAtBeginningOf(RIL.TEXTLINE):
+            line += 1
+        box = word.BoundingBox(RIL.WORD)
+        if box is None:
+            continue
+        x1, y1, x2, y2 = box
+        for field, value in zip(WORD_FIELDS, (
+            word.GetUTF8Text(RIL.WORD) or '', word.Confidence(RIL.WORD),
+            x1, y1, x2 - x1, y2 - y1, block, par, line,
+        )):
+            data[field].append(value)
+    return data
+
+
+_TASKS = {'text': _recognize, 'data': _recognize_data}
+
+
+def _run(task: str, image: np.ndarray, deadline: Optional[float] = None):
+    """Run a task with whatever is left until ``deadline`` (a ``time.time()`` value)"""
+    timeout = None
+    if deadline is not None:
+        timeout = deadline - time.time()
+        if timeout <= 0:
+            # The caller gave up while the page was queued
+            raise OCRTimeout("OCR deadline passed before the page started")
+    try:
+        return _TASKS[task](image, timeout)
+    except pytesseract.TesseractNotFoundError as e:
+        # Its constructor takes no message, so it can't be unpickled in the
+        # parent, which would break the whole pool
+        raise RuntimeError(str(e)) from None
+
+
+class OCREngine:
+    """Runs Tesseract on a pool of warm worker processes"""
+
+    def __init__(
+        self,
+        workers: int = DEFAULTS['WORKERS'],
+        max_queue: int = DEFAULTS['MAX_QUEUE'],
+        timeout: float = DEFAULTS['TIMEOUT'],
+        lang: str = DEFAULTS['LANG'],
+        config: str = DEFAULTS['CONFIG'],
+    ):
+        self.workers = workers
+        self.timeout = timeout
+        self._init_args = (lang, config, timeout)
+        self._slots = threading.BoundedSemaphore(max(1, max_queue))
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._lock = threading.Lock()
+        self._inline_ready = False
+        # Pages submitted and not yet finished, for monitoring
+        self.capacity = max(1, max_queue)
+        self.pending = 0
+        self._pending_lock = threading.Lock()
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    # spawn, not fork: web workers are multi-threaded
+                    self._executor = ProcessPoolExecutor(
+                        max_workers=self.workers,
+                        mp_context=get_context('spawn'),
+                        initializer=_init_worker,
+                        initargs=self._init_args,
+                    )
+        return self._executor
+
+    def submit(self, image: np.ndarray, task: str = 'text', timeout: float = None) -> Future:
+        """Queue a page for OCR, failing fast when the queue is full.
+
+        ``task`` is ``'text'`` for plain text or ``'data'`` for word boxes
+        and confidences. The worker abandons the page once ``timeout``
+        (default ``OCR_ENGINE['TIMEOUT']``) has passed since submission.
+        """
+        if not self._slots.acquire(blocking=False):
+            OCR_FAILURES.inc(reason='queue_full')
+            raise OCRQueueFull("OCR queue is full")
+
+        timeout = timeout or self.timeout
+        deadline = time.time() + timeout if timeout else None
+        self._track(1)
+        try:
+            if self.workers > 0:
+                future = self._get_executor().submit(_run, task, image, deadline)
+            else:
+                future = self._run_inline(task, image, deadline)
+        except Exception:
+            self._release()
+            raise
+
+        future.add_done_callback(lambda _: self._release())
+        return future
+
+    def _track(self, delta: int) -> None:
+        with self._pending_lock:
+            self.pending += delta
+
+    def _release(self) -> None:
+        self._track(-1)
+        self._slots.release()
+
+    def _run_inline(self, task: str, image: np.ndarray, deadline: Optional[float]) -> Future:
+        future = Future()
+        with self._lock:
+            if not self._inline_ready:
+                _init_worker(*self._init_args)
+                self._inline_ready = True
+            try:
+                future.set_result(_run(task, image, deadline))
+            except Exception as e:
+                future.set_exception(e)
+        return future
+
+    def recognize(self, image: np.ndarray, timeout: float = None) -> str:
+        """OCR a single page and return its text"""
+        timeout = timeout or self.timeout
+        return self._wait(self.submit(image, timeout=timeout), timeout)
+
+    def recognize_data(self, image: np.ndarray, timeout: float = None) -> Dict[str, List]:
+        """OCR a single page and return per-word text, boxes and confidences"""
+        timeout = timeout or self.timeout
+        return self._wait(self.submit(image, task='data', timeout=timeout), timeout)
+
+    def _wait(self, future: Future, timeout: float):
+        try:
+            # A little longer than the worker's own deadline, which normally
+            # fires first and frees the worker
+            return future.result(timeout=timeout + 1 if timeout else None)
+        except TimeoutError:
+            future.cancel()
+            OCR_FAILURES.inc(reason='timeout')
+            raise OCRTimeout(f"OCR did not finish within {timeout}s")
+        except OCRTimeout:
+            OCR_FAILURES.inc(reason='timeout')
+            raise
+        except Exception:
+            OCR_FAILURES.inc(reason='error')
+            raise
+
+    def shutdown(self) -> None:
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+
+
+_engine_lock = threading.Lock()
+_engine: Optional[OCREngine] = None
+
+
+def build_ocr_engine(**overrides) -> OCREngine:
+    """An OCR engine configured from OCR_ENGINE, with ``overrides`` (e.g. ``workers=0``) applied"""
+    config = {**DEFAULTS, **getattr(settings, 'OCR_ENGINE', {})}
+    config.update({name.upper(): value for name, value in overrides.items()})
+    return OCREngine(
+        workers=config['WORKERS'],
+        max_queue=config['MAX_QUEUE'],
+        timeout=config['TIMEOUT'],
+        lang=config['LANG'],
+        config=config['CONFIG'],
+    )
+
+
+def get_ocr_engine() -> OCREngine:
+    """Return the process-wide OCR engine configured from settings"""
+    global _engine
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                _engine = build_ocr_engine()
+    return _engine
+
+
+def set_ocr_engine(engine: Optional[OCREngine]) -> None:
+    """Swap the process-wide engine (``None`` rebuilds it from settings)"""
+    global _engine
+    with _engine_lock:
+        previous, _engine = _engine, engine
+    if previous is not None and previous is not engine:
+        previous.shutdown()
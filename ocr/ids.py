@@ -0,0 +1,26 @@
+"""Time-ordered primary keys.
+
+Random (version 4) UUIDs scatter inserts across the whole primary key
+index. Version 7 UUIDs start with a millisecond timestamp, so new rows
+land at the end of the index, as they would with an auto-increment key,
+and still can't be guessed or collide across processes.
+"""
+import os
+import time
+import uuid
+
+_TIMESTAMP_MASK = (1 << 48) - 1
+
+
+def uuid7() -> uuid.UUID:
+    """RFC 9562 version 7 UUID: 48-bit Unix time in ms, then 74 random bits"""
+    timestamp = time.time_ns() // 1_000_000 & _TIMESTAMP_MASK
+    random_bits = int.from_bytes(os.urandom(10), 'big')
+    value = (
+        timestamp << 80
+        | 0x7 << 76                             # version
+        | (random_bits >> 68 & 0xFFF) << 64     # rand_a
+        | 0b10 << 62                            # variant
+        | random_bits & ((1 << 62) - 1)         # rand_b
+    )
+    return uuid.UUID(int=value)
@@ -0,0 +1,76 @@
+import random
+import re
+import time
+
+from django.core.management.base import BaseCommand
+
+from ocr.tokenizer import tokenize_ingredients
+
+WORDS = [
+    'water', 'sugar', 'salt', 'glycerin', 'sodium lauryl sulfate', 'citric acid',
+    'natural flavor', 'soy lecithin', 'palm oil', 'tocopherol', 'wasser', 'zucker',
+    'aroma', 'sucre', 'huile de tournesol', 'azúcar', 'sel', 'milch', 'panthenol',
+]
+
+
+def legacy_extract_ingredients(text):
+    """The regex-based parser the tokenizer replaced, kept for comparison"""
+    ingredients_match = re.search(
+        r'ingredients[:\s]+(.+?)(?:nutrition|allergen|warning|$)',
+        text,
+        re.IGNORECASE | re.DOTALL
+    )
+    ingredients_text = ingredients_match.group(1) if ingredients_match else text
+    cleaned = []
+    for ing in re.split(r'[,;|\n]+', ingredients_text):
+        ing = re.sub(r'\([^)]*\)', '', ing)
+        ing = ' '.join(ing.split()).strip('.,;:- ')
+        if ing and len(ing) > 2:
+            cleaned.append(ing)
+    return cleaned
+
+
+def synthetic_label(items: int, seed: int = 0) -> str:
+    """A long multi-language label with nesting, percentages and a may-contain section"""
+    rng = random.Random(seed)
+    parts = []
+    for i in range(items):
+        word = rng.choice(WORDS)
+        roll = rng.random()
+        if roll < 0.15:
+            word = f"{word} ({rng.choice(WORDS)}, {rng.choice(WORDS)} ({rng.choice(WORDS)}))"
+        elif roll < 0.3:
+            word = f"{word} {rng.randint(1, 40)}.{rng.randint(0, 9)}%"
+        parts.append(word)
+        if i % 12 == 11:
+            parts.append('\n')
+    return (
+        "Net wt 500g\nIngredients: " + ', '.join(parts)
+        + ". May contain traces of nuts, sesame.\nNutrition Facts per 100g"
+    )
+
+
+class Command(BaseCommand):
+    help = "Measure ingredient parser throughput on large synthetic label texts"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--items', type=int, nargs='+', default=[50, 1000, 20000],
+                            help="Ingredient counts per label")
+        parser.add_argument('--repeat', type=int, default=20)
+
+    def handle(self, *args, **options):
+        parsers = [('legacy', legacy_extract_ingredients), ('tokenizer', tokenize_ingredients)]
+        self.stdout.write(f"{'items':>7} {'chars':>9} {'parser':>10} {'ms/label':>9} {'MB/s':>8} {'tokens':>7}")
+
+        for items in options['items']:
+            text = synthetic_label(items)
+            for name, parse in parsers:
+                parse(text)
+                start = time.perf_counter()
+                for _ in range(options['repeat']):
+                    result = parse(text)
+                elapsed = (time.perf_counter() - start) / options['repeat']
+                self.stdout.write(
+                    f"{items:>7} {len(text):>9} {name:>10} {elapsed * 1000:>9.3f} "
+                    f"{len(text.encode()) / elapsed / 1e6:>8.2f} {len(result):>7}"
+                )
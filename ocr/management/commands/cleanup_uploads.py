@@ -0,0 +1,39 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from ocr.storage import (
+    DEFAULT_BATCH_SIZE, delete_failed_uploads, delete_orphaned_files, expire_originals,
+    storage_settings,
+)
+
+
+class Command(BaseCommand):
+    help = "Delete expired original uploads, failed upload records and orphaned image files"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--retention-days', type=int,
+                            help="Keep originals this long (default: IMAGE_STORAGE['RETENTION_DAYS'])")
+        parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE)
+        parser.add_argument('--skip-orphans', action='store_true',
+                            help="Don't scan storage for unreferenced files")
+        parser.add_argument('--dry-run', action='store_true', help="Report what would be deleted")
+
+    def handle(self, *args, **options):
+        days = options['retention_days']
+        if days is None:
+            days = storage_settings()['RETENTION_DAYS']
+        cutoff = timezone.now() - timedelta(days=days)
+        batch_size, dry_run = options['batch_size'], options['dry_run']
+
+        records = delete_failed_uploads(cutoff, batch_size, dry_run)
+        originals = expire_originals(cutoff, batch_size, dry_run)
+        orphans = 0
+        if not options['skip_orphans']:
+            orphans = delete_orphaned_files(batch_size=batch_size, dry_run=dry_run)
+
+        verb = "Would delete" if dry_run else "Deleted"
+        self.stdout.write(self.style.SUCCESS(
+            f"{verb} {originals} originals, {records} failed uploads, {orphans} orphaned files"
+        ))
@@ -0,0 +1,42 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:20
+
+from django.db import migrations, models
+
+
+def mark_existing_uploads(apps, schema_editor):
+    # Uploads from before the job queue were processed inline; don't let
+    # the workers pick them up again.
+    UploadedImage = apps.get_model('ocr', 'UploadedImage')
+    UploadedImage.objects.filter(ocrresult__isnull=False).update(status='done', processed=True)
+    UploadedImage.objects.filter(ocrresult__isnull=True).update(status='failed')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ocr', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='uploadedimage',
+            name='error',
+            field=models.TextField(blank=True),
+        ),
+        migrations.AddField(
+            model_name='uploadedimage',
+            name='health_conditions',
+            field=models.JSONField(default=list),
+        ),
+        migrations.AddField(
+            model_name='uploadedimage',
+            name='started_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='uploadedimage',
+            name='status',
+            field=models.CharField(choices=[('queued', 'Queued'), ('running', 'Running'), ('done', 'Done'), ('failed', 'Failed')], db_index=True, default='queued', max_length=16),
+        ),
+        migrations.RunPython(mark_existing_uploads, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ocr', '0004_stage_timings'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='uploadedimage',
+            name='thumbnail',
+            field=models.ImageField(blank=True, upload_to='thumbnails/%Y/%m/%d/'),
+        ),
+        migrations.AddField(
+            model_name='uploadedimage',
+            name='working_copy',
+            field=models.ImageField(blank=True, upload_to='working/%Y/%m/%d/'),
+        ),
+        migrations.AlterField(
+            model_name='uploadedimage',
+            name='image',
+            field=models.ImageField(blank=True, upload_to='uploads/%Y/%m/%d/'),
+        ),
+    ]
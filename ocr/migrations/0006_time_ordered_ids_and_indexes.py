@@ -0,0 +1,45 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:50
+
+import ocr.ids
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ocr', '0005_image_storage_tiers'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='ocrresult',
+            name='id',
+            field=models.UUIDField(default=ocr.ids.uuid7, editable=False, primary_key=True, serialize=False),
+        ),
+        migrations.AlterField(
+            model_name='uploadedimage',
+            name='id',
+            field=models.UUIDField(default=ocr.ids.uuid7, editable=False, primary_key=True, serialize=False),
+        ),
+        migrations.AlterField(
+            model_name='uploadedimage',
+            name='status',
+            field=models.CharField(choices=[('queued', 'Queued'), ('running', 'Running'), ('done', 'Done'), ('failed', 'Failed')], default='queued', max_length=16),
+        ),
+        migrations.AddIndex(
+            model_name='ocrresult',
+            index=models.Index(fields=['-created_at'], name='ocr_result_recent_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='uploadedimage',
+            index=models.Index(fields=['-uploaded_at'], name='ocr_upload_recent_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='uploadedimage',
+            index=models.Index(fields=['status', 'uploaded_at'], name='ocr_upload_status_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='uploadedimage',
+            index=models.Index(fields=['image'], name='ocr_upload_image_idx'),
+        ),
+    ]
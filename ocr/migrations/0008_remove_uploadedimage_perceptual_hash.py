@@ -0,0 +1,17 @@
+# Generated by Django 5.2.18 on 2026-10-18 13:31
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ocr', '0007_uploadedimage_received_status'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='uploadedimage',
+            name='perceptual_hash',
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 13:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ocr', '0008_remove_uploadedimage_perceptual_hash'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='uploadedimage',
+            name='preprocess_profile',
+            field=models.CharField(blank=True, max_length=64),
+        ),
+    ]
@@ -1,26 +1,65 @@
 from django.db import models
-import uuid
+
+from .ids import uuid7
 
 class UploadedImage(models.Model):
-    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
-    image = models.ImageField(upload_to='uploads/%Y/%m/%d/')
+    class Status(models.TextChoices):
+        # Stored but not handed to the job queue; only jobs.enqueue queues uploads
+        RECEIVED = 'received', 'Received'
+        QUEUED = 'queued', 'Queued'
+        RUNNING = 'running', 'Running'
+        DONE = 'done', 'Done'
+        FAILED = 'failed', 'Failed'
+    
+    id = models.UUIDField(primary_key=True, default=uuid7, editable=False)
+    # The original is removed after IMAGE_STORAGE['RETENTION_DAYS'] (see ocr.storage);
+    # the recompressed working copy and thumbnail are kept
+    image = models.ImageField(upload_to='uploads/%Y/%m/%d/', blank=True)
+    working_copy = models.ImageField(upload_to='working/%Y/%m/%d/', blank=True)
+    thumbnail = models.ImageField(upload_to='thumbnails/%Y/%m/%d/', blank=True)
     uploaded_at = models.DateTimeField(auto_now_add=True)
     processed = models.BooleanField(default=False)
+    content_hash = models.CharField(max_length=64, blank=True, db_index=True)
+    status = models.CharField(max_length=16, choices=Status.choices, default=Status.RECEIVED)
+    health_conditions = models.JSONField(default=list)
+    # Preprocessing profile for queued jobs; blank means OCR_PREPROCESSING_PROFILE
+    preprocess_profile = models.CharField(max_length=64, blank=True)
+    started_at = models.DateTimeField(blank=True, null=True)
+    error = models.TextField(blank=True)
     
     class Meta:
         ordering = ['-uploaded_at']
+        indexes = [
+            # Upload history and the admin's date filter
+            models.Index(fields=['-uploaded_at'], name='ocr_upload_recent_idx'),
+            # Admin status filter and the job queue (oldest queued first)
+            models.Index(fields=['status', 'uploaded_at'], name='ocr_upload_status_idx'),
+            # Retention cleanup looks originals up by file name
+            models.Index(fields=['image'], name='ocr_upload_image_idx'),
+        ]
     
     def __str__(self):
         return f"Image {self.id}"
+    
+    @property
+    def source_file(self):
+        """The original while it is retained, else the working copy"""
+        return self.image if self.image else self.working_copy
 
 class OCRResult(models.Model):
-    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    id = models.UUIDField(primary_key=True, default=uuid7, editable=False)
     image = models.OneToOneField(UploadedImage, on_delete=models.CASCADE)
     raw_text = models.TextField()
     extracted_ingredients = models.JSONField(default=list)
     confidence = models.FloatField(default=0.0)
     processing_time = models.FloatField()
+    stage_timings = models.JSONField(default=dict)
     created_at = models.DateTimeField(auto_now_add=True)
     
+    class Meta:
+        indexes = [
+            models.Index(fields=['-created_at'], name='ocr_result_recent_idx'),
+        ]
+    
     def __str__(self):
-        return f"OCR Result for {self.image.id}"
+        return f"OCR Result for {self.image_id}"
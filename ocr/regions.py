@@ -0,0 +1,124 @@
+"""Locate the ingredients panel on a label before running full OCR.
+
+A cheap Tesseract layout pass on a downscaled copy finds the
+"Ingredients" heading; the text block it belongs to (plus the blocks
+directly beneath it, up to the next section heading) is then mapped back
+to full resolution so only that crop goes through the expensive OCR pass.
+Small images skip the layout pass: at their size it would cost nearly as
+much as the full pass, which then has to run anyway when no heading is
+found.
+"""
+import re
+from typing import Dict, List, NamedTuple, Optional
+
+import cv2
+import numpy as np
+
+from .engine import OCREngine
+
+HEADING_RE = re.compile(
+    r'^(ingr[eé]d[il]ents?|ingredientes|ingredienti|zutaten|composition|inci)\b',
+    re.IGNORECASE,
+)
+TERMINATOR_RE = re.compile(
+    r'^(nutrition|allergen|allergy|warning|directions|storage|n[äa]hrwert)',
+    re.IGNORECASE,
+)
+
+
+class Region(NamedTuple):
+    left: int
+    top: int
+    right: int
+    bottom: int
+
+    @property
+    def area(self) -> int:
+        return max(0, self.right - self.left) * max(0, self.bottom - self.top)
+
+
+def _block_boxes(data: Dict[str, List]) -> Dict[int, Dict]:
+    """Group words by Tesseract block into bounding boxes"""
+    blocks = {}
+    for i, text in enumerate(data['text']):
+        text = (text or '').strip()
+        if not text:
+            continue
+        block = blocks.setdefault(data['block_num'][i], {
+            'left': data['left'][i], 'top': data['top'][i],
+            'right': data['left'][i] + data['width'][i],
+            'bottom': data['top'][i] + data['height'][i],
+            'words': [],
+        })
+        block['left'] = min(block['left'], data['left'][i])
+        block['top'] = min(block['top'], data['top'][i])
+        block['right'] = max(block['right'], data['left'][i] + data['width'][i])
+        block['bottom'] = max(block['bottom'], data['top'][i] + data['height'][i])
+        block['words'].append((text, data['height'][i]))
+    return blocks
+
+
+def find_ingredients_region(data: Dict[str, List]) -> Optional[Region]:
+    """Pick the ingredients block out of a layout pass, in that pass's coordinates"""
+    blocks = _block_boxes(data)
+
+    heading = None
+    for block_num, block in sorted(blocks.items(), key=lambda item: item[1]['top']):
+        if any(HEADING_RE.match(word) for word, _ in block['words']):
+            heading = block_num
+            break
+    if heading is None:
+        return None
+
+    box = dict(blocks[heading])
+    line_height = max(h for _, h in box['words']) or 1
+
+    # Follow the panel down: blocks that start just below and overlap horizontally
+    for block in sorted(blocks.values(), key=lambda b: b['top']):
+        if block['top'] <= box['top']:
+            continue
+        if block['top'] - box['bottom'] > 2 * line_height:
+            break
+        if block['right'] < box['left'] or block['left'] > box['right']:
+            continue
+        if TERMINATOR_RE.match(block['words'][0][0]):
+            break
+        box['left'] = min(box['left'], block['left'])
+        box['right'] = max(box['right'], block['right'])
+        box['bottom'] = max(box['bottom'], block['bottom'])
+
+    return Region(box['left'], box['top'], box['right'], box['bottom'])
+
+
+def detect_ingredients_region(
+    gray: np.ndarray,
+    engine: OCREngine,
+    layout_side: int = 1000,
+    margin: float = 0.02,
+    min_side: int = 2000,
+) -> Optional[Region]:
+    """Find the ingredients panel of a grayscale image, in full-resolution pixels.
+
+    Images whose longest side is under ``min_side`` aren't searched (None).
+    """
+    height, width = gray.shape[:2]
+    if max(height, width) < min_side:
+        return None
+    scale = min(1.0, layout_side / max(height, width))
+    small = gray if scale == 1.0 else cv2.resize(
+        gray, (max(1, int(width * scale)), max(1, int(height * scale))),
+        interpolation=cv2.INTER_AREA,
+    )
+
+    region = find_ingredients_region(engine.recognize_data(small))
+    if region is None:
+        return None
+
+    pad_x, pad_y = int(width * margin), int(height * margin)
+    region = Region(
+        max(0, int(region.left / scale) - pad_x),
+        max(0, int(region.top / scale) - pad_y),
+        min(width, int(region.right / scale) + pad_x),
+        min(height, int(region.bottom / scale) + pad_y),
+    )
+    return region if region.area > 0 else None
@@ -1,44 +1,160 @@
-import pytesseract
-from PIL import Image
-import cv2
 import numpy as np
-from typing import List
-import re
+from typing import Dict, List, Union
+import time
+
+from django.conf import settings
+
+from monitoring.metrics import histogram
+from .engine import OCREngine, OCRQueueFull, OCRTimeout, get_ocr_engine
+from .preprocessing import PreprocessingPipeline, UnknownProfile, grayscale
+from .regions import detect_ingredients_region
+from .tokenizer import IngredientToken, tokenize_ingredients
+from .uploads import EncodedImage, UploadRejected, decode_image, open_encoded
+
+OCR_IMAGE_BYTES = histogram(
+    'ocr_image_bytes', "Encoded size of images sent to OCR",
+    buckets=(64 * 1024, 256 * 1024, 512 * 1024, 1024 ** 2, 2 * 1024 ** 2, 5 * 1024 ** 2, 10 * 1024 ** 2),
+)
+OCR_IMAGE_PIXELS = histogram(
+    'ocr_image_pixels', "Decoded size of images sent to OCR",
+    buckets=(250_000, 1_000_000, 2_000_000, 4_000_000, 8_000_000, 12_000_000, 24_000_000, 50_000_000),
+)
+OCR_PHASE_SECONDS = histogram(
+    'ocr_phase_duration_seconds', "Time spent in each OCR phase (decode, region, preprocess, ocr)",
+    ['phase'],
+)
+
+def text_from_data(data: Dict[str, List]) -> str:
+    """Rebuild plain text from word-level OCR data, keeping line and block breaks"""
+    blocks, lines, words = [], [], []
+    current_block = current_line = None
+    
+    for i, word in enumerate(data['text']):
+        word = (word or '').strip()
+        if not word:
+            continue
+        block = data['block_num'][i]
+        line = (block, data['par_num'][i], data['line_num'][i])
+        if line != current_line and words:
+            lines.append(' '.join(words))
+            words = []
+        if block != current_block and lines:
+            blocks.append('\n'.join(lines))
+            lines = []
+        current_block, current_line = block, line
+        words.append(word)
+    
+    if words:
+        lines.append(' '.join(words))
+    if lines:
+        blocks.append('\n'.join(lines))
+    return '\n\n'.join(blocks)
+
+
+def confidence_from_data(data: Dict[str, List]) -> float:
+    """Character-weighted mean word confidence in [0, 1]"""
+    total = weight = 0.0
+    for word, conf in zip(data['text'], data['conf']):
+        word = (word or '').strip()
+        conf = float(conf)
+        if not word or conf < 0:
+            continue
+        total += conf * len(word)
+        weight += len(word)
+    return round(total / weight / 100, 4) if weight else 0.0
+
 
 class OCRService:
     """Extract text from images using Tesseract"""
     
-    def extract_text(self, image_path: str) -> str:
-        """Extract text from image"""
+    def __init__(self, engine: OCREngine = None):
+        self.engine = engine or get_ocr_engine()
+        self.timings = {}
+        self.memory = {}
+        self.decoded = None
+        self.region = None
+        self.confidence = 0.0
+    
+    @property
+    def processing_time(self) -> float:
+        """Total seconds spent in the last extract_text call"""
+        total = 0.0
+        for value in self.timings.values():
+            total += sum(value.values()) if isinstance(value, dict) else value
+        return total / 1000
+    
+    def extract_text(self, image, preprocess: Union[str, bool] = True,
+                     detect_region: bool = None) -> str:
+        """Extract text from image.
+
+        ``image`` is a path, an upload or stored file, or an EncodedImage
+        from ``ocr.uploads.open_encoded``; its bytes are decoded once,
+        without being copied (see ``ocr.uploads``).
+
+        ``preprocess`` selects a preprocessing profile by name; True uses
+        the configured default and False only converts to grayscale.
+        With ``detect_region`` (default: OCR_DETECT_INGREDIENTS_REGION) a
+        low-resolution layout pass first looks for the ingredients panel
+        and only that crop is OCR'd at full resolution.
+        Stage timings (ms), image memory (bytes) and the word-confidence
+        score of the last call are kept in ``self.timings``,
+        ``self.memory`` and ``self.confidence``; the decoded grayscale
+        image stays in ``self.decoded`` for deriving stored copies.
+        """
+        if detect_region is None:
+            detect_region = getattr(settings, 'OCR_DETECT_INGREDIENTS_REGION', True)
+        
         try:
-            image = cv2.imread(image_path)
-            gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-            _, thresh = cv2.threshold(gray, 127, 255, cv2.THRESH_BINARY)
-            text = pytesseract.image_to_string(thresh)
-            return text.strip()
+            start = time.perf_counter()
+            encoded = image if isinstance(image, EncodedImage) else open_encoded(image)
+            image = grayscale(decode_image(encoded))
+            self.timings = {'decode': (time.perf_counter() - start) * 1000}
+            self.memory = {
+                'encoded': encoded.data.nbytes,
+                'buffered': encoded.buffered,
+                'decoded': image.nbytes,
+            }
+            del encoded
+            self.decoded = image
+            
+            self.region = None
+            if detect_region:
+                start = time.perf_counter()
+                self.region = detect_ingredients_region(image, self.engine)
+                self.timings['region'] = (time.perf_counter() - start) * 1000
+                if self.region is not None:
+                    image = image[self.region.top:self.region.bottom, self.region.left:self.region.right]
+            
+            pipeline = PreprocessingPipeline.from_profile(preprocess)
+            processed, stage_timings = pipeline.run(image)
+            self.timings['preprocess'] = stage_timings
+            self.memory['processed'] = processed.nbytes
+            
+            # One pass yields both the text and per-word confidences
+            start = time.perf_counter()
+            data = self.engine.recognize_data(processed)
+            self.timings['ocr'] = (time.perf_counter() - start) * 1000
+            self.confidence = confidence_from_data(data)
+            self._observe()
+            return text_from_data(data).strip()
+        except (OCRQueueFull, OCRTimeout, UploadRejected, UnknownProfile):
+            # Callers answer these with their own status codes
+            raise
         except Exception as e:
             raise Exception(f"OCR Error: {str(e)}")
     
+    def _observe(self) -> None:
+        OCR_IMAGE_BYTES.observe(self.memory['encoded'])
+        OCR_IMAGE_PIXELS.observe(self.memory['decoded'])
+        for phase, value in self.timings.items():
+            # Preprocessing reports its steps; the phase total is their sum
+            total = sum(value.values()) if isinstance(value, dict) else value
+            OCR_PHASE_SECONDS.observe(total / 1000, phase=phase)
+    
     def extract_ingredients(self, text: str) -> List[str]:
         """Parse text to extract ingredients"""
-        ingredients_match = re.search(
-            r'ingredients[:\s]+(.+?)(?:nutrition|allergen|warning|$)',
-            text,
-            re.IGNORECASE | re.DOTALL
-        )
-        
-        if ingredients_match:
-            ingredients_text = ingredients_match.group(1)
-        else:
-            ingredients_text = text
-        
-        ingredients = re.split(r'[,;|\n]+', ingredients_text)
-        cleaned = []
-        
-        for ing in ingredients:
-            ing = re.sub(r'\([^)]*\)', '', ing)
-            ing = ' '.join(ing.split()).strip('.,;:- ')
-            if ing and len(ing) > 2:
-                cleaned.append(ing)
-        
-        return cleaned
+        return [token.name for token in tokenize_ingredients(text)]
+    
+    def tokenize_ingredients(self, text: str) -> List[IngredientToken]:
+        """Parse text into ingredient tokens with offsets, percentages and details"""
+        return tokenize_ingredients(text)
@@ -0,0 +1,205 @@
+"""Tiered storage for uploaded images.
+
+Every analysed upload gets two derived files, both WebP: a grayscale
+working copy downsized to ``WORKING_MAX_SIDE`` (what OCR reads once the
+original is gone) and a small thumbnail. They are encoded from the
+pixels OCR already decoded, so the original is not read again.
+
+Originals are kept for ``RETENTION_DAYS``; ``cleanup_uploads`` then
+deletes them, along with failed uploads past the same window and files
+no row refers to. Cleanup works on batches of names and primary keys
+with bulk queries, never one model instance at a time.
+"""
+import io
+import os
+from datetime import timedelta
+from typing import Dict, Iterable, Iterator, List, Optional, Set
+
+import numpy as np
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.utils import timezone
+from PIL import Image
+
+from .models import UploadedImage
+from .preprocessing import downscale, grayscale
+
+DEFAULTS = {
+    'RETENTION_DAYS': 30,
+    # The OCR preprocessing target size, so the default profile reads the
+    # working copy just as it read the original
+    'WORKING_MAX_SIDE': 2000,
+    'WORKING_QUALITY': 80,
+    'WEBP_METHOD': 0,
+    'THUMBNAIL_SIZE': 320,
+    'THUMBNAIL_QUALITY': 70,
+    # Files younger than this are never treated as orphans: batch uploads
+    # write their files before their rows are inserted
+    'ORPHAN_GRACE_HOURS': 24,
+}
+FILE_FIELDS = ('image', 'working_copy', 'thumbnail')
+STORAGE_DIRS = ('uploads', 'working', 'thumbnails')
+DEFAULT_BATCH_SIZE = 1000
+
+
+def storage_settings() -> Dict:
+    return {**DEFAULTS, **getattr(settings, 'IMAGE_STORAGE', {})}
+
+
+def encode_webp(image: np.ndarray, quality: int, method: int = 0) -> bytes:
+    """Lossy WebP; ``method`` 0 encodes several times faster than OpenCV's default effort"""
+    buffer = io.BytesIO()
+    Image.fromarray(image).save(buffer, 'WEBP', quality=quality, method=method)
+    return buffer.getvalue()
+
+
+def save_derivatives(uploaded_image: UploadedImage, image: np.ndarray) -> None:
+    """Attach a working copy and thumbnail encoded from decoded pixels (not saved to the DB)"""
+    options = storage_settings()
+    image = grayscale(image)
+    base = os.path.splitext(os.path.basename(uploaded_image.image.name or ''))[0]
+    base = base or str(uploaded_image.pk)
+
+    working = downscale(image, options['WORKING_MAX_SIDE'])
+    thumbnail = downscale(working, options['THUMBNAIL_SIZE'])
+    for field, pixels, quality in (
+        (uploaded_image.working_copy, working, options['WORKING_QUALITY']),
+        (uploaded_image.thumbnail, thumbnail, options['THUMBNAIL_QUALITY']),
+    ):
+        data = encode_webp(pixels, quality, options['WEBP_METHOD'])
+        field.save(f'{base}.webp', ContentFile(data), save=False)
+
+
+def share_derivatives(uploaded_image: UploadedImage, duplicate: UploadedImage) -> None:
+    """Point a duplicate upload at the files of the image it duplicates"""
+    for field in FILE_FIELDS:
+        getattr(uploaded_image, field).name = getattr(duplicate, field).name
+
+
+def _delete_files(names: Iterable[str]) -> int:
+    deleted = 0
+    for name in names:
+        try:
+            default_storage.delete(name)
+            deleted += 1
+        except OSError:
+            pass
+    return deleted
+
+
+def discard_upload_files(uploaded_image: UploadedImage) -> int:
+    """Delete the files written for an upload whose row was never saved"""
+    return _delete_files(
+        getattr(uploaded_image, field).name for field in FILE_FIELDS if getattr(uploaded_image, field)
+    )
+
+
+def _referenced(names: Iterable[str]) -> Set[str]:
+    """Which of these storage names some row still points at"""
+    names = list(names)
+    found = set()
+    for field in FILE_FIELDS:
+        found.update(
+            UploadedImage.objects.filter(**{f'{field}__in': names})
+            .values_list(field, flat=True)
+        )
+    return found
+
+
+def expire_originals(cutoff=None, batch_size: int = DEFAULT_BATCH_SIZE, dry_run: bool = False) -> int:
+    """Delete originals uploaded before ``cutoff``; returns the number of files removed.
+
+    Duplicate uploads share their original's file, so a file is kept
+    while any row uploaded after the cutoff still refers to it.
+    """
+    if cutoff is None:
+        cutoff = timezone.now() - timedelta(days=storage_settings()['RETENTION_DAYS'])
+    expired = UploadedImage.objects.filter(uploaded_at__lt=cutoff).exclude(image='')
+
+    removed, last = 0, ''
+    while True:
+        # Keyset pagination over names: rows kept for a newer duplicate stay
+        # behind the cursor instead of being fetched again
+        names = list(
+            expired.filter(image__gt=last).order_by('image')
+            .values_list('image', flat=True).distinct()[:batch_size]
+        )
+        if not names:
+            return removed
+        last = names[-1]
+
+        retained = set(
+            UploadedImage.objects.filter(image__in=names, uploaded_at__gte=cutoff)
+            .values_list('image', flat=True)
+        )
+        doomed = [name for name in names if name not in retained]
+        if doomed and not dry_run:
+            UploadedImage.objects.filter(image__in=doomed).update(image='')
+            _delete_files(doomed)
+        removed += len(doomed)
+
+
+def delete_failed_uploads(cutoff=None, batch_size: int = DEFAULT_BATCH_SIZE, dry_run: bool = False) -> int:
+    """Delete rows of uploads that failed before ``cutoff`` and never got an OCR result.
+
+    Their files become orphans and are removed by ``delete_orphaned_files``.
+    """
+    if cutoff is None:
+        cutoff = timezone.now() - timedelta(days=storage_settings()['RETENTION_DAYS'])
+    failed = UploadedImage.objects.filter(
+        status=UploadedImage.Status.FAILED, uploaded_at__lt=cutoff, ocrresult__isnull=True,
+    )
+    if dry_run:
+        return failed.count()
+
+    deleted = 0
+    while True:
+        pks = list(failed.values_list('pk', flat=True)[:batch_size])
+        if not pks:
+            return deleted
+        # No OCR result references these rows, so the collector has nothing to cascade
+        count, _ = UploadedImage.objects.filter(pk__in=pks).delete()
+        deleted += count
+
+
+def stored_files(directories: Iterable[str] = STORAGE_DIRS) -> Iterator[str]:
+    """Walk the upload directories, yielding storage names"""
+    pending: List[str] = [d for d in directories if default_storage.exists(d)]
+    while pending:
+        directory = pending.pop()
+        subdirectories, files = default_storage.listdir(directory)
+        pending.extend(f'{directory}/{name}' for name in subdirectories)
+        for name in files:
+            yield f'{directory}/{name}'
+
+
+def _batches(items: Iterable[str], size: int) -> Iterator[List[str]]:
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def delete_orphaned_files(grace: Optional[timedelta] = None, batch_size: int = DEFAULT_BATCH_SIZE,
+                          dry_run: bool = False) -> int:
+    """Delete stored files that no row refers to and that are older than ``grace``"""
+    if grace is None:
+        grace = timedelta(hours=storage_settings()['ORPHAN_GRACE_HOURS'])
+    cutoff = timezone.now() - grace
+
+    removed = 0
+    for names in _batches(stored_files(), batch_size):
+        referenced = _referenced(names)
+        orphans = [
+            name for name in names
+            if name not in referenced and default_storage.get_modified_time(name) < cutoff
+        ]
+        if not dry_run:
+            _delete_files(orphans)
+        removed += len(orphans)
+    return removed
@@ -1,3 +1,273 @@
-from django.test import TestCase
+import hashlib
+import io
+import os
+import tempfile
+import time
+import uuid
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+import numpy as np
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.core.files.uploadhandler import SkipFile, StopFutureHandlers
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+from PIL import Image
+
+from .dedup import find_duplicate, store_upload
+from .ids import uuid7
+from .models import OCRResult, UploadedImage
+from .regions import Region, detect_ingredients_region
+from .storage import delete_failed_uploads, delete_orphaned_files, expire_originals
+from .tokenizer import find_section, tokenize_ingredients
+from .uploads import ImageInfo, ImageMemoryUploadHandler, UploadRejected, open_encoded, read_header
+
+
+class TokenizerTests(SimpleTestCase):
+    def test_section_runs_from_heading_to_next_section(self):
+        text = "Colgate Total. Ingredients: Water, Salt. Nutrition: 100 kcal"
+        section = find_section(text)
+        self.assertEqual(text[section.start:section.stop].strip(' .'), 'Water, Salt')
+
+    def test_whole_text_is_used_without_heading(self):
+        self.assertEqual([token.name for token in tokenize_ingredients("Water, Glycerin")],
+                         ['Water', 'Glycerin'])
+
+    def test_spans_point_into_the_source_text(self):
+        for text in ("Ingredients: Water; Sodium Fluoride | Glycerin", "Ingredients: Water, Salt.", "- Water\n* Salt"):
+            tokens = tokenize_ingredients(text)
+            self.assertTrue(tokens)
+            for token in tokens:
+                self.assertEqual(text[token.start:token.end], token.name)
+
+    def test_nested_brackets_stay_in_one_token(self):
+        [flavor, salt] = tokenize_ingredients("Ingredients: Flavor (contains (milk)), Salt")
+        self.assertEqual(flavor.name, 'Flavor')
+        self.assertEqual(flavor.details, 'contains (milk)')
+        self.assertEqual(salt.name, 'Salt')
+
+    def test_percent_is_parsed_from_its_own_bracket_group(self):
+        [tomatoes, sugar] = tokenize_ingredients("Ingredients: Tomatoes (45%), Sugar [12,5 %]")
+        self.assertEqual(tomatoes.percent, 45.0)
+        self.assertEqual(sugar.percent, 12.5)
+
+    def test_percent_of_a_sub_ingredient_is_not_the_parents(self):
+        [water] = tokenize_ingredients("Ingredients: Water (Aqua, Sugar 5%)")
+        self.assertIsNone(water.percent)
+        self.assertEqual(water.details, 'Aqua, Sugar 5%')
+
+    def test_items_after_may_contain_are_flagged(self):
+        tokens = tokenize_ingredients("Ingredients: Salt; May contain traces of nuts, soy")
+        self.assertEqual([(token.name, token.may_contain) for token in tokens],
+                         [('Salt', False), ('nuts', True), ('soy', True)])
+
+    def test_short_fragments_are_dropped(self):
+        self.assertEqual([token.name for token in tokenize_ingredients("Water, E1, Salt")],
+                         ['Water', 'Salt'])
+
+
+class IdTests(SimpleTestCase):
+    def test_ids_are_version_7_and_sort_by_creation_time(self):
+        with mock.patch('ocr.ids.time.time_ns', side_effect=[1_700_000_000_000_000_000, 1_700_000_000_001_000_000]):
+            first, second = uuid7(), uuid7()
+        self.assertEqual((first.version, first.variant), (7, uuid.RFC_4122))
+        self.assertEqual(first.int >> 80, 1_700_000_000_000)
+        self.assertLess(first, second)
+
+
+class DedupTests(TestCase):
+    def setUp(self):
+        self.original = UploadedImage.objects.create(
+            image='uploads/label.png', working_copy='working/label.webp', thumbnail='thumbnails/label.webp',
+            content_hash='a' * 64,
+        )
+        OCRResult.objects.create(image=self.original, raw_text='Water', processing_time=0.1)
+
+    def test_only_analysed_uploads_of_the_same_bytes_match(self):
+        UploadedImage.objects.create(content_hash='b' * 64)
+        self.assertEqual(find_duplicate('a' * 64), self.original)
+        self.assertIsNone(find_duplicate('b' * 64))
+        self.assertIsNone(find_duplicate(''))
+        self.assertIsNone(find_duplicate('a' * 64, exclude=self.original.pk))
+
+    def test_repeats_share_the_duplicates_files(self):
+        repeat = store_upload(object(), self.original, content_hash='a' * 64)
+        self.assertEqual(
+            (repeat.image.name, repeat.working_copy.name, repeat.thumbnail.name),
+            ('uploads/label.png', 'working/label.webp', 'thumbnails/label.webp'),
+        )
+
+
+class RegionDetectionTests(SimpleTestCase):
+    def layout(self, *blocks):
+        data = {key: [] for key in ('text', 'block_num', 'left', 'top', 'width', 'height')}
+        for block_num, (text, left, top) in enumerate(blocks, 1):
+            for key, value in zip(data, (text, block_num, left, top, 200, 20)):
+                data[key].append(value)
+        return data
+
+    def test_small_images_skip_the_layout_pass(self):
+        engine = mock.Mock()
+        self.assertIsNone(detect_ingredients_region(np.zeros((1500, 1200), np.uint8), engine))
+        engine.recognize_data.assert_not_called()
+
+    def test_panel_is_mapped_back_to_full_resolution(self):
+        engine = mock.Mock()
+        engine.recognize_data.return_value = self.layout(
+            ('Colgate', 100, 50), ('Ingredients:', 100, 300), ('Water,', 100, 330), ('Nutrition', 100, 360),
+        )
+        region = detect_ingredients_region(np.zeros((4000, 3000), np.uint8), engine, margin=0)
+        [(small,), _] = engine.recognize_data.call_args
+        self.assertEqual(small.shape, (1000, 750))
+        self.assertEqual(region, Region(400, 1200, 1200, 1400))
+
+
+def png(width=40, height=30):
+    buffer = io.BytesIO()
+    Image.new('L', (width, height), 255).save(buffer, 'PNG')
+    return buffer.getvalue()
+
+
+class UploadValidationTests(TestCase):
+    def test_header_gives_format_and_dimensions(self):
+        self.assertEqual(read_header(png()), ImageInfo('PNG', 40, 30))
+        self.assertIsNone(read_header(png()[:8]))
+        with self.assertRaisesMessage(UploadRejected, 'Unsupported image type'):
+            read_header(b'%PDF-1.7 not an image')
+        with self.assertRaisesMessage(UploadRejected, 'damaged or incomplete'):
+            read_header(png()[:20], complete=True)
+
+    @override_settings(IMAGE_UPLOADS={'MAX_PIXELS': 1000})
+    def test_header_over_the_pixel_limit_is_rejected(self):
+        with self.assertRaisesMessage(UploadRejected, 'dimensions too large'):
+            read_header(png())
+
+    def stream(self, data, chunk_size=16):
+        request = RequestFactory().post('/api/analyze/')
+        handler = ImageMemoryUploadHandler(request)
+        handler.activated = True
+        with self.assertRaises(StopFutureHandlers):
+            handler.new_file('image', 'label.png', 'image/png', None)
+        for start in range(0, len(data), chunk_size):
+            handler.receive_data_chunk(data[start:start + chunk_size], start)
+        return request, handler.file_complete(len(data))
+
+    def test_handler_hashes_and_reads_the_header_while_streaming(self):
+        _, uploaded = self.stream(png())
+        self.assertEqual(uploaded.image_info, ImageInfo('PNG', 40, 30))
+        self.assertEqual(uploaded.content_hash, hashlib.sha256(png()).hexdigest())
+
+    def test_handler_skips_files_that_are_not_images(self):
+        with self.assertRaises(SkipFile):
+            self.stream(b'#!/bin/sh\necho not an image\n')
+
+    @override_settings(IMAGE_UPLOADS={'MAX_BYTES': 64})
+    def test_handler_stops_reading_past_the_byte_limit(self):
+        with self.assertRaises(SkipFile):
+            self.stream(png())
+
+    def test_rejection_reaches_the_view(self):
+        upload = SimpleUploadedFile('label.png', b'GIF89a not accepted', content_type='image/png')
+        response = self.client.post('/api/analyze/', {'image': upload})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('Unsupported image type', response.json()['error'])
+
+    def test_in_memory_uploads_are_borrowed_and_files_are_mapped(self):
+        encoded = open_encoded(SimpleUploadedFile('label.png', png()))
+        self.assertEqual((encoded.info, encoded.buffered), (ImageInfo('PNG', 40, 30), len(png())))
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'label.png')
+            with open(path, 'wb') as fh:
+                fh.write(png())
+            encoded = open_encoded(path)
+            self.assertEqual((encoded.data.tobytes(), encoded.buffered), (png(), 0))
+
+            open(path, 'wb').close()
+            with self.assertRaisesMessage(UploadRejected, 'empty'):
+                open_encoded(path)
+
+
+class StorageCleanupTests(TestCase):
+    def setUp(self):
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        self.enterContext(override_settings(MEDIA_ROOT=media_root.name))
+        self.now = timezone.now()
+        self.cutoff = self.now - timedelta(days=30)
+
+    def stored(self, name, days_old=0):
+        """A file in storage whose modification time is ``days_old`` days ago"""
+        name = default_storage.save(name, ContentFile(b'image'))
+        stamp = time.time() - days_old * 86400
+        os.utime(default_storage.path(name), (stamp, stamp))
+        return name
+
+    def upload(self, name, days_old, **fields):
+        image = UploadedImage.objects.create(image=name, **fields)
+        UploadedImage.objects.filter(pk=image.pk).update(uploaded_at=self.now - timedelta(days=days_old))
+        return image
+
+    def test_originals_past_the_cutoff_are_removed(self):
+        expired = self.upload(self.stored('uploads/old.png', 40), 40)
+        kept = self.upload(self.stored('uploads/recent.png', 29), 29)
+
+        self.assertEqual(expire_originals(self.cutoff), 1)
+        expired.refresh_from_db()
+        kept.refresh_from_db()
+        self.assertEqual((expired.image.name, kept.image.name), ('', 'uploads/recent.png'))
+        self.assertFalse(default_storage.exists('uploads/old.png'))
+        self.assertTrue(default_storage.exists('uploads/recent.png'))
+
+    def test_originals_shared_with_a_recent_duplicate_are_kept(self):
+        name = self.stored('uploads/label.png', 40)
+        original = self.upload(name, 40)
+        self.upload(name, 1)
+
+        self.assertEqual(expire_originals(self.cutoff), 0)
+        original.refresh_from_db()
+        self.assertEqual(original.image.name, name)
+        self.assertTrue(default_storage.exists(name))
+
+    def test_only_old_failures_without_results_are_deleted(self):
+        failed = UploadedImage.Status.FAILED
+        self.upload('', 40, status=failed)
+        recent = self.upload('', 1, status=failed)
+        analysed = self.upload('', 40, status=failed)
+        OCRResult.objects.create(image=analysed, raw_text='Water', processing_time=0.1)
+        done = self.upload('', 40, status=UploadedImage.Status.DONE)
+
+        self.assertEqual(delete_failed_uploads(self.cutoff), 1)
+        self.assertEqual(set(UploadedImage.objects.values_list('pk', flat=True)), {recent.pk, analysed.pk, done.pk})
+
+    def test_orphans_are_deleted_after_the_grace_period(self):
+        self.stored('working/orphan.webp', 2)
+        self.stored('thumbnails/fresh.webp', 0)
+        self.upload('', 2, working_copy=self.stored('working/label.webp', 2))
+
+        self.assertEqual(delete_orphaned_files(timedelta(hours=24)), 1)
+        self.assertEqual(
+            sorted(default_storage.listdir('working')[1] + default_storage.listdir('thumbnails')[1]),
+            ['fresh.webp', 'label.webp'],
+        )
+
+    def test_dry_run_reports_without_deleting(self):
+        self.upload(self.stored('uploads/old.png', 40), 40)
+        self.upload('', 40, status=UploadedImage.Status.FAILED)
+        self.stored('thumbnails/orphan.webp', 2)
+
+        out = StringIO()
+        call_command('cleanup_uploads', '--dry-run', stdout=out)
+        self.assertIn('Would delete 1 originals, 1 failed uploads, 1 orphaned files', out.getvalue())
+        self.assertEqual(UploadedImage.objects.count(), 2)
+        self.assertEqual(UploadedImage.objects.filter(image='uploads/old.png').count(), 1)
+        self.assertTrue(default_storage.exists('uploads/old.png'))
+        self.assertTrue(default_storage.exists('thumbnails/orphan.webp'))
+
+        call_command('cleanup_uploads', stdout=out)
+        self.assertIn('Deleted 1 originals, 1 failed uploads, 1 orphaned files', out.getvalue())
+        self.assertFalse(default_storage.exists('uploads/old.png'))
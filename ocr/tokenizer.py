@@ -0,0 +1,169 @@
+"""Single-pass tokenizer for ingredient lists.
+
+The ingredients section is located with two precompiled searches (its
+heading, then the first section that follows it), and the section is
+then lexed once, left to right. Separators only split at bracket depth
+zero, so "Flavor (contains (milk))" stays one token with the nested text
+kept as its details. Percentages are parsed into numbers. Items after a
+"may contain" statement are flagged.
+"""
+import re
+from typing import List, NamedTuple, Optional, Tuple
+
+_HEADING = (
+    r'\b(?:ingredients?|ingr[eé]dients|ingredientes|ingredienti|zutaten|'
+    r'ingredi[eë]nten|sk[łl]adniki|composition|inci)\b\s*[:：]?'
+)
+_TERMINATOR = (
+    r'(?:nutrition|allergen|warning|n[äa]hrwert|valeurs? nutritionnelles|'
+    r'informaci[oó]n nutricional|valori nutrizionali|directions)'
+)
+HEADING_RE = re.compile(_HEADING, re.IGNORECASE)
+TERMINATOR_RE = re.compile(_TERMINATOR, re.IGNORECASE)
+# Case-sensitive twins for pre-lowercased text; IGNORECASE alternations
+# are several times slower on long pages
+_HEADING_LOWER_RE = re.compile(_HEADING)
+_TERMINATOR_LOWER_RE = re.compile(_TERMINATOR)
+MAY_CONTAIN_RE = re.compile(
+    r'^(?:may (?:also )?contain(?: traces of)?|peut contenir(?: des traces de)?|'
+    r'kann spuren von|puede contener(?: trazas de)?|pu[oò] contenere(?: tracce di)?)\b[\s:]*',
+    re.IGNORECASE,
+)
+MAY_CONTAIN_SUFFIX_RE = re.compile(r'\s+enthalten$', re.IGNORECASE)
+PERCENT_RE = re.compile(r'(\d+(?:[.,]\d+)?)\s*%')
+
+_BRACKET_RE = re.compile(r'[()\[\]{}]')
+_SEPARATOR_RE = re.compile(r'[,;|\n•·、，；]|\.(?=\s)')
+_PAIRS = {')': '(', ']': '[', '}': '{'}
+_SPACE_RE = re.compile(r'\s+')
+_MAY_CONTAIN_INITIALS = 'mMpPkK'
+_STRIP = ' \t\r.,:;-*'
+
+
+class IngredientToken(NamedTuple):
+    """One ingredient with its span in the source text"""
+    name: str
+    start: int
+    end: int
+    percent: Optional[float] = None
+    details: str = ''
+    may_contain: bool = False
+
+
+def find_section(text: str) -> range:
+    """Span of the ingredients list: after its heading, before the next section.
+
+    Without a heading the whole text is used.
+    """
+    lowered = text.lower()
+    if len(lowered) == len(text):
+        text, heading_re, terminator_re = lowered, _HEADING_LOWER_RE, _TERMINATOR_LOWER_RE
+    else:
+        heading_re, terminator_re = HEADING_RE, TERMINATOR_RE
+
+    heading = heading_re.search(text)
+    if heading is None:
+        return range(0, len(text))
+    terminator = terminator_re.search(text, heading.end())
+    return range(heading.end(), terminator.start() if terminator else len(text))
+
+
+def _bracket_groups(text: str, start: int, end: int) -> List[Tuple[int, int]]:
+    """``(open, close)`` positions of the outermost bracket pairs, in order.
+
+    Brackets without a partner (OCR often drops one side) come back as
+    ``(pos, pos)`` and are treated as plain word breaks.
+    """
+    pairs, unpaired, stack = [], [], []
+    for m in _BRACKET_RE.finditer(text, start, end):
+        pos, char = m.start(), m.group()
+        if char not in _PAIRS:
+            stack.append(pos)
+        elif stack and text[stack[-1]] == _PAIRS[char]:
+            pairs.append((stack.pop(), pos))
+        else:
+            unpaired.append(pos)
+    unpaired.extend(stack)
+
+    # Keep outermost pairs and the unpaired brackets outside them
+    groups, last_close = [], -1
+    for opened, closed in sorted(pairs + [(pos, pos) for pos in unpaired]):
+        if opened > last_close:
+            groups.append((opened, closed))
+            last_close = closed
+    return groups
+
+
+def _clean(text: str) -> str:
+    text = text.strip(_STRIP)
+    if '  ' in text or '\t' in text or '\r' in text or '\n' in text:
+        text = _SPACE_RE.sub(' ', text)
+    return text
+
+
+def tokenize_ingredients(text: str, min_length: int = 3) -> List[IngredientToken]:
+    """Split the ingredients section of a label into structured tokens"""
+    text = text or ''
+    section = find_section(text)
+
+    tokens: List[IngredientToken] = []
+    may_contain = False
+    pieces: List[str] = []
+    details: List[str] = []
+    begin = cursor = section.start
+
+    def flush(end: int) -> None:
+        nonlocal may_contain
+        simple = len(pieces) == 1 and not details
+        raw = pieces[0] if simple else text[begin:end]
+        name = (raw if simple else ' '.join(pieces)).strip(_STRIP)
+        if '  ' in name or '\t' in name or '\r' in name or '\n' in name:
+            name = _SPACE_RE.sub(' ', name)
+        if not name:
+            return
+        prefix = MAY_CONTAIN_RE.match(name) if name[0] in _MAY_CONTAIN_INITIALS else None
+        if prefix:
+            may_contain = True
+            name = _clean(MAY_CONTAIN_SUFFIX_RE.sub('', name[prefix.end():]))
+
+        percent = None
+        if '%' in name:
+            m = PERCENT_RE.search(name)
+            if m:
+                percent = float(m.group(1).replace(',', '.'))
+                name = _clean(name[:m.start()] + name[m.end():])
+        detail = '; '.join(details) if details else ''
+        if percent is None and '%' in detail:
+            # "Tomatoes (45%)": a bracket holding only a percentage is the
+            # token's own; one in nested text belongs to a sub-ingredient
+            for group in details:
+                m = PERCENT_RE.fullmatch(group)
+                if m:
+                    percent = float(m.group(1).replace(',', '.'))
+                    break
+
+        if len(name) >= min_length:
+            tokens.append(IngredientToken(
+                name, begin + len(raw) - len(raw.lstrip(_STRIP)), begin + len(raw.rstrip(_STRIP)),
+                percent, detail, may_contain,
+            ))
+
+    # Bracket groups are sparse: split the text between them at C speed
+    # (every separator is one character, so offsets follow from lengths)
+    for opened, closed in (*_bracket_groups(text, section.start, section.stop),
+                           (section.stop, section.stop)):
+        parts = _SEPARATOR_RE.split(text[cursor:opened])
+        pos = cursor
+        for i, part in enumerate(parts):
+            if i:
+                flush(pos - 1)
+                pieces, details = [], []
+                begin = pos
+            pieces.append(part)
+            pos += len(part) + 1
+        if closed > opened:
+            details.append(_clean(text[opened + 1:closed]))
+        cursor = closed + 1
+
+    flush(section.stop)
+    return tokens
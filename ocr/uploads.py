@@ -0,0 +1,254 @@
+"""Streaming validation and single-read decoding of uploaded images.
+
+The upload handlers check each image while it streams in: the first
+bytes must carry a known image signature, the header's dimensions must
+fit under ``MAX_PIXELS`` and the byte count under ``MAX_BYTES``. A file
+that fails is dropped with ``SkipFile`` (its remaining bytes are
+discarded, never buffered) and the reason is recorded for the view. The
+SHA-256 used for deduplication is computed on the same pass.
+
+Accepted uploads are decoded exactly once with ``cv2.imdecode`` straight
+from their buffer: the in-memory ``BytesIO`` for small files, a
+read-only memory map of the temporary (or stored) file otherwise.
+Very large photos are decoded at a reduced scale.
+"""
+import hashlib
+import io
+import mmap
+import os
+import warnings
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+import cv2
+import numpy as np
+from django.conf import settings
+from django.core.files.uploadhandler import (
+    MemoryFileUploadHandler, SkipFile, TemporaryFileUploadHandler,
+)
+from PIL import Image
+
+DEFAULTS = {
+    'MAX_BYTES': 10 * 1024 * 1024,
+    'MAX_PIXELS': 50_000_000,
+    'FIELDS': ['image', 'images'],
+    'DECODE_MIN_SIDE': 4000,
+}
+# Enough for the size fields of PNG, WebP, BMP and most JPEGs; JPEGs with
+# large EXIF/ICC blocks before their frame header are read further
+HEADER_BYTES = 64 * 1024
+MAX_HEADER_BYTES = 1024 * 1024
+
+SIGNATURES = (
+    (b'\x89PNG\r\n\x1a\n', 'PNG'),
+    (b'\xff\xd8\xff', 'JPEG'),
+    (b'BM', 'BMP'),
+    (b'II*\x00', 'TIFF'),
+    (b'MM\x00*', 'TIFF'),
+)
+_REDUCED_FLAGS = (
+    (8, cv2.IMREAD_REDUCED_GRAYSCALE_8),
+    (4, cv2.IMREAD_REDUCED_GRAYSCALE_4),
+    (2, cv2.IMREAD_REDUCED_GRAYSCALE_2),
+)
+
+
+class UploadRejected(Exception):
+    """Raised for files that are not acceptable images"""
+
+
+class ImageInfo(NamedTuple):
+    """What the header says about an image"""
+    format: str
+    width: int
+    height: int
+
+
+def upload_settings() -> Dict:
+    return {**DEFAULTS, **getattr(settings, 'IMAGE_UPLOADS', {})}
+
+
+def sniff_format(header: bytes) -> Optional[str]:
+    """Image format from the file signature, or None"""
+    if header[:4] == b'RIFF' and header[8:12] == b'WEBP':
+        return 'WEBP'
+    for signature, image_format in SIGNATURES:
+        if header.startswith(signature):
+            return image_format
+    return None
+
+
+def read_header(header: bytes, complete: bool = False) -> Optional[ImageInfo]:
+    """Validate an image header; None while more bytes are needed.
+
+    Raises UploadRejected for unknown formats, unreadable headers (once
+    ``complete`` says no more bytes will come) and images over MAX_PIXELS.
+    """
+    if len(header) < 12 and not complete:
+        return None
+    image_format = sniff_format(header)
+    if image_format is None:
+        raise UploadRejected("Unsupported image type. Use PNG, JPEG, WebP, BMP or TIFF.")
+
+    try:
+        with warnings.catch_warnings():
+            # Pillow only reads the header here; the size check happens below
+            warnings.simplefilter('ignore', Image.DecompressionBombWarning)
+            with Image.open(io.BytesIO(header)) as img:
+                width, height = img.size
+    except Image.DecompressionBombError:
+        raise UploadRejected("Image dimensions too large.")
+    except Exception:
+        if complete:
+            raise UploadRejected("Image header is damaged or incomplete.")
+        return None
+
+    max_pixels = upload_settings()['MAX_PIXELS']
+    if width * height > max_pixels:
+        raise UploadRejected(
+            f"Image dimensions too large. Maximum {max_pixels // 1_000_000} megapixels."
+        )
+    return ImageInfo(image_format, width, height)
+
+
+def rejected_uploads(request) -> Dict[str, List[Tuple[str, str]]]:
+    """``(file_name, reason)`` pairs recorded by the upload handlers, by form field"""
+    return getattr(request, 'rejected_uploads', {})
+
+
+class ImageValidationMixin:
+    """Validates and hashes image fields in whichever handler stores the file"""
+
+    def new_file(self, field_name, file_name, content_type, content_length, charset=None,
+                 content_type_extra=None):
+        options = upload_settings()
+        self.validating = field_name in options['FIELDS']
+        self.max_bytes = options['MAX_BYTES']
+        self.received = 0
+        self.header = bytearray()
+        self.image_info = None
+        self.digest = hashlib.sha256()
+        self.field_name, self.file_name = field_name, file_name
+        if self.validating and content_length and content_length > self.max_bytes:
+            self._reject(self._too_large())
+        super().new_file(field_name, file_name, content_type, content_length, charset,
+                         content_type_extra)
+
+    def _stores_file(self) -> bool:
+        return getattr(self, 'activated', True)
+
+    def _too_large(self) -> str:
+        return f"File too large. Maximum {self.max_bytes // (1024 * 1024)}MB."
+
+    def _reject(self, message: str):
+        rejected = self.request.__dict__.setdefault('rejected_uploads', {})
+        rejected.setdefault(self.field_name, []).append((self.file_name, message))
+        raise SkipFile(message)
+
+    def receive_data_chunk(self, raw_data, start):
+        if self.validating and self._stores_file():
+            self.received += len(raw_data)
+            if self.received > self.max_bytes:
+                self._reject(self._too_large())
+            self.digest.update(raw_data)
+            if self.image_info is None:
+                self.header += raw_data[:MAX_HEADER_BYTES - len(self.header)]
+                try:
+                    self.image_info = read_header(
+                        bytes(self.header), complete=len(self.header) >= MAX_HEADER_BYTES,
+                    )
+                except UploadRejected as e:
+                    self._reject(str(e))
+        return super().receive_data_chunk(raw_data, start)
+
+    def file_complete(self, file_size):
+        uploaded = super().file_complete(file_size)
+        if uploaded is None or not self.validating:
+            return uploaded
+        if self.image_info is None:
+            # Too late to skip the file here; open_encoded() rejects it instead
+            try:
+                self.image_info = read_header(bytes(self.header), complete=True)
+            except UploadRejected:
+                pass
+        uploaded.image_info = self.image_info
+        uploaded.content_hash = self.digest.hexdigest()
+        self.header = bytearray()
+        return uploaded
+
+
+class ImageMemoryUploadHandler(ImageValidationMixin, MemoryFileUploadHandler):
+    """MemoryFileUploadHandler that validates image fields as they arrive"""
+
+
+class ImageTemporaryUploadHandler(ImageValidationMixin, TemporaryFileUploadHandler):
+    """TemporaryFileUploadHandler that validates image fields as they arrive"""
+
+
+class EncodedImage(NamedTuple):
+    """An image's undecoded bytes as a zero-copy uint8 array"""
+    data: np.ndarray
+    info: Optional[ImageInfo]
+    # Bytes held on the heap for this image (0 for memory-mapped files)
+    buffered: int
+
+
+def _map_file(path: str) -> np.ndarray:
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            raise UploadRejected("Image file is empty.")
+        # The mapping stays valid after the file is closed, moved or unlinked
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    return np.frombuffer(mapped, dtype=np.uint8)
+
+
+def open_encoded(source) -> EncodedImage:
+    """Borrow the bytes of an upload, stored file or path without copying them.
+
+    In-memory uploads expose their BytesIO buffer; temporary uploads and
+    files on disk are memory-mapped, so the page cache is the only copy.
+    The header is validated unless the upload handler already did so.
+    """
+    buffered = 0
+    raw = getattr(source, 'file', source)
+    if isinstance(source, (str, os.PathLike)):
+        data = _map_file(source)
+    elif hasattr(source, 'temporary_file_path'):
+        data = _map_file(source.temporary_file_path())
+    elif isinstance(raw, io.BytesIO):
+        data = np.frombuffer(raw.getbuffer(), dtype=np.uint8)
+        buffered = data.nbytes
+    elif getattr(source, 'path', None):
+        data = _map_file(source.path)
+    else:
+        raw.seek(0)
+        data = np.frombuffer(raw.read(), dtype=np.uint8)
+        raw.seek(0)
+        buffered = data.nbytes
+    if not data.size:
+        raise UploadRejected("Image file is empty.")
+
+    info = getattr(source, 'image_info', None)
+    if info is None:
+        info = read_header(data[:HEADER_BYTES].tobytes())
+        if info is None:
+            info = read_header(data[:MAX_HEADER_BYTES].tobytes(), complete=True)
+    return EncodedImage(data, info, buffered)
+
+
+def reduction_flag(info: Optional[ImageInfo], min_side: int) -> int:
+    """Largest IMREAD_REDUCED_GRAYSCALE_* scale that keeps the long side >= min_side"""
+    if info is not None and min_side:
+        long_side = max(info.width, info.height)
+        for factor, flag in _REDUCED_FLAGS:
+            if long_side // factor >= min_side:
+                return flag
+    return cv2.IMREAD_GRAYSCALE
+
+
+def decode_image(encoded: EncodedImage) -> np.ndarray:
+    """Decode once, straight to grayscale (the only thing OCR reads)"""
+    flag = reduction_flag(encoded.info, upload_settings()['DECODE_MIN_SIDE'])
+    image = cv2.imdecode(encoded.data, flag)
+    if image is None:
+        raise UploadRejected("Image data could not be decoded.")
+    return image
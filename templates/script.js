@@ -16,3 +16,120 @@ document.querySelectorAll('.nav-links a').forEach(anchor => {
     target.scrollIntoView({ behavior: 'smooth' });
   });
 });
+
+// Analyze an uploaded image, rendering each stage as the server streams it
+const STAGE_TITLES = {
+  ocr: "Extracted Text",
+  ingredients: "Ingredients",
+  unsafe: "Unsafe Ingredients",
+  brand: "Brand",
+  category: "Category",
+  definitions: "Unsafe Ingredients",
+};
+
+async function streamAnalysis(file, conditions, onEvent) {
+  const form = new FormData();
+  form.append("image", file);
+  conditions.forEach(condition => form.append("conditions[]", condition));
+
+  const response = await fetch("/api/analyze/stream/", { method: "POST", body: form });
+  if (!response.ok) {
+    const body = await response.json().catch(() => ({}));
+    throw new Error(body.error || `Request failed (${response.status})`);
+  }
+
+  // One JSON object per line; a chunk may end mid-line
+  const reader = response.body.getReader();
+  const decoder = new TextDecoder();
+  let buffered = "";
+  for (;;) {
+    const { value, done } = await reader.read();
+    buffered += decoder.decode(value || new Uint8Array(), { stream: !done });
+    const lines = buffered.split("\n");
+    buffered = lines.pop();
+    lines.filter(line => line.trim()).forEach(line => onEvent(JSON.parse(line)));
+    if (done) break;
+  }
+}
+
+function describeStage(event) {
+  switch (event.stage) {
+    case "ocr":
+      return event.extracted_text || "No text detected";
+    case "ingredients":
+      return event.ingredients.join(", ") || "None found";
+    case "unsafe":
+    case "definitions":
+      return event.unsafe_ingredients.map(item =>
+        `${item.ingredient} (${item.safety}): ${item.effect}` +
+        (item.definition ? `\n  ${item.definition}` : "")
+      ).join("\n") || "None found";
+    case "brand":
+      return event.identified_brand.name
+        ? `${event.identified_brand.name} – ${event.identified_brand.product_name}`
+        : "Unknown";
+    case "category":
+      return event.product_category;
+    default:
+      return "";
+  }
+}
+
+function renderStage(container, event) {
+  // Definitions replace the plain unsafe list once they arrive
+  const key = event.stage === "definitions" ? "unsafe" : event.stage;
+  let block = container.querySelector(`[data-stage="${key}"]`);
+  if (!block) {
+    block = document.createElement("div");
+    block.className = "result-stage";
+    block.dataset.stage = key;
+    block.append(document.createElement("h4"), document.createElement("p"));
+    container.append(block);
+  }
+  block.querySelector("h4").textContent = STAGE_TITLES[event.stage];
+  block.querySelector("p").textContent = describeStage(event);
+}
+
+const uploadCard = document.querySelector(".upload-card");
+const imageInput = document.getElementById("image-input");
+const resultsSection = document.getElementById("results");
+const resultStatus = document.getElementById("result-status");
+const resultStages = document.getElementById("result-stages");
+
+function analyzeFile(file) {
+  resultsSection.hidden = false;
+  resultStages.replaceChildren();
+  resultStatus.textContent = "Reading label…";
+
+  streamAnalysis(file, [], event => {
+    if (event.stage === "error") {
+      resultStatus.textContent = event.error;
+    } else if (event.stage === "complete") {
+      resultStatus.textContent = "Analysis complete.";
+      // A cached analysis arrives in one piece
+      if (!resultStages.children.length) {
+        ["ocr", "ingredients", "brand", "category", "definitions"].forEach(stage =>
+          renderStage(resultStages, { ...event, stage })
+        );
+      }
+    } else {
+      if (event.stage === "ocr") resultStatus.textContent = "Analyzing…";
+      if (event.stage === "unsafe") resultStatus.textContent = "Looking up definitions…";
+      renderStage(resultStages, event);
+    }
+  }).catch(error => {
+    resultStatus.textContent = error.message;
+  });
+}
+
+if (uploadCard && imageInput) {
+  uploadCard.addEventListener("click", () => imageInput.click());
+  imageInput.addEventListener("change", () => {
+    if (imageInput.files.length) analyzeFile(imageInput.files[0]);
+  });
+  uploadCard.addEventListener("dragover", e => e.preventDefault());
+  uploadCard.addEventListener("drop", e => {
+    e.preventDefault();
+    if (e.dataTransfer.files.length) analyzeFile(e.dataTransfer.files[0]);
+  });
+}